@@ -0,0 +1,3 @@
+"""Benchmarks. Run the benchmark suite with `python -m mdtools.bench` (see `suite`), or a
+single benchmark module with `python -m mdtools.bench.<module>`.
+"""
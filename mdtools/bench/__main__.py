@@ -0,0 +1,5 @@
+"""Runs the benchmark suite (see `suite`)."""
+
+from mdtools.bench.suite import main
+
+main()
@@ -0,0 +1,107 @@
+"""Micro-benchmark of fuzzy matching: the bounded edit distance against the full-matrix
+NumPy implementation it replaced, and the q-gram index against a scan of all candidates.
+
+Usage: python -m mdtools.bench.fuzzy [number of candidates]
+"""
+
+
+import random
+import string
+import sys
+import timeit
+
+import numpy as np  # type: ignore
+
+from mdtools.issues.fix import fuzzy
+
+
+def levenshtein_numpy(seq1, seq2):
+    """The original implementation, for reference."""
+
+    size_x = len(seq1) + 1
+    size_y = len(seq2) + 1
+    matrix = np.zeros ((size_x, size_y))
+    for x in range(size_x):
+        matrix [x, 0] = x
+    for y in range(size_y):
+        matrix [0, y] = y
+
+    for x in range(1, size_x):
+        for y in range(1, size_y):
+            if seq1[x-1] == seq2[y-1]:
+                matrix [x,y] = min(
+                    matrix[x-1, y] + 1,
+                    matrix[x-1, y-1],
+                    matrix[x, y-1] + 1
+                )
+            else:
+                matrix [x,y] = min(
+                    matrix[x-1,y] + 1,
+                    matrix[x-1,y-1] + 1,
+                    matrix[x,y-1] + 1
+                )
+    return (matrix[size_x - 1, size_y - 1])
+
+
+def best_match_numpy(what, list_):
+    """The original `best_match`, using `levenshtein_numpy`."""
+    pwhat = fuzzy.normalize(what)
+    min_ = float('inf')
+    sugg = None
+    for i in list_:
+        lev = levenshtein_numpy(pwhat, fuzzy.normalize(i))
+        if min_ > lev:
+            min_ = lev
+            sugg = i
+    return sugg, min_
+
+
+def make_names(count: int, rnd: random.Random):
+    """Random file-name-like strings."""
+    alphabet = string.ascii_lowercase + '-_'
+    return ['{}.md'.format(''.join(rnd.choice(alphabet) for _ in range(rnd.randint(4, 20))))
+            for _ in range(count)]
+
+
+def misspell(name: str, rnd: random.Random) -> str:
+    """Apply one or two random edits to `name`."""
+    for _ in range(rnd.randint(1, 2)):
+        pos = rnd.randrange(len(name))
+        name = name[:pos] + rnd.choice(string.ascii_lowercase) + name[pos + 1:]
+    return name
+
+
+def main():
+    """Benchmark entry point."""
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rnd = random.Random(1)
+    names = make_names(count, rnd)
+    queries = [misspell(rnd.choice(names), rnd) for _ in range(5)]
+    per = 1000 / len(queries)
+    print("{} candidates, {} queries (ms per query):".format(count, len(queries)))
+
+    # The reference implementations are too slow for large candidate sets.
+    if count <= 20000:
+        for query in queries:
+            old = best_match_numpy(query, names)
+            new = fuzzy.best_match(query, names, 3)
+            assert old[1] > 3 and new[0] is None or old == new, (query, old, new)
+        t_old = timeit.timeit(lambda: [best_match_numpy(q, names) for q in queries], number=1)
+        t_unb = timeit.timeit(lambda: [fuzzy.best_match(q, names) for q in queries], number=1)
+        print("  numpy, full matrix:  {:9.2f}".format(t_old * per))
+        print("  lists, unbounded:    {:9.2f}".format(t_unb * per))
+
+    t_new = timeit.timeit(lambda: [fuzzy.best_match(q, names, 3) for q in queries], number=1)
+    print("  bounded (k=3):       {:9.2f}".format(t_new * per))
+
+    t_build = timeit.timeit(lambda: fuzzy.FuzzyIndex(names), number=1)
+    index = fuzzy.FuzzyIndex(names)
+    assert all(index.nearest(q, 3) == fuzzy.best_match(q, names, 3) for q in queries)
+    t_index = timeit.timeit(lambda: [index.nearest(q, 3) for q in queries], number=1)
+    print("  index (k=3):         {:9.2f}  (built in {:.0f} ms)".format(
+        t_index * per, t_build * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Memory benchmark: the size of the model of a synthetic markdown tree.
+
+Usage: python -m mdtools.bench.memory [number of files] [engine]
+
+Reports the growth of the resident set size while the tree is read (which is what the
+model retains, plus allocator slack), and the peak resident set size of the process.
+"""
+
+
+import gc
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+
+
+def rss() -> int:
+    """Current resident set size of this process, in bytes (Linux only)."""
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def make_document(rnd: random.Random, names: list) -> str:
+    """A random document: headings, paragraphs and links to other files of the tree."""
+    parts = []
+    for section in range(rnd.randint(2, 5)):
+        parts.append("## Section {} {}\n".format(section, rnd.randrange(1000)))
+        for _ in range(rnd.randint(1, 3)):
+            links = ["[link {}]({}#section-{})".format(i, rnd.choice(names), rnd.randrange(5))
+                     for i in range(rnd.randint(1, 4))]
+            parts.append("Some *text* with " + ", ".join(links) + " and more text.\n")
+    return "\n".join(parts)
+
+
+def make_tree(base: Path, count: int, rnd: random.Random) -> None:
+    """Write `count` random markdown files, 100 per directory."""
+    names = ["../d{}/f{}.md".format(i // 100, i % 100) for i in range(count)]
+    for i in range(count):
+        dir_ = base.joinpath("d{}".format(i // 100))
+        dir_.mkdir(exist_ok=True)
+        dir_.joinpath("f{}.md".format(i % 100)).write_text(make_document(rnd, names))
+
+
+def main():
+    """Benchmark entry point."""
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    engine = sys.argv[2] if len(sys.argv) > 2 else 'marko'
+    with tempfile.TemporaryDirectory() as base:
+        make_tree(Path(base), count, random.Random(1))
+        gc.collect()
+        before = rss()
+        start = time.monotonic()
+        tree = Tree(Path(base).resolve())
+        read_md_tree(tree, 1, None, engine)
+        elapsed = time.monotonic() - start
+        gc.collect()
+        after = rss()
+        links = sum(len(f.links) for f in tree.files.values())
+
+    mib = 1024 * 1024
+    print("{} files, {} links, engine {}, read in {:.1f} s".format(
+        count, links, engine, elapsed))
+    print("  model (RSS growth): {:8.1f} MiB".format((after - before) / mib))
+    print("  peak RSS:           {:8.1f} MiB".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / mib))
+
+
+if __name__ == "__main__":
+    main()
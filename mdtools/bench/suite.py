@@ -0,0 +1,221 @@
+"""Benchmark suite: times the stages of a link check on a synthetic tree (see `synth`), and
+compares the times with a baseline.
+
+Usage: python -m mdtools.bench [options]
+
+Options:
+    Any option of `python -m mdtools.bench.synth`, to set up the tree (e.g. --files=100000).
+    -r N, --repeat=N: Time the read and analyze stages N times, and keep the best
+        (default: 3).
+    -j N, --jobs=N: Parse markdown files in N processes (default: 1).
+    --engine=NAME: Extraction engine, marko or scan (default: scan).
+    --tmp=DIR: Where to generate the tree (default: the system's temporary directory).
+    -o FILE, --output=FILE: Write the results to FILE, as JSON.
+    -b FILE, --baseline=FILE: Compare the results with FILE, written by an earlier run with
+        -o. Exit with status 1 if a stage got slower by more than the tolerance.
+    --tolerance=X: Allowed slowdown, as a fraction (default: 0.2).
+
+Stages:
+    read:     `read_md_tree`: walk the tree, parse the files and build the model.
+    analyze:  `analyze`: check all links.
+    suggest:  Find a fuzzy match for the target of each broken link (as `-i -f` does).
+    patch:    Fix the broken links automatically, and write the files (as `-a` does).
+
+Example: save a baseline on the main branch, then check a change against it.
+    python -m mdtools.bench --files=20000 -o baseline.json
+    python -m mdtools.bench --files=20000 -b baseline.json
+"""
+
+
+import contextlib
+import dataclasses
+import getopt
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Tuple
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze, issues
+from mdtools.issues.fix import fix_all
+from mdtools.issues.fix.link_issues import fuzzy_index
+from mdtools.issues.fix.options import Options
+from mdtools.bench import synth
+from mdtools.bench.synth import SynthOptions
+
+
+# Version of the layout of the results.
+RESULTS_VERSION = 1
+
+# Differences in time below this (in seconds) are noise, and never a regression.
+NOISE = 0.05
+
+
+@dataclasses.dataclass
+class SuiteOptions:
+    """Benchmark suite options, parsed from command line arguments."""
+
+    synth:      SynthOptions = dataclasses.field(default_factory=SynthOptions)
+    repeat:     int   = 3
+    jobs:       int   = 1
+    engine:     str   = 'scan'
+    tmp:        str   = ''
+    output:     str   = ''
+    baseline:   str   = ''
+    tolerance:  float = 0.2
+
+
+def __best(repeat: int, run: Callable[[], Any]) -> Tuple[float, Any]:
+    """Run `run` `repeat` times; return the best time, and the result of the last run."""
+    best = float('inf')
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def __suggest(tree: Tree, found: List[issues.Issue]) -> int:
+    """Look for a fuzzy match of each broken link, as the interactive fix does. Return the
+    number of links with a suggestion.
+    """
+
+    suggested = 0
+    for issue in found:
+        if isinstance(issue, issues.TargetNotFound):
+            match, _ = fuzzy_index(tree, 'names').nearest(Path(issue.link.get_href()).name, 3)
+        elif isinstance(issue, issues.AnchorNotFound):
+            match, _ = fuzzy_index(tree, 'all_anchors').nearest(issue.link.get_anchor(), 4)
+        else:
+            continue
+        suggested += match is not None
+    return suggested
+
+
+def run(base: Path, opt: SuiteOptions) -> Dict[str, Any]:
+    """Run the stages on the tree at `base`. Return the times (in seconds) and counts."""
+
+    def read():
+        tree = Tree(str(base))
+        read_md_tree(tree, opt.jobs, None, opt.engine)
+        return tree
+
+    times = {}
+    counts = {}
+    times['read'], tree = __best(opt.repeat, read)
+    times['analyze'], found = __best(opt.repeat, lambda: analyze(tree))
+    # Timed once: the first run builds the fuzzy matching indexes, which are then cached.
+    times['suggest'], counts['suggested'] = __best(1, lambda: __suggest(tree, found))
+    with contextlib.redirect_stdout(io.StringIO()):
+        times['patch'], _ = __best(1, lambda: fix_all(found, tree, Options(mode='-a')))
+
+    counts['files'] = len(tree.files)
+    counts['links'] = sum(len(f.links) for f in tree.files.values())
+    counts['issues'] = len(found)
+    counts['fixed'] = len(found) - len(analyze(tree))
+    return {'times': times, 'counts': counts}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print the times of `results` next to those of `baseline`. Return the names of the
+    stages which got slower by more than `tolerance` (a fraction).
+    """
+
+    if results['params'] != baseline.get('params'):
+        print("Warning: the baseline was run with different parameters: " +
+              json.dumps(baseline.get('params')))
+
+    slower = []
+    print("{:10}{:>12}{:>12}{:>10}".format('stage', 'baseline', 'current', 'change'))
+    for stage, current in results['times'].items():
+        base = baseline.get('times', {}).get(stage)
+        if base is None:
+            print("{:10}{:>12}{:>12.3f}".format(stage, '-', current))
+            continue
+        change = (current - base) / base if base else 0.0
+        mark = ''
+        if change > tolerance and current - base > NOISE:
+            slower.append(stage)
+            mark = '  SLOWER'
+        print("{:10}{:>12.3f}{:>12.3f}{:>+9.1%}{}".format(stage, base, current, change, mark))
+    return slower
+
+
+def parse_args(argv: List[str]) -> SuiteOptions:
+    """Parse the command line arguments (without the program name)."""
+
+    opt = SuiteOptions()
+    opts, args = getopt.getopt(argv, 'hr:j:o:b:',
+                               ['help', 'repeat=', 'jobs=', 'engine=', 'tmp=', 'output=',
+                                'baseline=', 'tolerance='] + synth.long_options())
+    if args:
+        raise getopt.GetoptError('unexpected argument: ' + args[0])
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        elif o in ('-r', '--repeat'): opt.repeat = int(a)
+        elif o in ('-j', '--jobs'): opt.jobs = int(a)
+        elif o == '--engine': opt.engine = a
+        elif o == '--tmp': opt.tmp = a
+        elif o in ('-o', '--output'): opt.output = a
+        elif o in ('-b', '--baseline'): opt.baseline = a
+        elif o == '--tolerance': opt.tolerance = float(a)
+        else: synth.set_option(opt.synth, o, a)
+    return opt
+
+
+def main():
+    """Benchmark suite entry point."""
+
+    # pylint: disable=multiple-statements
+
+    try:
+        opt = parse_args(sys.argv[1:])
+    except (getopt.GetoptError, ValueError) as err:
+        print(err)
+        print(__doc__)
+        sys.exit(2)
+
+    with tempfile.TemporaryDirectory(dir=opt.tmp or None) as tmp:
+        base = Path(tmp).resolve()
+        start = time.perf_counter()
+        generated = synth.generate(base, opt.synth)
+        print("Generated {} files with {} links in {:.1f} s".format(
+            generated['files'], generated['links'], time.perf_counter() - start))
+        results = run(base, opt)
+
+    results = {
+        'version':  RESULTS_VERSION,
+        'python':   platform.python_version(),
+        'machine':  platform.machine(),
+        'params':   {'synth': dataclasses.asdict(opt.synth), 'engine': opt.engine,
+                     'jobs': opt.jobs, 'repeat': opt.repeat},
+        **results,
+    }
+
+    if opt.output:
+        with open(opt.output, 'w', encoding='utf-8') as out:
+            json.dump(results, out, indent=2)
+            out.write('\n')
+
+    if opt.baseline:
+        with open(opt.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        slower = compare(results, baseline, opt.tolerance)
+        if slower:
+            print("Slower than the baseline: " + ", ".join(slower))
+            sys.exit(1)
+    else:
+        for stage, seconds in results['times'].items():
+            print("{:10}{:>10.3f} s".format(stage, seconds))
+    print(', '.join('{} {}'.format(v, k) for k, v in results['counts'].items()))
+
+
+if __name__ == "__main__":
+    main()
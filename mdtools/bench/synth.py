@@ -0,0 +1,241 @@
+"""Generator of synthetic markdown trees, for benchmarks.
+
+Usage: python -m mdtools.bench.synth [options] <directory>
+
+Options (see `SynthOptions`):
+    --files=N: Number of markdown files (default: 1000).
+    --depth=N: Depth of the directory tree (default: 3).
+    --per-dir=N: Markdown files per directory (default: 50).
+    --links=N: Links per page (default: 8).
+    --anchors=N: Anchors per page, half of them headings (default: 4).
+    --broken=X: Fraction of broken links (default: 0.05).
+    --near-miss=X: Fraction of the broken links which are near misses (default: 0.5).
+    --seed=N: Random seed (default: 1).
+
+The tree only depends on the options: the same options always produce the same bytes.
+Each page is generated from its own random stream, so the names and anchors of any page
+are known without generating the whole tree, and memory use does not grow with its size.
+
+Broken links are of two kinds:
+- Near misses: a typo in the file name (fuzzy matching suggests the right file), or in the
+  anchor (fuzzy matching suggests the right anchor).
+- Moved targets: the file name is right, but the directory is not. Automatic fixing (-a)
+  fixes these, as all file names are unique.
+"""
+
+
+import dataclasses
+import getopt
+import random
+import string
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+from mdtools.model.anchor import Anchor
+
+
+@dataclass
+class SynthOptions:
+    """Parameters of a synthetic markdown tree."""
+
+    files:      int   = 1000
+    depth:      int   = 3
+    per_dir:    int   = 50
+    links:      int   = 8
+    anchors:    int   = 4
+    broken:     float = 0.05
+    near_miss:  float = 0.5
+    seed:       int   = 1
+
+
+class Page(NamedTuple):
+    """What is known about a page of the tree without generating its content."""
+
+    dir:        str             # Directory, relative to the base, '/'-separated ('' for base)
+    name:       str             # File name
+    headings:   List[str]       # Texts of the headings
+    anchors:    List[str]       # Names of all anchors (of the headings too)
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ba', 'de', 'fu', 'go',
+             'hi', 'ja', 'po', 'ze', 'qua', 'ster', 'lin', 'dor', 'mar', 'tek']
+
+
+def __word(rnd: random.Random) -> str:
+    return ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+
+def __rnd(opts: SynthOptions, index: int, stream: int) -> random.Random:
+    """The random stream `stream` of the page `index`."""
+    return random.Random(((opts.seed * 1000003 + index) << 2) + stream)
+
+
+def dir_of(opts: SynthOptions, index: int) -> str:
+    """Directory of the page `index`: pages are put `per_dir` to a directory, and the
+    directories are spread evenly over a tree of `depth` levels.
+    """
+
+    if opts.depth <= 0:
+        return ''
+    dirs = -(-opts.files // opts.per_dir)
+    fanout = 2
+    while fanout ** opts.depth < dirs:
+        fanout += 1
+    number = index // opts.per_dir
+    parts = []
+    for level in reversed(range(opts.depth)):
+        parts.append('sect-{}'.format(number // fanout ** level % fanout))
+    return '/'.join(parts)
+
+
+def page(opts: SynthOptions, index: int) -> Page:
+    """The name, directory and anchors of the page `index`."""
+
+    rnd = __rnd(opts, index, 0)
+    name = '{}-{}.md'.format(__word(rnd), index)
+    headings = []
+    anchors = []
+    for number in range(opts.anchors):
+        if number % 2 == 0:
+            heading = '{} {} {}'.format(__word(rnd).capitalize(), __word(rnd), number)
+            headings.append(heading)
+            anchors.append(Anchor.heading_to_anchor(heading))
+        else:
+            anchors.append('{}-{}'.format(__word(rnd), number))
+    return Page(dir_of(opts, index), name, headings, anchors)
+
+
+def __typo(rnd: random.Random, text: str) -> str:
+    """`text` with one of its letters replaced."""
+    letters = [i for i, c in enumerate(text) if c in string.ascii_lowercase]
+    i = rnd.choice(letters)
+    return text[:i] + rnd.choice(string.ascii_lowercase.replace(text[i], '')) + text[i+1:]
+
+
+def __href(from_dir: str, to: Page) -> str:
+    """Relative href from a page in `from_dir` to the page `to`."""
+    src = from_dir.split('/') if from_dir else []
+    dst = to.dir.split('/') if to.dir else []
+    common = 0
+    while common < min(len(src), len(dst)) and src[common] == dst[common]:
+        common += 1
+    return '/'.join(['..'] * (len(src) - common) + dst[common:] + [to.name])
+
+
+def document(opts: SynthOptions, index: int, counts: Dict[str, int]) -> str:
+    """The markdown text of the page `index`. Adds the number of links of each kind to
+    `counts`.
+    """
+
+    this = page(opts, index)
+    rnd = __rnd(opts, index, 1)
+    lines = ['# ' + this.name[:-3].replace('-', ' ').capitalize(), '']
+
+    links = []
+    for _ in range(opts.links):
+        target = page(opts, rnd.randrange(opts.files))
+        anchor = rnd.choice(target.anchors) if target.anchors and rnd.random() < 0.5 else ''
+        href = __href(this.dir, target)
+        if rnd.random() < opts.broken:
+            if rnd.random() < opts.near_miss:
+                if anchor and rnd.random() < 0.5:
+                    anchor = __typo(rnd, anchor)
+                    counts['broken_anchor'] += 1
+                else:
+                    href = href[:-len(target.name)] + __typo(rnd, target.name[:-3]) + '.md'
+                    counts['broken_name'] += 1
+            else:
+                moved = (target.dir + '/' if target.dir else '') + 'moved'
+                href = __href(this.dir, target._replace(dir=moved))
+                counts['broken_moved'] += 1
+        counts['links'] += 1
+        links.append('[{}]({})'.format(__word(rnd), href + ('#' + anchor if anchor else '')))
+
+    headings = iter(this.headings)
+    for number, anchor in enumerate(this.anchors):
+        if number % 2 == 0:
+            lines += ['## ' + next(headings), '']
+        else:
+            lines += ['<a name="{}"></a>'.format(anchor), '']
+        # Spread the links over the sections
+        share = links[:max(1, len(links) // max(1, len(this.anchors) - number))]
+        del links[:len(share)]
+        lines += [' '.join(__word(rnd) for _ in range(rnd.randint(3, 12))) + ' ' +
+                  ', '.join(share) + '.', '']
+    if links:
+        lines += ['See also ' + ', '.join(links) + '.', '']
+    return '\n'.join(lines)
+
+
+def generate(base: Path, opts: SynthOptions) -> Dict[str, int]:
+    """Write the synthetic tree to the directory `base`. Return the number of files,
+    directories and links (of each kind).
+    """
+
+    counts = dict.fromkeys(['files', 'dirs', 'links', 'broken_name', 'broken_anchor',
+                            'broken_moved'], 0)
+    made = set()
+    for index in range(opts.files):
+        this = page(opts, index)
+        dir_ = base.joinpath(this.dir)
+        if this.dir not in made:
+            dir_.mkdir(parents=True, exist_ok=True)
+            made.add(this.dir)
+        with open(dir_.joinpath(this.name), 'w', encoding='utf-8', newline='\n') as file:
+            file.write(document(opts, index, counts))
+        counts['files'] += 1
+    counts['dirs'] = len({p for d in made for p in __parents(d)})
+    return counts
+
+
+def __parents(dir_: str) -> List[str]:
+    parts = dir_.split('/') if dir_ else []
+    return ['/'.join(parts[:n]) for n in range(1, len(parts) + 1)]
+
+
+def long_options() -> List[str]:
+    """The getopt long options setting the fields of `SynthOptions`."""
+    return [f.name.replace('_', '-') + '=' for f in dataclasses.fields(SynthOptions)]
+
+
+def set_option(opts: SynthOptions, option: str, value: str) -> bool:
+    """Set the field of `opts` named by the getopt `option` (e.g. '--per-dir') to `value`.
+    Return False if there is no such field.
+    """
+
+    name = option.lstrip('-').replace('-', '_')
+    for field in dataclasses.fields(SynthOptions):
+        if field.name == name:
+            setattr(opts, name, type(getattr(opts, name))(value))
+            return True
+    return False
+
+
+def main():
+    """Generator entry point."""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['help'] + long_options())
+    except getopt.GetoptError as err:
+        print(err)
+        print(__doc__)
+        sys.exit(2)
+
+    synth = SynthOptions()
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        set_option(synth, o, a)
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(2)
+
+    counts = generate(Path(args[0]), synth)
+    print(', '.join('{} {}'.format(v, k.replace('_', ' ')) for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
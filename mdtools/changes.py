@@ -0,0 +1,92 @@
+"""Changed-files mode: finds the files changed since a git revision, and the links these
+changes could have broken, so that only these links are checked (e.g. in a pre-commit hook,
+or for a pull request).
+
+The links affected by the changes are:
+- the links in the files added or modified (including the new paths of renamed files, and
+  the files git does not track yet);
+- the links in other files pointing at files deleted, renamed or modified (as the anchors
+  of a modified file may have changed).
+
+The whole tree is still read, so that the links can be resolved: the files which did not
+change are usually in the parse cache, so they are not parsed again.
+"""
+
+
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, NamedTuple
+
+from mdtools.model.tree import Tree, Link
+
+
+class Changes(NamedTuple):
+    """Files changed since a revision, as resolved paths."""
+
+    # Files added or modified, the new paths of renamed files, and untracked files.
+    modified:   Set[Path]
+
+    # Files deleted, and the old paths of renamed files.
+    deleted:    Set[Path]
+
+
+def __git(root: Path, *args: str) -> str:
+    """Run git in the directory `root`, and return its output. Raise ValueError if it fails."""
+    try:
+        done = subprocess.run(['git', '-C', str(root), *args], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, check=False)
+    except OSError as exc:
+        raise ValueError("cannot run git: " + str(exc)) from exc
+    if done.returncode:
+        raise ValueError(done.stderr.decode('utf-8', 'replace').strip() or
+                         "git " + args[0] + " failed")
+    return done.stdout.decode('utf-8', 'surrogateescape')
+
+
+def changed_since(root: Path, ref: str) -> Changes:
+    """Return the files changed since the revision `ref`, in the git work tree containing
+    `root` (committed, staged or not, and untracked). Raise ValueError if git fails, e.g.
+    because `root` is not in a git work tree, or `ref` is not a revision.
+    """
+
+    top = Path(__git(root, 'rev-parse', '--show-toplevel').strip()).resolve()
+    changes = Changes(set(), set())
+
+    # Entries: a status, and a path (two paths, old and new, for renames and copies)
+    fields = __git(root, 'diff', '--name-status', '-z', '-M', ref, '--').split('\0')
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i][:1]
+        if status in ('R', 'C'):
+            old, new = fields[i + 1], fields[i + 2]
+            if status == 'R':
+                changes.deleted.add(top.joinpath(old))
+            changes.modified.add(top.joinpath(new))
+            i += 3
+            continue
+        (changes.deleted if status == 'D' else changes.modified).add(top.joinpath(fields[i + 1]))
+        i += 2
+
+    untracked = __git(root, 'ls-files', '--others', '--exclude-standard', '--full-name', '-z')
+    changes.modified.update(top.joinpath(path) for path in untracked.split('\0') if path)
+    return changes
+
+
+def affected_links(tree: Tree, changes: Changes) -> List[Tuple[Path, Link]]:
+    """Return the links of the tree that `changes` could affect (see the module docstring),
+    in the order in which a full check finds them, as pairs of the containing file's Path
+    and the Link.
+    """
+
+    # By id, so that each link is checked once
+    links: Dict[int, Tuple[Path, Link]] = {}
+    for path in sorted(changes.modified | changes.deleted):
+        if path in changes.modified and path in tree.files:
+            for link in tree.files[path].links:
+                links[id(link)] = (path, link)
+        for path_link in tree.links_to(path):
+            links[id(path_link[1])] = path_link
+
+    files = {path for path, _ in links.values()}
+    return [(path, link) for path, file in tree.files.items() if path in files
+            for link in file.links if id(link) in links]
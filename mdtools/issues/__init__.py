@@ -2,43 +2,78 @@
 there are facilities for interactive/automatic fixing of the issues.
 """
 
-from typing import List, Optional
+from typing import List, Optional, Iterable, Iterator, Tuple
 from pathlib import Path
 
 from mdtools.issues import issues
 from mdtools.model.tree import Tree, File, Link
-from mdtools import util
+from mdtools import profiling
 
 
-def analyze(md_tree: Tree) -> List[issues.Issue]:
-    """Scan the markdown tree and look for known issues."""
+def check_link(md_tree: Tree, path: Path, link: Link) -> Optional[issues.Issue]:
+    """Check a local link found in the file at `path`. Return the issue found, if any."""
 
-    out = []
+    target: Path = md_tree.resolve(path, link.get_href())
 
-    def check_link(path: Path, link: Link) -> Optional[issues.Issue]:
-        target: Path = util.href_to_path(path, md_tree.base, link.get_href())
+    if not target in md_tree.files:
+        return issues.TargetNotFound(path, link)
 
-        if not target in md_tree.files:
-            return issues.TargetNotFound(path, link)
+    thefile: File = md_tree.files[target]
+    anchor = link.get_anchor()
+    if (anchor
+        and not anchor in thefile.anchors
+        and not anchor in thefile.h_anchors):
+        return issues.AnchorNotFound(path, link)
 
-        thefile: File = md_tree.files[target]
-        anchor = link.get_anchor()
-        if (anchor
-            and not anchor in thefile.anchors
-            and not anchor in thefile.h_anchors):
-            return issues.AnchorNotFound(path, link)
+    return None
 
-        return None
 
-    # Check all links in all files
+def iter_issues(md_tree: Tree,
+                links: Optional[Iterable[Tuple[Path, Link]]] = None,
+                files: Iterable[Path] = ()) -> Iterator[issues.Issue]:
+    """Scan the markdown tree and yield the known issues, as soon as each is found.
+
+    links: if given, only these links (pairs of the containing file's Path and the Link)
+    are checked, rather than all links and anchors in the tree.
+    files: with `links`, the files whose anchors are checked too (e.g. the files which
+    changed). The issues of the anchors of a file come before those of its links, as in a
+    check of the whole tree.
+    """
+
+    if links is None:
+        # Check all anchors and links in all files
+        for file_path, file in md_tree.files.items():
+            yield from iter_issues(md_tree, ((file_path, link) for link in file.links),
+                                   (file_path,))
+        return
+
+    # Files whose anchors are not checked yet
+    pending = dict.fromkeys(files)
     path: Path
-    file: File
-    for path, file in md_tree.files.items():
-        link: Link
-        for link in file.links:
-            if link.is_local():
-                issue = check_link(path, link)
-                if issue:
-                    out.append(issue)
-
-    return out
+    link: Link
+    for path, link in links:
+        if path in pending:
+            del pending[path]
+            yield from __anchor_issues(md_tree, path)
+        if link.is_local():
+            issue = check_link(md_tree, path, link)
+            if issue:
+                yield issue
+    for path in pending:
+        yield from __anchor_issues(md_tree, path)
+
+
+def __anchor_issues(md_tree: Tree, path: Path) -> Iterator[issues.Issue]:
+    """Yield the issues of the anchors of the file at `path`, if it is in the tree."""
+    file = md_tree.files.get(path)
+    for anchor in (file.duplicates if file else None) or ():
+        yield issues.DuplicateAnchor(path, anchor)
+
+
+def analyze(md_tree: Tree,
+            links: Optional[Iterable[Tuple[Path, Link]]] = None,
+            files: Iterable[Path] = ()) -> List[issues.Issue]:
+    """Scan the markdown tree and return all known issues. See `iter_issues`."""
+
+    with profiling.phase('analyze'):
+        return list(iter_issues(md_tree, links, files))
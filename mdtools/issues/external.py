@@ -0,0 +1,358 @@
+"""Checks external (http and https) links: each distinct URL in the tree is requested once,
+concurrently, with asyncio.
+
+- Requests are HEAD requests; if the server answers a HEAD request with an error, the URL
+  is requested again with GET (some servers do not implement HEAD, or answer it
+  differently). Redirects are followed.
+- Connections are pooled per host and kept alive between HEAD requests.
+- The number of requests in progress is limited, overall and per host, and the requests to
+  a host can be spaced to a maximal rate.
+- The definitive results (see `Result.definitive`) are cached on disk for a while (see
+  `UrlCache`), so that repeated runs only request the URLs they have not checked recently.
+  Failures which may be temporary (timeouts, connection errors, 429 or 5xx) are not: a
+  network blip must not make links look broken until the results expire.
+
+Only the standard library is used: the HTTP/1.1 client is a minimal one, which reads the
+status and the headers of the responses, and never the bodies.
+"""
+
+
+import asyncio
+import os
+import sqlite3
+import ssl
+import sys
+import time
+from pathlib import Path
+from typing import List, Dict, Set, Tuple, Iterable, NamedTuple, Optional
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+from mdtools import profiling
+from mdtools.issues import issues
+from mdtools.model.cache import BUSY_TIMEOUT, WRITE_BATCH
+from mdtools.model.tree import Tree, Link
+
+
+# Maximal number of redirects followed.
+MAX_REDIRECTS = 5
+
+# Redirect statuses.
+REDIRECTS = (301, 302, 303, 307, 308)
+
+USER_AGENT = 'mdlinkcheck'
+
+
+def default_path() -> Path:
+    """Default location of the result cache."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base).joinpath('mdtools', 'url-cache.sqlite')
+
+
+def is_external(dest: str) -> bool:
+    """Return True if the link destination `dest` is an http or https URL."""
+    return dest[:8].lower().startswith(('http://', 'https://'))
+
+
+class Result(NamedTuple):
+    """Result of checking a URL."""
+
+    # HTTP status of the final response, or 0 if there was none (e.g. no connection).
+    status: int
+
+    # Reason phrase of the response, or what went wrong.
+    reason: str
+
+    def ok(self) -> bool:
+        """Return True if the URL works."""
+        return 200 <= self.status < 400
+
+    def definitive(self) -> bool:
+        """Return True if checking the URL again soon would most likely give the same
+        result: it works, or the server says it is not there.
+        """
+        return self.ok() or self.status in (404, 410)
+
+
+class UrlCache:
+    """Persistent cache of the results of checking URLs, in an sqlite database. Results are
+    valid for `ttl` seconds.
+
+    Usage: `get` a URL; if that returns None, check it and `put` the result. `close` at the
+    end of the session, to persist the changes.
+
+    As with the parse cache (see `model.cache`), several processes may use the cache at
+    once: the writes are committed in short transactions, and if the database stays
+    locked, the session continues without the cache.
+    """
+
+    path:   Path
+    ttl:    float
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = 24 * 3600) -> None:
+        self.path = Path(path) if path else default_path()
+        self.ttl = ttl
+        # Results not committed yet
+        self.__writes: List[Tuple[str, int, str, float]] = []
+        self.__db: Optional[sqlite3.Connection] = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.__db = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT)
+            self.__db.execute("PRAGMA busy_timeout = {}".format(int(BUSY_TIMEOUT * 1000)))
+            self.__db.execute("PRAGMA journal_mode = WAL")
+            self.__db.execute("""CREATE TABLE IF NOT EXISTS urls (
+                                     url TEXT PRIMARY KEY, status INTEGER, reason TEXT,
+                                     checked REAL)""")
+            self.__db.commit()
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+
+    def __disable(self, exc: sqlite3.Error) -> None:
+        """Continue the session without the cache, because of `exc`."""
+        print("URL cache " + str(self.path) + " unavailable (" + str(exc) +
+              "); continuing without it", file=sys.stderr)
+        if self.__db is not None:
+            self.__db.close()
+        self.__db = None
+        self.__writes.clear()
+
+    def get(self, url: str) -> Optional[Result]:
+        """Return the result of checking `url`, if checked less than `ttl` seconds ago."""
+        if self.__db is None:
+            return None
+        try:
+            row = self.__db.execute("SELECT status, reason, checked FROM urls WHERE url = ?",
+                                    (url,)).fetchone()
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+            return None
+        if row and time.time() - row[2] < self.ttl:
+            return Result(row[0], row[1])
+        return None
+
+    def put(self, url: str, result: Result) -> None:
+        """Store the result of checking `url`."""
+        if self.__db is None:
+            return
+        self.__writes.append((url, result.status, result.reason, time.time()))
+        if len(self.__writes) >= WRITE_BATCH:
+            self.__flush()
+
+    def __flush(self) -> None:
+        """Commit the buffered results, in one transaction."""
+        if self.__db is None or not self.__writes:
+            return
+        try:
+            with self.__db:
+                self.__db.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                                      self.__writes)
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+        self.__writes.clear()
+
+    def close(self) -> None:
+        """Persist the changes made during this session, drop the expired results, and
+        release the database.
+        """
+        self.__flush()
+        if self.__db is None:
+            return
+        try:
+            with self.__db:
+                self.__db.execute("DELETE FROM urls WHERE checked < ?",
+                                  (time.time() - self.ttl,))
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+            return
+        self.__db.close()
+        self.__db = None
+
+
+class _Host:
+    """Idle connections and limits of one host (scheme, host name and port)."""
+
+    def __init__(self, per_host: int, rate: float) -> None:
+        self.idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.slots = asyncio.Semaphore(per_host)
+        self.interval = 1 / rate if rate > 0 else 0.0
+        # Time (of the event loop) when the next request may start
+        self.next = 0.0
+
+    async def pace(self) -> None:
+        """Wait until the rate allows another request to the host."""
+        if self.interval:
+            now = asyncio.get_event_loop().time()
+            start = max(now, self.next)
+            self.next = start + self.interval
+            if start > now:
+                await asyncio.sleep(start - now)
+
+
+class Checker:
+    """Checks URLs. See the module docstring."""
+
+    # Maximal number of URLs being checked at a time.
+    concurrency:    int
+
+    # Maximal number of requests in progress per host.
+    per_host:       int
+
+    # Maximal number of requests per second per host (0: no limit).
+    rate:           float
+
+    # Time allowed to check a URL, including redirects, in seconds.
+    timeout:        float
+
+    cache:          Optional[UrlCache]
+
+    def __init__(self, concurrency: int = 20, per_host: int = 4, rate: float = 0.0,
+                 timeout: float = 10.0, cache: Optional[UrlCache] = None) -> None:
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.timeout = timeout
+        self.cache = cache
+        self.__hosts: Dict[Tuple[str, str, int], _Host] = {}
+        self.__ssl: Optional[ssl.SSLContext] = None
+
+    def check(self, urls: Iterable[str]) -> Dict[str, Result]:
+        """Check the `urls` (without fragments). Return the result of each."""
+
+        results: Dict[str, Result] = {}
+        pending: Set[str] = set()
+        for url in urls:
+            if url in results or url in pending:
+                continue
+            cached = self.cache.get(url) if self.cache else None
+            if cached is None:
+                pending.add(url)
+            else:
+                results[url] = cached
+
+        if pending:
+            checked = asyncio.run(self.__check_all(sorted(pending)))
+            results.update(checked)
+            if self.cache:
+                for url, result in checked.items():
+                    if result.definitive():
+                        self.cache.put(url, result)
+        return results
+
+    async def __check_all(self, urls: List[str]) -> Dict[str, Result]:
+        self.__hosts = {}
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def check(url: str) -> Result:
+            async with slots:
+                try:
+                    return await asyncio.wait_for(self.__follow(url), self.timeout)
+                except asyncio.TimeoutError:
+                    return Result(0, "timed out")
+                except (OSError, ValueError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError) as exc:
+                    return Result(0, str(exc) or type(exc).__name__)
+
+        try:
+            return dict(zip(urls, await asyncio.gather(*(check(url) for url in urls))))
+        finally:
+            for host in self.__hosts.values():
+                for _, writer in host.idle:
+                    writer.close()
+
+    async def __follow(self, url: str) -> Result:
+        """Request `url` (with HEAD, then with GET if that fails), following redirects."""
+
+        for _ in range(MAX_REDIRECTS + 1):
+            status, reason, location = await self.__request('HEAD', url)
+            if status >= 400:
+                got = await self.__request('GET', url)
+                # Unless the server does not implement GET either
+                if got[0] not in (405, 501):
+                    status, reason, location = got
+            if status not in REDIRECTS or not location:
+                return Result(status, reason)
+            url = urljoin(url, location)
+        return Result(status, "too many redirects")
+
+    async def __request(self, method: str, url: str) -> Tuple[int, str, str]:
+        """Make a request; return the status, the reason and the Location header."""
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError("unsupported URL: " + url)
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        host = self.__hosts.get(key)
+        if host is None:
+            host = self.__hosts[key] = _Host(self.per_host, self.rate)
+
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        netloc = parts.hostname if parts.port is None else '{}:{}'.format(parts.hostname, port)
+        request = ("{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\nAccept: */*\r\n"
+                   "Connection: keep-alive\r\n\r\n").format(
+                       method, target, netloc, USER_AGENT).encode('latin-1')
+
+        async with host.slots:
+            await host.pace()
+            # A pooled connection may have been closed by the server: then retry on a new one.
+            while True:
+                reused = bool(host.idle)
+                if reused:
+                    reader, writer = host.idle.pop()
+                else:
+                    reader, writer = await self.__connect(scheme, parts.hostname, port)
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    break
+                except (OSError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if not reused:
+                        raise
+                except asyncio.CancelledError:
+                    writer.close()
+                    raise
+
+        lines = head.decode('latin-1').split('\r\n')
+        version, status, reason = (lines[0].split(' ', 2) + ['', ''])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Only the (bodiless) responses to HEAD requests leave the connection reusable.
+        if (method == 'HEAD' and version == 'HTTP/1.1'
+                and headers.get('connection', '').lower() != 'close'):
+            host.idle.append((reader, writer))
+        else:
+            writer.close()
+        return int(status), reason, headers.get('location', '')
+
+    async def __connect(self, scheme: str, hostname: str, port: int
+                        ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if scheme == 'http':
+            return await asyncio.open_connection(hostname, port)
+        if self.__ssl is None:
+            self.__ssl = ssl.create_default_context()
+        return await asyncio.open_connection(hostname, port, ssl=self.__ssl,
+                                             server_hostname=hostname)
+
+
+def check_external(md_tree: Tree, checker: Checker,
+                   links: Optional[Iterable[Tuple[Path, Link]]] = None) -> List[issues.Issue]:
+    """Check the external links of the tree; return the issues found.
+
+    links: if given, only these links (pairs of the containing file's Path and the Link)
+    are checked, rather than all links in the tree.
+    """
+
+    if links is None:
+        links = ((path, link) for path, file in md_tree.files.items() for link in file.links)
+
+    with profiling.phase('external'):
+        external = [(path, link, urldefrag(link.get_dest())[0]) for path, link in links
+                    if is_external(link.get_dest())]
+        results = checker.check(url for _, _, url in external)
+        return [issues.ExternalLinkBroken(path, link, *results[url])
+                for path, link, url in external if not results[url].ok()]
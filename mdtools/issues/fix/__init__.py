@@ -4,6 +4,7 @@ from typing import List, Dict
 from pathlib import Path
 
 from mdtools.util import clr
+from mdtools import profiling
 from mdtools.model.tree import Tree
 from mdtools.issues import issues
 from mdtools.issues.fix import link_issues   # do not remove: decorators run
@@ -11,28 +12,50 @@ from mdtools.issues.fix.patch import Patches
 from mdtools.issues.fix import options
 
 
+# Number of upcoming issues whose fuzzy matches are computed in the background, while the
+# user is choosing a fix interactively.
+PREFETCH = 16
+
+
 def fix_all(all_issues: List[issues.Issue], tree: Tree, opt: options.Options) -> None:
     '''Print issues. If the mode implies fixing, and if there's a fixer available, invoke it.
     The fixer will work interactively or manually (depending on mode) and generate patches.
     The patches are applied at the end.
     '''
 
-    patches = Patches(tree)
+    patches = Patches(tree, opt.dry_run, opt.all_or_nothing)
 
     # Sort issues by file, for more natural interactive handling.
     issues_by_file: Dict[Path, List[issues.Issue]] = {}
     for i in all_issues:
         issues_by_file.setdefault(i.path, []).append(i)
 
+    # In the order they are handled
+    ordered = [i for issues_in_file in issues_by_file.values() for i in issues_in_file]
+    prefetch = opt.mode == '-i' and opt.fuzzy
+    n = 0
+    if opt.mode == '-a' and opt.fuzzy:
+        link_issues.batch_match(tree, ordered)
+
     for file, issues_in_file in issues_by_file.items():
         print(clr("BOLD") + str(file) + clr(""))
         for i in issues_in_file:
+            if prefetch:
+                link_issues.prefetch(tree, ordered[n:n + PREFETCH])
+            n += 1
             print(i.describe())
             if opt.mode and hasattr(i.__class__ ,'fixed_by'):
                 fixer = i.__class__.fixed_by         # type: ignore
                 fixer(i, tree, patches, opt)
 
     if not patches.empty:
-        print("Patching files...")
-        patches.apply()
-        print("OK")
+        if opt.dry_run:
+            print("Changes to be made (dry run):")
+            with profiling.phase('patch'):
+                patches.apply()
+        else:
+            print("Patching files...")
+            with profiling.phase('patch'):
+                ok = patches.apply()
+            if ok:
+                print("OK")
@@ -5,6 +5,9 @@
 
 import re
 import math
+from collections import Counter
+from typing import Optional, Iterable, Dict, List, Set, Tuple
+
 import numpy as np  # type: ignore
 
 
@@ -12,48 +15,294 @@ RE_WHITE = r"""\s"""
 rc_white = re.compile(RE_WHITE)
 
 
-def levenshtein(seq1, seq2):
-    """Computes a 'distance' between two strings."""
-
-    size_x = len(seq1) + 1
-    size_y = len(seq2) + 1
-    matrix = np.zeros ((size_x, size_y))
-    for x in range(size_x):
-        matrix [x, 0] = x
-    for y in range(size_y):
-        matrix [0, y] = y
-
-    for x in range(1, size_x):
-        for y in range(1, size_y):
-            if seq1[x-1] == seq2[y-1]:
-                matrix [x,y] = min(
-                    matrix[x-1, y] + 1,
-                    matrix[x-1, y-1],
-                    matrix[x, y-1] + 1
-                )
-            else:
-                matrix [x,y] = min(
-                    matrix[x-1,y] + 1,
-                    matrix[x-1,y-1] + 1,
-                    matrix[x,y-1] + 1
-                )
-    return (matrix[size_x - 1, size_y - 1])
-
-
-def best_match(what, list_):
+def levenshtein(seq1, seq2, max_dist: Optional[int] = None) -> int:
+    """Computes a 'distance' between two strings.
+
+    If `max_dist` is given, only the distances up to `max_dist` are computed exactly;
+    `max_dist + 1` is returned as soon as the distance is known to be larger. Only a
+    diagonal band of cells of width `2 * max_dist + 1` is evaluated, and the computation
+    stops when every cell in a row exceeds `max_dist`.
+    """
+
+    len1 = len(seq1)
+    len2 = len(seq2)
+    if max_dist is None:
+        max_dist = max(len1, len2)
+    big = max_dist + 1
+    if abs(len1 - len2) > max_dist:
+        return big
+
+    prev = [j if j <= max_dist else big for j in range(len2 + 1)]
+    for x in range(1, len1 + 1):
+        cur = [big] * (len2 + 1)
+        if x <= max_dist:
+            cur[0] = x
+        row_min = cur[0]
+        c1 = seq1[x - 1]
+        for y in range(max(1, x - max_dist), min(len2, x + max_dist) + 1):
+            d = prev[y - 1] if c1 == seq2[y - 1] else prev[y - 1] + 1
+            if prev[y] + 1 < d:
+                d = prev[y] + 1
+            if cur[y - 1] + 1 < d:
+                d = cur[y - 1] + 1
+            if d > big:
+                d = big
+            cur[y] = d
+            if d < row_min:
+                row_min = d
+        if row_min > max_dist:
+            return big
+        prev = cur
+
+    return prev[len2]
+
+
+def encode(strings: List[str], pad: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the code points of `strings`, as the rows of an array padded with `pad`, and
+    the lengths of the strings.
+    """
+    lengths = np.array([len(s) for s in strings], dtype=np.int32)
+    codes = np.full((len(strings), int(lengths.max(initial=0))), pad, dtype=np.int32)
+    for i, s in enumerate(strings):
+        if s:
+            codes[i, :len(s)] = np.frombuffer(s.encode('utf-32-le'), dtype=np.uint32)
+    return codes, lengths
+
+
+def levenshtein_batch(codes1: np.ndarray, lengths1: np.ndarray,
+                      codes2: np.ndarray, lengths2: np.ndarray) -> np.ndarray:
+    """Computes the distances (see `levenshtein`) between pairs of strings at once: the
+    strings are the rows of `codes1` and `codes2` (see `encode`, which must be padded with
+    different values), of lengths `lengths1` and `lengths2`.
+
+    The matrix is computed one row at a time for all pairs. In a row, the insertions (from
+    the cell on the left) are a running minimum: cell j is min over i <= j of
+    (cell i without insertions) + (j - i).
+    """
+
+    count, len2 = codes2.shape
+    cols = np.arange(len2 + 1, dtype=np.int32)
+    prev = np.broadcast_to(cols, (count, len2 + 1))
+    out = lengths2.copy()
+    for x in range(1, codes1.shape[1] + 1):
+        cur = np.empty((count, len2 + 1), dtype=np.int32)
+        cur[:, 0] = x
+        np.minimum(prev[:, :-1] + (codes2 != codes1[:, x - 1:x]), prev[:, 1:] + 1,
+                   out=cur[:, 1:])
+        cur = np.minimum.accumulate(cur - cols, axis=1) + cols
+        done = np.flatnonzero(lengths1 == x)
+        out[done] = cur[done, lengths2[done]]
+        prev = cur
+    return out
+
+
+def histogram_bound(hist1: Counter, seq2) -> int:
+    """A cheap lower bound of the distance between a string with the character histogram
+    `hist1` and `seq2`: every edit changes at most one character on each side.
+    """
+    diff = hist1.copy()
+    diff.subtract(seq2)
+    surplus = sum(n for n in diff.values() if n > 0)
+    deficit = -sum(n for n in diff.values() if n < 0)
+    return max(surplus, deficit)
+
+
+def normalize(s: str) -> str:
+    """Normalize a string for fuzzy comparison."""
+    return rc_white.sub("", s.lower())
+
+
+def best_match(what, list_, max_dist: Optional[int] = None):
     """Finds the closest match for `what` in `list_`.
     Returns the best match, and distance to `what`.
+
+    If `max_dist` is given, candidates further than `max_dist` are not considered
+    (and `None, math.inf` is returned if there are no others). Among candidates at the same
+    distance, the first one in `list_` wins.
     """
 
-    pwhat = what.lower()
-    pwhat = rc_white.sub("", pwhat)
+    pwhat = normalize(what)
+    hist = Counter(pwhat)
     min_ = math.inf
+    sugg = None
     for i in list_:
-        pi = i.lower()
-        pi = rc_white.sub("", pi)
-        lev = levenshtein(pwhat, pi)
+        pi = normalize(i)
+        if max_dist is None:
+            lev = levenshtein(pwhat, pi)
+        else:
+            # Only a strictly better candidate than the current best is of interest.
+            bound = max_dist if min_ == math.inf else int(min_) - 1
+            if abs(len(pi) - len(pwhat)) > bound or histogram_bound(hist, pi) > bound:
+                continue
+            lev = levenshtein(pwhat, pi, bound)
+            if lev > bound:
+                continue
         if min_ > lev:
             min_ = lev
             sugg = i
+            if lev == 0:
+                break
 
     return sugg, min_
+
+
+class FuzzyIndex:
+    """An index of strings, answering "the nearest string within distance k" much faster
+    than `best_match` over all of them, and giving the same answer.
+
+    Strings are normalized (see `normalize`) and split into q-grams. If two strings are
+    within distance k, at most k*q of the distinct q-grams of one of them are missing from
+    the other. So a match must contain at least one of the k*q + 1 rarest q-grams of the
+    query ("prefix filtering"); only the strings containing one of them are verified with
+    `levenshtein`.
+    """
+
+    q = 2
+
+    def __init__(self, keys: Iterable[str] = ()) -> None:
+        # Postings: maps from q-gram to ids of the normalized strings containing it.
+        self.__postings: Dict[str, List[int]] = {}
+        # Normalized strings, by id
+        self.__norms: List[str] = []
+        # Maps from normalized string to id
+        self.__ids: Dict[str, int] = {}
+        # Maps from id to the keys with this normalized string, and their insertion numbers
+        # (used to break ties the same way as `best_match` does: the first key wins).
+        self.__keys: Dict[int, Dict[str, int]] = {}
+        # Maps from key to id
+        self.__key_ids: Dict[str, int] = {}
+        self.__seq = 0
+        # Normalized strings, encoded for `nearest_all` (see `encode`); built when needed
+        self.__codes: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        for key in keys:
+            self.add(key)
+
+    def __grams(self, norm: str) -> Set[str]:
+        padded = '\0' * (self.q - 1) + norm + '\0' * (self.q - 1)
+        return {padded[i:i + self.q] for i in range(len(padded) - self.q + 1)}
+
+    def __len__(self) -> int:
+        return len(self.__key_ids)
+
+    def add(self, key: str) -> None:
+        """Add a key (if not already there)."""
+        if key in self.__key_ids:
+            return
+        norm = normalize(key)
+        id_ = self.__ids.get(norm)
+        if id_ is None:
+            id_ = self.__ids[norm] = len(self.__norms)
+            self.__norms.append(norm)
+            for gram in self.__grams(norm):
+                self.__postings.setdefault(gram, []).append(id_)
+        self.__keys.setdefault(id_, {})[key] = self.__seq
+        self.__key_ids[key] = id_
+        self.__seq += 1
+
+    def discard(self, key: str) -> None:
+        """Remove a key (if there). The postings are cleaned lazily."""
+        id_ = self.__key_ids.pop(key, None)
+        if id_ is not None:
+            del self.__keys[id_][key]
+
+    def sync(self, keys: Iterable[str]) -> None:
+        """Make the index contain exactly `keys`."""
+        keys = list(keys)
+        current = set(keys)
+        for key in [k for k in self.__key_ids if k not in current]:
+            self.discard(key)
+        for key in keys:
+            self.add(key)
+
+    def nearest(self, what: str, max_dist: int) -> Tuple[Optional[str], float]:
+        """Finds the closest key to `what`, within `max_dist`. Returns the key and its
+        distance to `what`, or `None, math.inf`. Same as `best_match(what, keys, max_dist)`.
+        """
+
+        pwhat = normalize(what)
+        candidates = self.__candidates(pwhat, max_dist)
+        best = None
+        best_seq = 0
+        min_ = math.inf
+        for id_ in candidates:
+            keys = self.__keys.get(id_)
+            if not keys:
+                continue
+            norm = self.__norms[id_]
+            bound = max_dist if min_ == math.inf else int(min_)
+            if abs(len(norm) - len(pwhat)) > bound:
+                continue
+            lev = levenshtein(pwhat, norm, bound)
+            if lev > bound:
+                continue
+            key, seq = min(keys.items(), key=lambda k_s: k_s[1])
+            if lev < min_ or seq < best_seq:
+                best, best_seq, min_ = key, seq, lev
+
+        return best, min_
+
+    def nearest_all(self, whats: Iterable[str], max_dist: int,
+                    batch: int = 1 << 12) -> Dict[str, Tuple[List[str], float]]:
+        """Finds the closest keys to each of `whats`, within `max_dist`. Returns, for each,
+        all the keys at the smallest distance (so that ambiguous matches can be told apart),
+        in the order they were added, and the distance; or `[], math.inf`.
+
+        The candidates of all `whats` are selected as in `nearest`, and their distances are
+        computed in batches of `batch` pairs with NumPy (see `levenshtein_batch`).
+        """
+
+        whats = list(dict.fromkeys(whats))
+        pwhats = [normalize(what) for what in whats]
+        out: Dict[str, Tuple[List[str], float]] = {what: ([], math.inf) for what in whats}
+        if not whats or not self.__norms:
+            return out
+
+        if self.__codes is None or len(self.__codes[1]) != len(self.__norms):
+            self.__codes = encode(self.__norms, -2)
+        codes2, lengths2 = self.__codes
+        codes1, lengths1 = encode(pwhats, -1)
+        # Pairs of a query (index in `whats`) and a candidate id, of similar lengths;
+        # without the normalized strings left by removed keys
+        cands = [np.fromiter(self.__candidates(pwhat, max_dist), dtype=np.int32)
+                 for pwhat in pwhats]
+        query = np.repeat(np.arange(len(whats), dtype=np.int32), [len(c) for c in cands])
+        cand = np.concatenate(cands)
+        live = np.array([bool(self.__keys.get(id_)) for id_ in range(len(self.__norms))])
+        near = live[cand] & (np.abs(lengths1[query] - lengths2[cand]) <= max_dist)
+        query, cand = query[near], cand[near]
+        if not len(query):
+            return out
+        # Similar lengths in each batch, for less padding
+        order = np.argsort(lengths1[query] * (lengths2.max() + 1) + lengths2[cand],
+                           kind='stable')
+        query, cand = query[order], cand[order]
+
+        dist = np.empty(len(query), dtype=np.int32)
+        for start in range(0, len(query), batch):
+            q, c = query[start:start + batch], cand[start:start + batch]
+            len1, len2 = int(lengths1[q].max()), int(lengths2[c].max())
+            dist[start:start + batch] = levenshtein_batch(
+                codes1[q, :len1], lengths1[q], codes2[c, :len2], lengths2[c])
+
+        best = np.full(len(whats), max_dist + 1, dtype=np.int32)
+        np.minimum.at(best, query, dist)
+        found: Dict[int, List[str]] = {}
+        closest = dist == best[query]
+        for i, id_ in zip(query[closest].tolist(), cand[closest].tolist()):
+            found.setdefault(i, []).extend(self.__keys[id_])
+        for i, keys in found.items():
+            keys.sort(key=lambda key: self.__keys[self.__key_ids[key]][key])
+            out[whats[i]] = (keys, int(best[i]))
+        return out
+
+    def __candidates(self, pwhat: str, max_dist: int) -> Iterable[int]:
+        """Ids of the normalized strings which may be within `max_dist` of `pwhat` (a
+        normalized string): all of those which are, and more.
+        """
+        grams = self.__grams(pwhat)
+        required = len(grams) - max_dist * self.q
+        if required <= 0:
+            return range(len(self.__norms))
+        rarest = sorted(grams, key=lambda g: len(self.__postings.get(g, ())))
+        return set().union(
+            *(self.__postings.get(g, ()) for g in rarest[:len(grams) - required + 1]))
@@ -18,7 +18,7 @@ def path_to_href_abs(target, base_dir):
 
 
 def path_to_href_rel(target, base_rel):
-    """ Generate relative href (b/c.md)
+    """ Generate relative href (b/c.md, ../../a/b/c.md)
 
     - target: Path to target
     - base_rel: The Path to the file containing the link, used to generate relative hrefs
@@ -29,22 +29,16 @@ def path_to_href_rel(target, base_rel):
         # The target is actually the file itself.
         return ''
 
-    else:
-        # The directory containing the markdown file that contains the offending link
-        base_dir_rel = base_rel.parent
-
-        # Try to find a relative path without going up ("..")
-        href = util.path_to_href(target, base_dir_rel)
-        if href:
-            return href
-        else:
-            # Try to find a relative path with going up ("..").
-            max_up = 3      # Max number of "ups" allowed
-            dir_up = ''
-            for _ in range(max_up):
-                dir_up = dir_up + '../'
-                base_dir_rel = base_dir_rel.parent
-                href = util.path_to_href(target, base_dir_rel)
-                if href:
-                    # Found
-                    return dir_up + href
+    # Go up from the directory containing the markdown file that contains the offending
+    # link to the closest common ancestor of it and the target, then down to the target.
+    from_parts = base_rel.parent.parts
+    to_parts = target.parts
+    common = 0
+    for from_part, to_part in zip(from_parts, to_parts):
+        if from_part != to_part:
+            break
+        common += 1
+    if common == 0:
+        # No common ancestor (e.g. on different drives)
+        return None
+    return '/'.join(['..'] * (len(from_parts) - common) + list(to_parts[common:])) or '.'
@@ -2,34 +2,171 @@
 
 # pylint: disable=invalid-name
 
-from typing import Optional, List, Dict
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, List, Dict, Callable, Iterable, Tuple
 from pathlib import Path
 
 from mdtools.util import clr
+from mdtools import profiling
 from mdtools.issues import issues
 from mdtools.model.tree import Tree
+from mdtools.model.paths import PathIndex
 from mdtools.issues.fix import href, options, util, fuzzy
 from mdtools.issues.fix.patch import Patch, Patches
 
 
+# The indexes of a tree that names are looked up in, by name (see `Tree`).
+__indexes: Dict[str, Callable[[Tree], PathIndex]] = {
+    'names':        lambda tree: tree.names,
+    'all_anchors':  lambda tree: tree.all_anchors,
+}
+
+
+def __index(tree: Tree, index_name: str) -> PathIndex:
+    """Return `tree.<index_name>`."""
+    return __indexes[index_name](tree)
+
+
+# Fuzzy matching indexes of the trees, by name of the index in the tree (e.g. "names"), with
+# the tree generation they are up to date with.
+__fuzzy_indexes: 'weakref.WeakKeyDictionary[Tree, Dict[str, list]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def fuzzy_index(tree: Tree, index_name: str) -> fuzzy.FuzzyIndex:
+    """Return the fuzzy matching index of the keys of `tree.<index_name>`. It is built once
+    per tree, and updated when the tree changes.
+    """
+
+    indexes = __fuzzy_indexes.setdefault(tree, {})
+    entry = indexes.get(index_name)
+    if entry is None:
+        entry = indexes[index_name] = [fuzzy.FuzzyIndex(__index(tree, index_name)),
+                                       tree.generation]
+    elif entry[1] != tree.generation:
+        entry[0].sync(__index(tree, index_name))
+        entry[1] = tree.generation
+    return entry[0]
+
+
+# Fuzzy matches for the interactive fixes, by tree: maps from the name looked up and the
+# name of the index to the (future) match and its distance, with the tree generation they
+# are up to date with. The matches are computed in a background thread (see `prefetch`).
+__fuzzy_matches: 'weakref.WeakKeyDictionary[Tree, list]' = weakref.WeakKeyDictionary()
+
+__executor: Optional[ThreadPoolExecutor] = None
+
+
+def __match_future(tree: Tree, object_name: str, index_name: str, max_dist: int) -> Future:
+    """Return the future fuzzy match of `object_name` in `tree.<index_name>`, starting to
+    compute it in the background thread if it is not known yet.
+    """
+
+    global __executor   # pylint: disable=global-statement
+    entry = __fuzzy_matches.get(tree)
+    if entry is None or entry[1] != tree.generation:
+        entry = __fuzzy_matches[tree] = [{}, tree.generation]
+    matches: Dict[Tuple[str, str], Future] = entry[0]
+    future = matches.get((object_name, index_name))
+    if future is None:
+        if __executor is None:
+            # One thread: the matching is pure Python, so more threads would not be faster.
+            # It also keeps the fuzzy indexes (see `fuzzy_index`) to one thread.
+            __executor = ThreadPoolExecutor(1, thread_name_prefix='mdtools-fuzzy')
+        future = matches[(object_name, index_name)] = __executor.submit(
+            lambda: fuzzy_index(tree, index_name).nearest(object_name, max_dist))
+    return future
+
+
+def __fuzzy_key(issue: issues.Issue) -> Optional[Tuple[str, str, int]]:
+    """The name a fix of `issue` looks up, the index it is looked up in, and
+    the maximal distance of a fuzzy match; or None if the fix does not look anything up.
+    """
+    if isinstance(issue, issues.TargetNotFound):
+        return Path(issue.link.get_href()).name, 'names', 3
+    if isinstance(issue, issues.AnchorNotFound):
+        return issue.link.get_anchor(), 'all_anchors', 4
+    return None
+
+
+def prefetch(tree: Tree, upcoming: Iterable[issues.Issue]) -> None:
+    """Start computing the fuzzy matches that the interactive fixes of the `upcoming`
+    issues need, in a background thread, so that they are ready by the time the user gets
+    to these issues. Each name is matched once per index.
+    """
+
+    for issue in upcoming:
+        key = __fuzzy_key(issue)
+        if key and key[0] not in __index(tree, key[1]):
+            __match_future(tree, *key)
+
+
 def __fuzzy_match(object_name: str,
-                  object_index: Dict[str, List[Path]],
+                  tree: Tree,
+                  index_name: str,
                   max_dist: int) -> Optional[str]:
-    """Perform fuzzy match of `object_name` in `object_index`, if possible."""
+    """Perform fuzzy match of `object_name` in `tree.<index_name>`, if possible."""
 
-    fuzzy_match, dist = fuzzy.best_match(object_name, object_index)
-    if dist <= max_dist:
+    with profiling.phase('fuzzy'):
+        fuzzy_match, dist = __match_future(tree, object_name, index_name, max_dist).result()
+    if fuzzy_match is not None and dist <= max_dist:
         print(clr("RED") + '      Did you mean: ' + fuzzy_match + '?' + clr(""))
         return fuzzy_match
     return None
 
 
+# Unique fuzzy matches for the automatic fixes, by tree: maps from the name looked up and
+# the name of the index to the match (None if there is no match, or several equally close
+# ones), with the tree generation they are up to date with (see `batch_match`).
+__unique_matches: 'weakref.WeakKeyDictionary[Tree, list]' = weakref.WeakKeyDictionary()
+
+
+def batch_match(tree: Tree, all_issues: Iterable[issues.Issue]) -> None:
+    """Compute the fuzzy matches that the automatic fixes of `all_issues` need, at once:
+    the names not found are collected and deduplicated, and matched against each index in
+    vectorized batches (see `FuzzyIndex.nearest_all`).
+    """
+
+    entry = __unique_matches.get(tree)
+    if entry is None or entry[1] != tree.generation:
+        entry = __unique_matches[tree] = [{}, tree.generation]
+    matches: Dict[Tuple[str, str], Optional[str]] = entry[0]
+
+    # Names to match, by index and maximal distance
+    wanted: Dict[Tuple[str, int], List[str]] = {}
+    for issue in all_issues:
+        key = __fuzzy_key(issue)
+        if key and key[0] not in __index(tree, key[1]) and (key[0], key[1]) not in matches:
+            wanted.setdefault((key[1], key[2]), []).append(key[0])
+    if not wanted:
+        return
+
+    with profiling.phase('fuzzy'):
+        for (index_name, max_dist), names in wanted.items():
+            found = fuzzy_index(tree, index_name).nearest_all(names, max_dist)
+            for name, (keys, _) in found.items():
+                matches[(name, index_name)] = keys[0] if len(keys) == 1 else None
+
+
+def __unique_match(issue: issues.LinkIssue, tree: Tree) -> Optional[str]:
+    """Return the unique fuzzy match of the name the automatic fix of `issue` looks up (see
+    `batch_match`), or None.
+    """
+    batch_match(tree, [issue])
+    key = __fuzzy_key(issue)
+    return __unique_matches[tree][0].get((key[0], key[1])) if key else None
+
+
 def __fix_a(issue: issues.LinkIssue,
             tree: Tree,
             object_name: str,
-            object_index: Dict[str, List[Path]],
-            patches: Patches) -> None:
-    """Generate a fix of a link issue automatically, if possible."""
+            object_index: PathIndex,
+            patches: Patches,
+            new_anchor: Optional[str] = None) -> None:
+    """Generate a fix of a link issue automatically, if possible. new_anchor: also replace
+    the anchor of the link.
+    """
 
     # Exactly one target candidate must be available for the automatic mode to work.
     if not object_name in object_index or len(object_index[object_name]) != 1:
@@ -46,12 +183,14 @@ def __fix_a(issue: issues.LinkIssue,
     def patch_func():
         """ Patch lambda. """
         issue.link.set_href(h)
+        if new_anchor is not None:
+            issue.link.set_anchor(new_anchor)
 
     if h is not None:
         # pylint: disable=W0108
-        anchor = issue.link.get_anchor()
+        anchor = issue.link.get_anchor() if new_anchor is None else new_anchor
         print(clr("GREEN") + "      -> " + h + (('#' + anchor) if anchor else '') + clr(""))
-        patches.add(Patch(issue.path, lambda: patch_func()))
+        patches.add(Patch(issue.path, lambda: patch_func(), issue.link))
 
 
 # Note: `__fix_target_not_found_i` and `__fix_anchor_not_found_i` are similar in principle
@@ -71,7 +210,7 @@ def __fix_target_not_found_i(issue: issues.TargetNotFound,
 
     if not file_name in files and opt.fuzzy:
         # No exact match; try to find a fuzzy match.
-        fm = __fuzzy_match(file_name, files, 3)
+        fm = __fuzzy_match(file_name, tree, 'names', 3)
         if fm:
             file_name = fm
 
@@ -91,7 +230,7 @@ def __fix_target_not_found_i(issue: issues.TargetNotFound,
             a = ('#' + a) if a else ''
             print(clr("GREEN") + "         " + str(len(choices)) + "\t" + new_href + a  + clr(""))
             # Add a patch candidate
-            choices.append(Patch(issue.path, lambda: patch_func()))
+            choices.append(Patch(issue.path, lambda: patch_func(), issue.link))
 
     # For each candidate target...
     for f in files[file_name]:
@@ -123,7 +262,7 @@ def __fix_anchor_not_found_i(issue: issues.AnchorNotFound,
 
     if not anchor in files and opt.fuzzy:
         # No exact match; try to find a fuzzy match.
-        fm = __fuzzy_match(anchor, files, 4)
+        fm = __fuzzy_match(anchor, tree, 'all_anchors', 4)
         if fm:
             anchor = fm
 
@@ -144,7 +283,7 @@ def __fix_anchor_not_found_i(issue: issues.AnchorNotFound,
             a = ('#' + a) if a else ''
             print(clr("GREEN") + "         " + str(len(choices)) + "\t" + new_href + a + clr(""))
              # Add a patch candidate
-            choices.append(Patch(issue.path, lambda: patch_func()))
+            choices.append(Patch(issue.path, lambda: patch_func(), issue.link))
 
     # For each candidate target...
     for f in files[anchor]:
@@ -166,6 +305,47 @@ def __fix_anchor_not_found_i(issue: issues.AnchorNotFound,
 # -----------------------------------------------------------------------------
 
 
+def suggest(issue: issues.Issue, tree: Tree, fuzzy_: bool = False) -> List[str]:
+    """Return the destinations a link with `issue` could be fixed to, without asking or
+    printing anything: one for each file with the name of the target (for `TargetNotFound`)
+    or with the anchor (for `AnchorNotFound`). The hrefs are absolute if the link is.
+
+    fuzzy_: if there is no such file, use the fuzzy match of the name or the anchor.
+    """
+
+    if isinstance(issue, issues.TargetNotFound):
+        index_name, max_dist = 'names', 3
+        name = Path(issue.link.get_href()).name
+        anchor = issue.link.get_anchor()
+    elif isinstance(issue, issues.AnchorNotFound):
+        index_name, max_dist = 'all_anchors', 4
+        name = anchor = issue.link.get_anchor()
+    else:
+        return []
+
+    object_index = __index(tree, index_name)
+    if name not in object_index and fuzzy_:
+        with profiling.phase('fuzzy'):
+            match, _ = fuzzy_index(tree, index_name).nearest(name, max_dist)
+        if match is None:
+            return []
+        name = match
+        if index_name == 'all_anchors':
+            anchor = match
+    if name not in object_index:
+        return []
+
+    out = []
+    for path in object_index[name]:
+        if issue.link.is_absolute():
+            h = href.path_to_href_abs(path, tree.base)
+        else:
+            h = href.path_to_href_rel(path, issue.path)
+        if h is not None:
+            out.append(h + (('#' + anchor) if anchor else ''))
+    return out
+
+
 @util.fixes(issues.TargetNotFound)
 def fix_target_not_found(issue: issues.TargetNotFound, tree: Tree, patches: Patches,
                          opt: options.Options) -> None:
@@ -179,6 +359,8 @@ def fix_target_not_found(issue: issues.TargetNotFound, tree: Tree, patches: Patc
     elif opt.mode == '-a':
         object_index = tree.names
         object_name = Path(issue.link.get_href()).name
+        if not object_name in object_index and opt.fuzzy:
+            object_name = __unique_match(issue, tree) or object_name
         __fix_a(issue, tree, object_name, object_index, patches)
 
 
@@ -195,4 +377,8 @@ def fix_anchor_not_found(issue: issues.AnchorNotFound, tree: Tree, patches: Patc
     elif opt.mode == '-a':
         object_index = tree.all_anchors
         object_name = issue.link.get_anchor()
-        __fix_a(issue, tree, object_name, object_index, patches)
+        new_anchor = None
+        if not object_name in object_index and opt.fuzzy:
+            new_anchor = __unique_match(issue, tree)
+            object_name = new_anchor or object_name
+        __fix_a(issue, tree, object_name, object_index, patches, new_anchor)
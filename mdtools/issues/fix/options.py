@@ -1,12 +1,37 @@
 """Defines a class to describe link fixing options."""
 
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
 @dataclass
 class Options:
     """Link fixing options, parsed from command line arguments."""
 
-    mode:      str  = ''
-    fuzzy:     bool = False
-    colorize:  bool = False
+    mode:           str  = ''
+    fuzzy:          bool = False
+    colorize:       bool = False
+    jobs:           int  = 1
+    cache:          bool = True
+    cache_file:     str  = ''
+    cache_stats:    bool = False
+    watch:          bool = False
+    backlinks:      str  = ''
+    dry_run:        bool = False
+    all_or_nothing: bool = False
+    profile:        bool = False
+    profile_json:   str  = ''
+    slowest:        int  = 10
+    cprofile:       str  = ''
+    format:         str  = 'text'
+    stream:         bool = False
+    changed_since:  str  = ''
+    exclude:        List[str] = field(default_factory=list)
+    ignore_files:   bool = True
+    follow_links:   bool = False
+    stat_threads:   int  = 0
+    external:       bool = False
+    external_jobs:  int  = 20
+    external_per_host: int = 4
+    external_rate:  float = 0.0
+    external_ttl:   float = 24 * 3600
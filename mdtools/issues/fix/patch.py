@@ -1,11 +1,35 @@
-"""Contains facilities for file patching."""
+"""Contains facilities for file patching.
 
+Patches are applied in phases:
+1. Each target file is read, the patches are applied to the model, and the new contents of
+   the file are computed in memory (`PatchTarget.prepare`).
+2. The new contents are written to temporary files next to the targets, on a thread pool
+   (`PatchTarget.write`).
+3. The temporary files are renamed over the targets (`PatchTarget.commit`), so that each
+   file is replaced atomically: a crash never leaves a half-written file behind.
 
+In the all-or-nothing mode, if any file cannot be patched, no file is changed (files already
+renamed over are restored), and the model is reverted. In the dry-run mode, unified diffs
+are printed instead of writing, and the model is reverted.
+"""
+
+
+import difflib
+import os
+import re
+import stat
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Optional, Tuple
 from pathlib import Path
 
-from mdtools.model.tree import Tree, File
+from mdtools import util
+from mdtools.model.tree import Tree, File, Link
+from mdtools.model.link import Span
+from mdtools.model.parse import parse_markdown
+from mdtools.model.scan import rc_literal
 
 
 @dataclass
@@ -15,51 +39,383 @@ class Patch:
     target:         Path
     patch_function: Callable[[], None]
 
-    def apply(self) -> None:
-        """Apply the patch."""
+    # The link whose destination the patch changes, if any.
+    link:           Optional[Link] = None
+
+    def apply(self, tree: Tree) -> None:
+        """Apply the patch, and keep the reverse link index of `tree` up to date."""
+        old_dest = self.link.get_dest() if self.link else None
         self.patch_function()   # type: ignore
+        if self.link and old_dest != self.link.get_dest():
+            tree.on_link_changed(self.target, self.link, old_dest)    # type: ignore
 
 
 class PatchTarget:
     """Describes a patch target (single file to be patched), and all the patches."""
 
-    file:    File
-    patches: List[Patch]
+    tree:     Tree
+    file:     File
+    patches:  List[Patch]
 
-    def __init__(self, file: File) -> None:
+    # Contents of the file when it was prepared
+    original: Optional[str]
+
+    # Patched contents of the file, as pieces to be written one after another; None if
+    # there is nothing to write.
+    patched:  Optional[List[str]]
+
+    def __init__(self, tree: Tree, file: File) -> None:
+        self.tree = tree
         self.file = file
         self.patches = []
+        self.original = None
+        self.patched = None
+        # Newline translation to write the file with (see `open`)
+        self.__newline: Optional[str] = ''
+        # Temporary file with the patched contents, until it is committed
+        self.__temp: Optional[str] = None
+        # State of the links before `prepare`: (link, destination, span)
+        self.__undo: List[Tuple[Link, str, Optional[Span]]] = []
 
     def add_patch(self, patch: Patch) -> None:
         """Register a patch to be added to this target."""
         self.patches.append(patch)
 
-    def apply(self) -> None:
-        """Apply patches for this target. This is where the actual file is changed. """
+    def prepare(self) -> bool:
+        """Read the file, apply the patches to the model, and compute the patched contents.
+        Return False if the file changed since it was read (the model is left as it is).
+
+        If the locations of the links are known (see `Span`), only the changed destinations
+        are spliced into the file, and every other byte is left as it was. Otherwise the
+        file is parsed again, and the whole document is rendered with the changes.
+        """
+        self.__undo = [(link, link.dest, link.span) for link in self.file.links]
+        if all(link.span is not None for link in self.file.links):
+            return self.__splice()
+        return self.__render()
+
+    def revert(self) -> None:
+        """Undo the changes `prepare` made to the model."""
+        for link, dest, span in self.__undo:
+            new_dest = link.get_dest()
+            if new_dest != dest:
+                link.set_dest(dest)
+                self.tree.on_link_changed(self.file.path, link, new_dest)
+            link.span = span
+
+    def write(self) -> None:
+        """Write the patched contents to a temporary file next to the target. Does not
+        touch the model, so targets can be written in parallel.
+        """
+        path = self.file.path
+        fd, self.__temp = tempfile.mkstemp(dir=str(path.parent), prefix='.' + path.name + '.',
+                                           suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8', newline=self.__newline) as f:   # pylint: disable=invalid-name
+                f.writelines(self.patched)  # type: ignore
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(self.__temp, stat.S_IMODE(os.stat(path).st_mode))
+        except BaseException:
+            self.discard()
+            raise
+
+    def commit(self) -> None:
+        """Replace the target with the temporary file written by `write`."""
+        os.replace(self.__temp, self.file.path)     # type: ignore
+        self.__temp = None
+
+    def discard(self) -> None:
+        """Remove the temporary file written by `write`, if any."""
+        if self.__temp is not None:
+            try:
+                os.remove(self.__temp)
+            except OSError:
+                pass
+            self.__temp = None
+
+    def restore(self) -> None:
+        """Put the original contents back after `commit` (in the same way it was written)."""
+        self.patched = [self.original]      # type: ignore
+        self.write()
+        self.commit()
+
+    def diff(self, base: Path) -> str:
+        """Unified diff of the patched contents against the original, with the paths
+        relative to `base`.
+        """
+        name = util.path_to_href(self.file.path, base) or str(self.file.path)
+        lines = difflib.unified_diff(self.__lines(self.original),    # type: ignore
+                                     self.__lines("".join(self.patched)),  # type: ignore
+                                     'a/' + name, 'b/' + name)
+        return "".join(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n'
+                       for line in lines)
+
+    @staticmethod
+    def __lines(text: str) -> List[str]:
+        return re.findall(r"[^\n]*\n|[^\n]+$", text)
+
+    def __not_patched(self) -> None:
+        print(util.clr("RED") + "Not patched, changed since it was read: " +
+              str(self.file.path) + util.clr(""))
+
+    @staticmethod
+    def __raw_offsets(raw: str) -> Callable[[int], int]:
+        """Return a function mapping the offsets in `raw` with the line endings normalized to
+        '\\n' (which the spans of the links refer to) to the offsets in `raw`.
+        """
+
+        normalized = [0]
+        original = [0]
+        for match in re.finditer(r"\r\n|\r|\n", raw):
+            normalized.append(normalized[-1] + match.start() - original[-1] + 1)
+            original.append(match.end())
+
+        def to_raw(offset: int) -> int:
+            k = bisect_right(normalized, offset) - 1
+            return original[k] + offset - normalized[k]
+        return to_raw
+
+    @staticmethod
+    def __is_dest(written: str, dest: str) -> bool:
+        """Check that `written` is the destination `dest`, as written in the markdown."""
+        if written[:1] == '<' and written[-1:] == '>':
+            written = written[1:-1]
+        return rc_literal.sub(r"\1", written) == dest
+
+    @staticmethod
+    def __is_at_span(text: str, link: Link) -> bool:
+        """Check that `text` still has the destination of `link` at its span."""
+        if link.span is None:
+            return False
+        start, end, _, _, _, reference, def_start, def_end = link.span
+        written = text[start:end]
+        if reference:
+            return text[start - 1:start] == ']' and (
+                not written or written[0] == '[' and written[-1] == ']') and \
+                PatchTarget.__is_dest(text[def_start:def_end], link.dest)
+        return PatchTarget.__is_dest(written, link.dest)
+
+    def __splice(self) -> bool:
+        with open(self.file.path, encoding='utf-8', newline='') as f:   # pylint: disable=invalid-name
+            raw = f.read()
+        text = raw.replace('\r\n', '\n').replace('\r', '\n') if '\r' in raw else raw
+
+        # The links must still be where they were when the file was read. (Checking just the
+        # spans keeps the cost of patching independent of the size of the file.)
+        links = self.file.links
+        if not all(self.__is_at_span(text, link) for link in links):
+            self.__not_patched()
+            return False
+        dests = [link.dest for link in links]
+        self.original = raw
+        self.__newline = ''
+
+        for patch in self.patches:
+            patch.apply(self.tree)
+
+        # The links using each reference definition: if they were all changed alike, the
+        # definition is changed, rather than each of them.
+        uses: Dict[Tuple[int, int], List[Tuple[Link, str]]] = {}
+        for link, dest in zip(links, dests):
+            if link.span is not None and link.span.reference:
+                uses.setdefault((link.span.def_start, link.span.def_end), []).append((link, dest))
+        definitions = {span: used[0][0].dest for span, used in uses.items()
+                       if all(link.dest != dest and link.dest == used[0][0].dest
+                              for link, dest in used)}
+
+        # Replacements of the changed destinations, by offset in the file
+        edits = []
+        for (def_start, def_end), new_dest in definitions.items():
+            edits.append((def_start, def_end, Link.format_dest(new_dest)))
+        for link, dest in zip(links, dests):
+            span = link.span
+            if link.dest == dest or span is None:
+                continue
+            new = Link.format_dest(link.dest)
+            if not span.reference:
+                edits.append((span.start, span.end, new))
+            elif (span.def_start, span.def_end) not in definitions:
+                edits.append((span.start, span.end, '(' + new + ')'))
+        if not edits:
+            return True
+        edits.sort()    # A link can contain an image, which comes after it in `links`
+        raw_edits = edits
+        if '\r' in raw:
+            to_raw = self.__raw_offsets(raw)
+            raw_edits = [(to_raw(start), to_raw(end), new) for start, end, new in edits]
+
+        # The untouched text between the edits, and the replacements
+        self.patched = []
+        pos = 0
+        for start, end, new in raw_edits:
+            self.patched += [raw[pos:start], new]
+            pos = end
+        self.patched.append(raw[pos:])
+
+        self.__move_spans(edits)
+        return True
+
+    def __move_spans(self, edits: List[Tuple[int, int, str]]) -> None:
+        """Update the spans of the links of the file after `edits` (which do not add or
+        remove lines) were made, so that the model matches the file again.
+        """
+
+        starts = [start for start, _, _ in edits]
+        deltas = [0]
+        for start, end, new in edits:
+            deltas.append(deltas[-1] + len(new) - (end - start))
+
+        def moved(offset: int) -> int:
+            """New offset of the text at `offset`, which is not in an edit. (Text inserted
+            at `offset` goes before it.)
+            """
+            k = bisect_left(starts, offset)
+            if k < len(starts) and starts[k] == offset and edits[k][1] == offset:
+                k += 1
+            return offset + deltas[k]
+
+        def edited(start: int) -> Optional[int]:
+            """Index of the edit at `start`, if any."""
+            k = bisect_left(starts, start)
+            return k if k < len(starts) and starts[k] == start else None
+
+        for link in self.file.links:
+            if link.span is None:
+                continue
+            start, end, offset, line, column, reference, def_start, def_end = link.span
+            line_start = offset - column + 1
+            offset, line_start = moved(offset), moved(line_start)
+            k = edited(start)
+            if k is not None:
+                # The link was changed; it is an inline link now.
+                start += deltas[k] + (1 if reference else 0)
+                end = start + len(Link.format_dest(link.dest))
+                reference = False
+                def_start = def_end = 0
+            else:
+                start, end = moved(start), moved(end)
+            if reference:
+                k = edited(def_start)
+                if k is not None:
+                    # The definition was changed
+                    def_start += deltas[k]
+                    def_end = def_start + len(edits[k][2])
+                else:
+                    def_start, def_end = moved(def_start), moved(def_end)
+            link.span = Span(start, end, offset, line, offset - line_start + 1, reference,
+                             def_start, def_end)
+
+    def __render(self) -> bool:
+        # The model does not keep the ASTs of the files: the changed link destinations are
+        # transferred to the Link/Image nodes of a new AST (which are in the same order as
+        # the links of the file in the model).
+        with open(self.file.path, encoding='utf-8') as f:      # pylint: disable=invalid-name
+            self.original = f.read()
+        match, doc, _, link_nodes = parse_markdown(self.original)
+        if [node.dest for node in link_nodes] != [link.dest for link in self.file.links]:
+            self.__not_patched()
+            return False
         for patch in self.patches:
-            patch.apply()
-        with open(self.file.path, 'w', encoding='utf-8') as f:      # pylint: disable=invalid-name
-            rendered = self.file.marko.render(self.file.m_document) # type: ignore
-            f.write(rendered)
+            patch.apply(self.tree)
+        for link, node in zip(self.file.links, link_nodes):
+            node.dest = link.dest
+        self.patched = [match.render(doc)]
+        self.__newline = None
+        return True
 
 
 class Patches:
     """Describes all patches to be applied during this session."""
 
-    tree:    Tree
-    targets: Dict[Path, PatchTarget] = {}   # Patch targets
-    empty:   bool       = True
+    tree:           Tree
+    targets:        Dict[Path, PatchTarget]     # Patch targets
+    empty:          bool
 
-    def __init__(self, tree: Tree):
+    dry_run:        bool            # Print diffs instead of writing
+    all_or_nothing: bool            # Patch all files, or none
+    jobs:           Optional[int]   # Number of threads writing files (None: default)
+
+    def __init__(self, tree: Tree, dry_run: bool = False, all_or_nothing: bool = False,
+                 jobs: Optional[int] = None):
         self.tree = tree
+        self.targets = {}
+        self.empty = True
+        self.dry_run = dry_run
+        self.all_or_nothing = all_or_nothing
+        self.jobs = jobs
 
     def add(self, patch: Patch) -> None:
         """Register a patch."""
         self.empty = False
         file: File = self.tree.files[patch.target]
-        self.targets.setdefault(patch.target, PatchTarget(file)).add_patch(patch)
+        self.targets.setdefault(patch.target, PatchTarget(self.tree, file)).add_patch(patch)
+
+    def apply(self) -> bool:
+        """Apply all registered patches (see the module docstring).
+        Return False if some files were not patched.
+        """
+
+        targets = list(self.targets.values())
+        prepared = [target for target in targets if target.prepare()]
+        ok = len(prepared) == len(targets)
+
+        if self.dry_run:
+            for target in prepared:
+                if target.patched is not None:
+                    print(target.diff(self.tree.base), end='')
+                target.revert()
+            return ok
+        if not ok and self.all_or_nothing:
+            self.__roll_back(prepared, [])
+            return False
+
+        # Write the files in parallel; rename them over the targets in order.
+        to_write = [target for target in prepared if target.patched is not None]
+        with ThreadPoolExecutor(self.jobs) as executor:
+            errors = list(executor.map(self.__try(PatchTarget.write), to_write))
+        written = [target for target, error in zip(to_write, errors) if not error]
+        ok = ok and len(written) == len(to_write)
+        if not ok and self.all_or_nothing:
+            self.__roll_back(prepared, [])
+            return False
+
+        committed: List[PatchTarget] = []
+        for target in written:
+            if self.__try(PatchTarget.commit)(target):
+                ok = False
+                if self.all_or_nothing:
+                    self.__roll_back(prepared, committed)
+                    return False
+            else:
+                committed.append(target)
+        for target in set(prepared) - set(committed):
+            if target.patched is not None:
+                target.revert()
+        return ok
+
+    @staticmethod
+    def __try(step: Callable[[PatchTarget], None]) -> Callable[[PatchTarget], bool]:
+        """Wrap a step of writing a target, so that it reports errors and returns True on
+        failure, instead of raising.
+        """
+        def run(target: PatchTarget) -> bool:
+            try:
+                step(target)
+                return False
+            except OSError as exc:
+                print(util.clr("RED") + "Could not write " + str(target.file.path) + ": " +
+                      str(exc) + util.clr(""))
+                target.discard()
+                return True
+        return run
 
-    def apply(self) -> None:
-        """Apply all registered patches."""
-        for target in self.targets.values():
-            target.apply()
+    def __roll_back(self, prepared: List[PatchTarget], committed: List[PatchTarget]) -> None:
+        """Undo the changes made to the files and to the model."""
+        for target in prepared:
+            target.discard()
+        for target in committed:
+            self.__try(PatchTarget.restore)(target)
+        for target in prepared:
+            target.revert()
+        print(util.clr("RED") + "No files were patched" + util.clr(""))
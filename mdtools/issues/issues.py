@@ -40,6 +40,13 @@ class LinkIssue(Issue):
         super().__init__(path)
         self.link = link
 
+    def location(self) -> str:
+        """Line and column of the link in the file, as a suffix for `describe`, if known."""
+        span = self.link.span
+        if span is None:
+            return ""
+        return clr("GREY") + " ({}:{})".format(span.line, span.column) + clr("")
+
 
 class TargetNotFound(LinkIssue):
     """Class for the 'target not found' issue
@@ -47,7 +54,8 @@ class TargetNotFound(LinkIssue):
     """
 
     def describe(self):
-        return clr("YELLOW") + "   Target not found: " + clr("") + self.link.get_dest()
+        return clr("YELLOW") + "   Target not found: " + clr("") + self.link.get_dest() \
+            + self.location()
 
 
 class AnchorNotFound(LinkIssue):
@@ -56,4 +64,27 @@ class AnchorNotFound(LinkIssue):
     """
 
     def describe(self):
-        return clr("YELLOW") + "   Anchor not found: " + clr("") + self.link.get_dest()
+        return clr("YELLOW") + "   Anchor not found: " + clr("") + self.link.get_dest() \
+            + self.location()
+
+
+class ExternalLinkBroken(LinkIssue):
+    """Class for the 'external link broken' issue
+    (an http or https link whose URL does not work; see `external`).
+    """
+
+    # HTTP status of the final response, or 0 if there was none.
+    status: int
+
+    # Reason phrase of the response, or what went wrong.
+    reason: str
+
+    def __init__(self, path: Path, link: Link, status: int, reason: str) -> None:
+        super().__init__(path, link)
+        self.status = status
+        self.reason = reason
+
+    def describe(self):
+        what = (str(self.status) + ' ' + self.reason) if self.status else self.reason
+        return clr("YELLOW") + "   External link broken: " + clr("") + self.link.get_dest() \
+            + clr("GREY") + " (" + what.strip() + ")" + clr("") + self.location()
@@ -0,0 +1,174 @@
+"""Machine-readable reports of issues, written as the issues are found.
+
+- jsonl: one JSON object per line, per issue.
+- sarif: a SARIF 2.1.0 log (https://docs.oasis-open.org/sarif/sarif/v2.1.0/), with one
+  result per issue. The log is written incrementally too: the results are elements of an
+  array which is only closed by `close`.
+
+Several trees can be reported together (see `root`): their issues are in a section (a
+SARIF run) per tree.
+
+The output is flushed after each issue, so that it can be consumed while the check runs.
+"""
+
+
+import json
+import textwrap
+from pathlib import Path
+from typing import Dict, List, Any, TextIO, Type, Union
+from urllib.parse import quote
+
+from mdtools.issues import issues
+from mdtools import util
+
+
+# Issue types, by class: the rule id, and a short description.
+RULES = {
+    issues.TargetNotFound:  ('target-not-found', "Target not found"),
+    issues.AnchorNotFound:  ('anchor-not-found', "Anchor not found"),
+    issues.DuplicateAnchor: ('duplicate-anchor', "Duplicate anchor"),
+    issues.ExternalLinkBroken: ('external-link-broken', "External link broken"),
+}
+
+
+def record(issue: issues.Issue, base: Path, suggestions: List[str]) -> Dict[str, Any]:
+    """Plain data describing `issue`: its type, the file (absolute, and relative to `base`),
+    the destination and the location of the link (for link issues), the anchor (for anchor
+    issues), and the destinations the link could be fixed to.
+    """
+
+    rule, description = RULES.get(type(issue), (type(issue).__name__, type(issue).__name__))
+    out: Dict[str, Any] = {
+        'type':     rule,
+        'message':  description,
+        'path':     str(issue.path),
+        'file':     util.path_to_href(issue.path, base) or str(issue.path),
+    }
+    if isinstance(issue, issues.LinkIssue):
+        span = issue.link.span
+        out['dest'] = issue.link.get_dest()
+        out['line'] = span.line if span else None
+        out['column'] = span.column if span else None
+        out['suggestions'] = suggestions
+        if isinstance(issue, issues.ExternalLinkBroken):
+            out['status'] = issue.status
+            out['reason'] = issue.reason
+    elif isinstance(issue, issues.DuplicateAnchor):
+        out['anchor'] = issue.anchor.name
+    return out
+
+
+class JsonlWriter:
+    """Writes issues as JSON lines. Each record has the base of its tree, as `root`."""
+
+    out:    TextIO
+    base:   Path
+
+    def __init__(self, out: TextIO, base: Path) -> None:
+        self.out = out
+        self.base = base
+
+    def root(self, base: Path) -> None:
+        """Write the issues of another tree, with the base `base`, from now on."""
+        self.base = base
+
+    def write(self, issue: issues.Issue, suggestions: List[str]) -> None:
+        """Write an issue, and the destinations its link could be fixed to."""
+        rec = record(issue, self.base, suggestions)
+        rec['root'] = str(self.base)
+        self.out.write(json.dumps(rec) + '\n')
+        self.out.flush()
+
+    def close(self) -> None:
+        """Finish the output."""
+        self.out.flush()
+
+
+# Closes the array of results of a SARIF run, and the run.
+CLOSE_RUN = '\n      ]\n    }'
+
+
+class SarifWriter:
+    """Writes issues as a SARIF log, with a run per tree."""
+
+    out:    TextIO
+    base:   Path
+
+    # Number of results written so far, in the current run
+    count:  int
+
+    # Number of runs started so far
+    runs:   int
+
+    def __init__(self, out: TextIO, base: Path) -> None:
+        self.out = out
+        self.runs = 0
+        head = {
+            '$schema':  'https://json.schemastore.org/sarif-2.1.0.json',
+            'version':  '2.1.0',
+            'runs':     [],
+        }
+        # Everything up to the (open) array of runs
+        text = json.dumps(head, indent=2)
+        self.out.write(text[:text.rindex('[]')] + '[\n')
+        self.root(base)
+
+    def root(self, base: Path) -> None:
+        """Write the issues of another tree, with the base `base`, from now on (in a new
+        run).
+        """
+
+        if self.runs:
+            self.out.write(CLOSE_RUN + ',\n')
+        self.base = base
+        self.count = 0
+        self.runs += 1
+
+        rules = [{'id': rule, 'shortDescription': {'text': description}}
+                 for rule, description in RULES.values()]
+        run = {
+            'tool': {'driver': {'name': 'mdlinkcheck', 'rules': rules}},
+            'originalUriBaseIds': {'ROOT': {'uri': base.as_uri() + '/'}},
+            'results': [],
+        }
+        # Everything up to the (open) array of results, indented as an element of the runs
+        text = textwrap.indent(json.dumps(run, indent=2), '    ')
+        self.out.write(text[:text.rindex('[]')] + '[')
+        self.out.flush()
+
+    def write(self, issue: issues.Issue, suggestions: List[str]) -> None:
+        """Write an issue, and the destinations its link could be fixed to."""
+
+        rec = record(issue, self.base, suggestions)
+        text = rec['message'] + ': ' + rec.get('dest', rec.get('anchor', ''))
+        location: Dict[str, Any] = {
+            'artifactLocation': {'uri': quote(rec['file']), 'uriBaseId': 'ROOT'}}
+        if rec.get('line'):
+            location['region'] = {'startLine': rec['line'], 'startColumn': rec['column']}
+        result = {
+            'ruleId':       rec['type'],
+            'level':        'error' if isinstance(issue, issues.LinkIssue) else 'warning',
+            'message':      {'text': text},
+            'locations':    [{'physicalLocation': location}],
+        }
+        if rec.get('suggestions'):
+            result['properties'] = {'suggestions': rec['suggestions']}
+
+        self.out.write((',' if self.count else '') + '\n' + json.dumps(result))
+        self.out.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        """Finish the output: close the array of results, the run, and the log."""
+        self.out.write(CLOSE_RUN + '\n  ]\n}\n')
+        self.out.flush()
+
+
+# A writer of any of the formats.
+Writer = Union[JsonlWriter, SarifWriter]
+
+# Writers, by name of the format.
+writers: Dict[str, Type[Writer]] = {
+    'jsonl': JsonlWriter,
+    'sarif': SarifWriter,
+}
@@ -21,16 +21,30 @@ Terms:
   hrefs and anchors are each optional (but one of them must be present).
 """
 
+import os
 import sys
 import getopt
+import contextlib
+import dataclasses
+import cProfile
 from pathlib import Path
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Tuple, Callable, Iterable, Optional, TextIO
 
-from mdtools import util
-from mdtools.model.tree import Tree
+from mdtools import util, profiling
+from mdtools.model.tree import Tree, Link
+from mdtools.changes import changed_since, affected_links
+from mdtools.issues.issues import Issue
 from mdtools.model import read_md_tree
-from mdtools.issues import analyze
+from mdtools.model.cache import ParseCache
+from mdtools.model.walk import Walker
+from mdtools.issues import analyze, iter_issues, report
+from mdtools.issues.external import Checker, UrlCache, check_external
+from mdtools.issues.fix.link_issues import suggest
 from mdtools.issues.fix.options import Options
 from mdtools.issues.fix import fix_all
+from mdtools.pipeline import Pipeline
+from mdtools.watch import watch
 
 # pylint: disable=multiple-statements
 
@@ -40,16 +54,118 @@ from mdtools.issues.fix import fix_all
 def print_usage():
     """Print info about the command-line arguments of the script."""
     print("""
-Usage: link_checker.py <modes and options> <markdown_dir_root>
+Usage: link_checker.py <modes and options> <markdown_dir_root>...
+Several trees can be checked in one run: each is checked on its own (its absolute hrefs are
+relative to its root), and reported in a section of its own, followed by a summary. The
+trees share the parse cache and the -j worker processes.
 Modes:
     <nothing>: Just check the links and print results.
     -i: Fix interactively with automatic suggestions.
     -a: Fix non-ambiguous cases automatically. Skip otherwise.
 Options:
-    -f: If interactive mode, use fuzzy matching for suggestions. Slower.
+    -f: Use fuzzy matching for suggestions in interactive mode (or --format). Slower. In
+        automatic mode, also fix names and anchors which are not found, if exactly one is
+        the closest match.
+    --dry-run: Do not change any files; print the changes as unified diffs instead.
+    --all-or-nothing: If any of the files cannot be patched, do not change any of them.
     -c: Colorize output for better readability.
+    --format=FORMAT: Output format of the issues: text (default), jsonl (a JSON object per
+        line) or sarif (a SARIF 2.1.0 log). In jsonl and sarif, each issue is written (and
+        flushed) as soon as it is found, with the destinations the link could be fixed to,
+        and all other output goes to the standard error. Not with -i or -a.
+    --external: Also check the http and https links. Each distinct URL is requested once,
+        with HEAD (then GET if that fails), following redirects. The results are cached
+        (see --external-ttl; not with --no-cache). Not with --stream; not re-checked
+        with --watch.
+    --external-jobs=N: Check at most N URLs at a time (default: 20).
+    --external-per-host=N: At most N requests at a time to each host (default: 4).
+    --external-rate=R: At most R requests per second to each host (default: no limit).
+    --external-ttl=SECONDS: How long the results of checking URLs are cached (default:
+        86400, a day).
+    --stream: Check in a single pass, reporting issues while the tree is being read: the
+        links of each file are checked as soon as it is parsed, and links to files not seen
+        yet are checked once they are. Issues are not grouped by file, links are not kept
+        in memory, and no fixes are suggested. Not with -i, -a, --watch, --backlinks or
+        --changed-since.
+    --changed-since=REV: Only check the links that the changes since the git revision REV
+        (committed or not, and untracked files) could have broken: the links in the files
+        added or modified, and the links to the files deleted, renamed or modified. The
+        whole tree is still read (from the parse cache, for the files which did not
+        change), so the issues are the same as those of a full check, for these links.
+    -j N, --jobs=N: Parse markdown files in N processes (0: one per CPU).
+    --exclude=PATTERN: Do not walk the paths matching PATTERN, a .gitignore-style pattern
+        relative to <markdown_dir_root> (e.g. node_modules/ or /build). Can be repeated.
+        The patterns in the .gitignore and .mdignore files in the tree apply too, and
+        --exclude patterns take precedence over them. Links to excluded paths are reported
+        as broken.
+    --no-ignore: Do not read the .gitignore and .mdignore files.
+    --follow-links: Walk the directories that symbolic links point to (each directory is
+        walked once, so link loops are safe).
+    --stat-threads=N: List directories in N threads ahead of the walk; for slow (e.g.
+        network) file systems.
+    --no-cache: Do not use the parse cache (re-parse all files).
+    --cache=FILE: Location of the parse cache (default: ~/.cache/mdtools/parse-cache.sqlite).
+    --cache-stats: Print parse cache statistics.
+    --watch: After checking, keep running and re-check what is affected by each change
+        to the tree. Fixes are not made for the re-checked links. Only with a single tree.
+    --backlinks=PATH[#ANCHOR]: Instead of checking, list the links pointing at the file
+        or directory PATH (at the anchor ANCHOR in it, if specified).
+    --profile: At the end, print the wall and CPU time of each phase of the run (walk,
+        read, parse, analyze, fuzzy matching, patch...), counts of files, links, anchors
+        and issues, and the files which took longest to parse.
+    --profile-json=FILE: Same as --profile, but write the report to FILE as JSON
+        ('-' for the standard output).
+    --slowest=N: Number of slowest files to report with --profile (default: 10).
+    --cprofile=FILE: Run under cProfile, and write the statistics to FILE (for pstats or
+        snakeviz). Only covers this process, not the -j worker processes.
 """)
 
+# -----------------------------------------------------------------------------
+# Queries
+
+def print_backlinks(tree: Tree, query: str) -> None:
+    """Print the links pointing at `query` (a path, optionally followed by #anchor)."""
+
+    path, anchor = Link.split_link(query)
+    found = tree.links_to(Path(path).resolve(), anchor)
+
+    by_file: Dict[Path, List[Link]] = {}
+    for linking, link in found:
+        by_file.setdefault(linking, []).append(link)
+    for linking, links in by_file.items():
+        print(util.clr("BOLD") + str(linking) + util.clr(""))
+        for link in links:
+            print("   -> " + link.get_dest())
+    print(str(len(found)) + " link(s) in " + str(len(by_file)) + " file(s)")
+
+# -----------------------------------------------------------------------------
+# Profiling
+
+def __print_profile(trees: List[Tree], issues: list, opt: Options,
+                    links: Optional[int] = None) -> None:
+    """If profiling, complete the profile with the size of the trees and the number of
+    `issues` found, and print it. `links`: the number of links, if not kept in the trees.
+    """
+
+    profile = profiling.current
+    if not profile:
+        return
+    files = [f for tree in trees for f in tree.files.values()]
+    profile.counts['files'] = len(files)
+    profile.counts['markdown files'] = sum(1 for f in files if f.path.suffix == '.md')
+    profile.counts['links'] = sum(len(f.links) for f in files) if links is None else links
+    profile.counts['anchors'] = sum(len(f.anchors) + len(f.h_anchors) for f in files)
+    profile.counts['issues'] = len(issues)
+
+    if opt.profile:
+        print(util.clr("BOLD") + "Profile:" + util.clr(""))
+        print(profile.describe(opt.slowest))
+    if opt.profile_json == '-':
+        print(profile.to_json(opt.slowest))
+    elif opt.profile_json:
+        with open(opt.profile_json, 'w', encoding='utf-8') as out:
+            out.write(profile.to_json(opt.slowest) + '\n')
+
 # -----------------------------------------------------------------------------
 # Argument parsing
 
@@ -57,13 +173,20 @@ def main():
     """Script entry point"""
 
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], "ifac")
+        optlist, args = getopt.getopt(sys.argv[1:], "ifacj:",
+                                      ["jobs=", "no-cache", "cache=", "cache-stats",
+                                       "watch", "backlinks=", "dry-run", "all-or-nothing",
+                                       "profile", "profile-json=", "slowest=", "cprofile=",
+                                       "format=", "stream", "changed-since=", "exclude=", "no-ignore",
+                                       "follow-links", "stat-threads=", "external",
+                                       "external-jobs=", "external-per-host=",
+                                       "external-rate=", "external-ttl="])
     except getopt.GetoptError as exc:
         print(exc.msg + "\n")
         print_usage()
         exit()
 
-    if len(args) != 1:
+    if not args:
         print_usage()
         exit()
 
@@ -73,10 +196,83 @@ def main():
         elif o[0] == '-a': opt.mode = '-a'
         elif o[0] == '-f': opt.fuzzy = True
         elif o[0] == '-c': opt.colorize = True
+        elif o[0] in ('-j', '--jobs'):
+            try:
+                opt.jobs = int(o[1])
+            except ValueError:
+                print("Invalid number of jobs: " + o[1] + "\n")
+                print_usage()
+                exit()
+        elif o[0] == '--no-cache': opt.cache = False
+        elif o[0] == '--cache': opt.cache_file = o[1]
+        elif o[0] == '--cache-stats': opt.cache_stats = True
+        elif o[0] == '--watch': opt.watch = True
+        elif o[0] == '--backlinks': opt.backlinks = o[1]
+        elif o[0] == '--dry-run': opt.dry_run = True
+        elif o[0] == '--all-or-nothing': opt.all_or_nothing = True
+        elif o[0] == '--profile': opt.profile = True
+        elif o[0] == '--profile-json': opt.profile_json = o[1]
+        elif o[0] == '--slowest':
+            try:
+                opt.slowest = int(o[1])
+            except ValueError:
+                print("Invalid number of files: " + o[1] + "\n")
+                print_usage()
+                exit()
+        elif o[0] == '--cprofile': opt.cprofile = o[1]
+        elif o[0] == '--format': opt.format = o[1]
+        elif o[0] == '--stream': opt.stream = True
+        elif o[0] == '--changed-since': opt.changed_since = o[1]
+        elif o[0] == '--exclude': opt.exclude.append(o[1])
+        elif o[0] == '--no-ignore': opt.ignore_files = False
+        elif o[0] == '--follow-links': opt.follow_links = True
+        elif o[0] == '--stat-threads':
+            try:
+                opt.stat_threads = int(o[1])
+            except ValueError:
+                print("Invalid number of threads: " + o[1] + "\n")
+                print_usage()
+                exit()
+        elif o[0] == '--external': opt.external = True
+        elif o[0].startswith('--external-'):
+            field = o[0][2:].replace('-', '_')
+            try:
+                setattr(opt, field, type(getattr(opt, field))(o[1]))
+            except ValueError:
+                print("Invalid value of " + o[0] + ": " + o[1] + "\n")
+                print_usage()
+                exit()
 
-    root_dir = args[0]
-    if not Path(root_dir).resolve().exists():
-        print("Input path " + root_dir + " does not exist\n")
+    for root_dir in args:
+        if not Path(root_dir).resolve().exists():
+            print("Input path " + root_dir + " does not exist\n")
+            print_usage()
+            exit()
+
+    if opt.watch and len(args) > 1:
+        print("--watch cannot be used with several trees\n")
+        print_usage()
+        exit()
+
+    if opt.format != 'text':
+        error = None
+        if opt.format not in report.writers:
+            error = "Unknown format: " + opt.format
+        elif opt.mode:
+            error = "--format=" + opt.format + " cannot be used to fix issues (" + opt.mode + ")"
+        elif opt.watch and opt.format == 'sarif':
+            error = "--format=sarif cannot be used with --watch"
+        if error:
+            print(error + "\n")
+            print_usage()
+            exit()
+
+    if opt.stream and (opt.mode or opt.watch or opt.backlinks or opt.external or
+                       opt.changed_since):
+        print("--stream cannot be used with " +
+              (opt.mode or ('--watch' if opt.watch else
+                            '--backlinks' if opt.backlinks else
+                            '--external' if opt.external else '--changed-since')) + "\n")
         print_usage()
         exit()
 
@@ -85,13 +281,203 @@ def main():
         from colorama import init as colorama_init  # type: ignore
         colorama_init()
 
-    # -----------------------------------------------------------------------------
-    # Doing the thing
+    if opt.profile or opt.profile_json:
+        profiling.current = profiling.Profile()
+
+    # With a machine-readable format, the standard output only carries the issues.
+    out = sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr if opt.format != 'text' else out):
+            if not opt.cprofile:
+                run(args, opt, out)
+                return
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                run(args, opt, out)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(opt.cprofile)
+    except BrokenPipeError:
+        # Whoever reads the output stopped reading (e.g. `| head`)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------
+# Doing the thing
+
+def write_issues(found: Iterable[Issue], tree: Tree, writer: report.Writer, opt: Options,
+                 suggestions: bool = True) -> List[Issue]:
+    """Write the issues `found` with `writer` (see `report`), one by one, with the
+    destinations their links could be fixed to (unless `suggestions` is False). Return the
+    issues.
+    """
+
+    out = []
+    for issue in found:
+        writer.write(issue, suggest(issue, tree, opt.fuzzy) if suggestions else [])
+        out.append(issue)
+    return out
+
+
+def print_issues(found: Iterable[Issue]) -> List[Issue]:
+    """Print the issues `found` one by one, each under the path of its file (printed again
+    whenever the file changes). Return the issues.
+    """
+
+    out: List[Issue] = []
+    for issue in found:
+        if not out or out[-1].path != issue.path:
+            print(util.clr("BOLD") + str(issue.path) + util.clr(""))
+        print(issue.describe())
+        out.append(issue)
+    return out
+
+
+def __close_cache(cache: Optional[ParseCache], opt: Options) -> None:
+    if cache:
+        cache.close()
+        if opt.cache_stats:
+            print(cache.stats.describe())
+
+
+def run_stream(tree: Tree, cache: Optional[ParseCache], walker: Walker, opt: Options,
+               writer: Optional[report.Writer] = None, pool: Optional[Executor] = None
+               ) -> Tuple[List[Issue], int]:
+    """Check the markdown tree in a single pass (see `pipeline`), reporting issues as they
+    are found: with `writer` (see `report`), if given, else as text. Parse the files in the
+    worker processes of `pool`, if given. Return the issues, and the number of links.
+    """
+
+    pipeline = Pipeline(tree, opt.jobs, cache, 'scan', walker=walker, pool=pool)
+    if writer is None:
+        issues = print_issues(pipeline.run())
+    else:
+        # Suggestions would be made from a partial tree
+        issues = write_issues(pipeline.run(), tree, writer, opt, suggestions=False)
+    return issues, pipeline.links
+
+
+def check_urls(tree: Tree, opt: Options,
+               links: Optional[List[Tuple[Path, Link]]] = None) -> List[Issue]:
+    """Check the external links of the tree (only `links`, if given; see `external`).
+    Return the issues.
+    """
+
+    url_cache = UrlCache(ttl=opt.external_ttl) if opt.cache else None
+    checker = Checker(opt.external_jobs, opt.external_per_host, opt.external_rate,
+                      cache=url_cache)
+    try:
+        return check_external(tree, checker, links)
+    finally:
+        if url_cache:
+            url_cache.close()
+
+
+def check(tree: Tree, opt: Options, writer: Optional[report.Writer] = None,
+          links: Optional[List[Tuple[Path, Link]]] = None,
+          files: Iterable[Path] = ()) -> Tuple[List[Issue], Callable]:
+    """Check (and fix) the markdown tree, which has been read: only `links`, and the anchors
+    of `files`, if given (see `iter_issues`). Report the issues with `writer` (see
+    `report`), if given, else as text. Return the issues, and the function reporting those
+    found later (e.g. by `watch`).
+    """
+
+    if writer is None:
+        issues = analyze(tree, links, files)
+        if opt.external:
+            issues += check_urls(tree, opt, links)
+        fix_all(issues, tree, opt)
+        check_only = dataclasses.replace(opt, mode='')
+        return issues, lambda found: fix_all(found, tree, check_only)
+
+    with profiling.phase('analyze'):
+        issues = write_issues(iter_issues(tree, links, files), tree, writer, opt)
+    if opt.external:
+        issues += write_issues(check_urls(tree, opt, links), tree, writer, opt)
+    return issues, lambda found: write_issues(found, tree, writer, opt)
+
+
+def __changed(tree: Tree, opt: Options
+              ) -> Tuple[Optional[List[Tuple[Path, Link]]], List[Path]]:
+    """With --changed-since, the links of the tree that the changes could affect (see
+    `changes`), and the changed files, whose anchors are checked too; else None (all
+    links).
+    """
+
+    if not opt.changed_since:
+        return None, []
+    try:
+        changes = changed_since(tree.base, opt.changed_since)
+    except ValueError as exc:
+        print(util.clr("RED") + "--changed-since: " + str(exc) + util.clr(""))
+        sys.exit(1)
+    links = affected_links(tree, changes)
+    print(util.clr("GREY") + "Checking {} link(s) affected by {} changed file(s)".format(
+        len(links), len(changes.modified | changes.deleted)) + util.clr(""))
+    return links, [path for path in tree.files if path in changes.modified]
+
+
+def run(root_dirs: List[str], opt: Options, out: TextIO) -> None:
+    """Check (and fix) the markdown trees at `root_dirs`, one after the other, in one
+    report: as text, under a heading per tree if there are several, followed by a summary;
+    or machine-readable (see `Options.format`), written to `out`, in a section per tree.
+
+    The trees share the parse cache, and the worker processes parsing the files. Each has
+    its own base, to which its absolute hrefs are relative.
+    """
+
+    cache = ParseCache(opt.cache_file or None) if opt.cache else None
+    walker = Walker(opt.exclude, opt.ignore_files, opt.follow_links, opt.stat_threads)
+    jobs = opt.jobs or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(jobs) if jobs > 1 and len(root_dirs) > 1 else None
+    writer: Optional[report.Writer] = None
+
+    trees: List[Tree] = []
+    issues: List[Issue] = []
+    found_in: List[int] = []
+    links = 0
+    try:
+        for root_dir in root_dirs:
+            # The scanner records where the links are, so that fixes are spliced into the
+            # files.
+            tree = Tree(root_dir)
+            trees.append(tree)
+            if opt.format != 'text':
+                if writer is None:
+                    writer = report.writers[opt.format](out, tree.base)
+                else:
+                    writer.root(tree.base)
+            elif len(root_dirs) > 1:
+                print(util.clr("BOLD") + "== " + str(tree.base) + util.clr(""))
+
+            if opt.stream:
+                found, tree_links = run_stream(tree, cache, walker, opt, writer, pool)
+                links += tree_links
+            else:
+                read_md_tree(tree, opt.jobs, cache, 'scan', walker, pool)
+                if opt.backlinks:
+                    print_backlinks(tree, opt.backlinks)
+                    continue
+                found, on_change = check(tree, opt, writer, *__changed(tree, opt))
+            issues += found
+            found_in.append(len(found))
+    finally:
+        if pool:
+            pool.shutdown()
+    if writer:
+        writer.close()
+    __close_cache(cache, opt)
+
+    if opt.format == 'text' and len(root_dirs) > 1 and not opt.backlinks:
+        print(util.clr("BOLD") + "Summary:" + util.clr(""))
+        for tree, count in zip(trees, found_in):
+            print("   " + str(count) + " issue(s) in " + str(tree.base))
+        print(str(len(issues)) + " issue(s) in " + str(len(trees)) + " tree(s)")
+    __print_profile(trees, issues, opt, links if opt.stream else None)
 
-    tree = Tree(root_dir)
-    read_md_tree(tree)
-    issues = analyze(tree)
-    fix_all(issues, tree, opt)
+    if opt.watch and not opt.backlinks:
+        watch(trees[0], on_change, walker=walker)
 
 
 if __name__ == "__main__":
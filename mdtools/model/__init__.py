@@ -1,98 +1,201 @@
 """This package provides a simple model of a markdown tree."""
 
+import contextlib
 import os
-import re
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Union, Tuple
-
-import marko # type: ignore
-from marko.md_renderer import MarkdownRenderer # type: ignore
+from typing import List, Dict, Optional, Sequence, Tuple
 
 from mdtools.model.tree import Tree, Anchor, Link
-from mdtools import util
+from mdtools.model.link import Span
+from mdtools.model.parse import Extract, extract_file
+from mdtools.model.scan import scan_file, scan_markdown
+from mdtools.model.cache import ParseCache
+from mdtools.model.walk import Walker, iter_walk
+from mdtools import util, profiling
 
 ###############################################################################
 
 
-ignore_paths = ['.git']
-
-RE_ANCHOR = r"""<a\s*(name|id).*?>"""
-rc_anchor = re.compile(RE_ANCHOR)
+# Extraction engines: functions returning the `Extract` of a markdown file (given its path,
+# and its contents if already read), or None.
+# - marko: builds a full AST, and extracts the data from it.
+# - scan: a fast scanner, which extracts the same data without an AST (see `scan`).
+# The ASTs are not kept in the model. The scanner records where the links are, so patches
+# are spliced into the files; files read with marko are parsed again to be patched.
+engines = {
+    'marko': extract_file,
+    'scan':  scan_file,
+}
 
 
 ###############################################################################
 
 
-def __on_link(path: Path, tree: Tree,
-              marko_node: Union[marko.inline.Link, marko.inline.Image]) -> None:
-    """Called when a link node is encountered in the AST."""
-    tree.on_link(path, Link(marko_node))
-
-def __on_image(path: Path, tree: Tree, marko_node: marko.inline.Image) -> None:
-    """Called when an image node is encountered in the AST."""
-    tree.on_link(path, Link(marko_node))
-
-def __on_inline_html(path: Path, tree: Tree, html: str) -> None:
-    """Called when inline HTML is encountered in the AST."""
-    match = rc_anchor.match(html)
-    if match:
-        tree.on_anchor(path, Anchor(html=html))
-
-def __on_heading(path: Path, tree: Tree, text: str) -> None:
-    """Called when a heading node is encountered in the AST."""
-    tree.on_heading_anchor(path, Anchor(heading=text))
-
-def __traverse_ast(path: Path, tree: Tree, node) -> None:
-    """Recursively traverse the AST produced by Marko, and update the markdown tree model."""
-
-    if isinstance(node, marko.inline.InlineHTML):
-        __on_inline_html(path, tree, node.children)
-    elif isinstance(node, marko.inline.Link):
-        __on_link(path, tree, node)
-    elif isinstance(node, marko.inline.Image):
-        __on_image(path, tree, node)
-    elif isinstance(node, marko.block.Heading):
-        text = node.children[0].children
-        if isinstance(text, str):
-            __on_heading(path, tree, text)
-
-    if hasattr(node, 'children') and isinstance(node.children, list):
-        for child in node.children:
-            __traverse_ast(path, tree, child)
-
-
-def read_md_tree(tree: Tree) -> None:
-    """Scan a markdown tree and populate the model."""
-
-    def parse_markdown(path: Path): #  -> Tuple[marko, Document]:
-        """Parse a markdown file and update the markdown tree model."""
-        with open(path, encoding='utf-8') as file:
-            markdown = file.read()
-        match = marko.Markdown(renderer = MarkdownRenderer)
-        doc = match.parse(markdown)
-        __traverse_ast(path, tree, doc)
-        return match, doc
-
-    # Walk the file tree
-    for dir_, dirs, files in os.walk(tree.base, topdown=True):
-        dirs[:] = [d for d in dirs if d not in ignore_paths]
-
-        for dir_name in dirs:
-            # Treat directories as files (for some links that can point to directories)
-            path = Path(dir_).joinpath(Path(dir_name)).resolve()
-            tree.on_file(path)
-
-        for file_name in files:
-            path = Path(dir_).joinpath(Path(file_name)).resolve()
-            the_file = tree.on_file(path)
-
-            ext = Path(file_name).suffix
-            if ext == '.md':
-                try:
-                    match, doc = parse_markdown(path)
-                    the_file.marko = match
-                    the_file.m_document = doc
-                except:
-                    print(util.clr("RED") + "Parser error in: " +  str(path) + util.clr(""))
-
-    tree.all_anchors = {**tree.anchors, **tree.h_anchors}
+def __merge(tree: Tree, path: Path, extract: Extract) -> None:
+    """Update the markdown tree model with the data extracted from the file at `path`."""
+
+    spans: Sequence[Optional[Span]] = extract.spans or [None] * len(extract.links)
+    for dest, span in zip(extract.links, spans):
+        tree.on_link(path, Link(dest, span))
+    for name in extract.anchors:
+        tree.on_anchor(path, Anchor(name=name))
+    for name in Anchor.headings_to_anchors(extract.headings):
+        tree.on_heading_anchor(path, Anchor(name=name))
+
+
+def __on_parser_error(path: Path) -> None:
+    print(util.clr("RED") + "Parser error in: " +  str(path) + util.clr(""))
+
+
+def __walk(tree: Tree, walker: Optional[Walker]) -> List[Path]:
+    """Walk the whole file tree (see `Walker.walk`). Return the paths of the markdown files."""
+    return [path for _, md_paths in iter_walk(tree, walker) for path in md_paths]
+
+
+def __unique_by_hash(paths: List[Path], cache: Optional[ParseCache]) -> Dict[Path, Path]:
+    """Map each of `paths` to the first path with the same content (as far as the cache
+    knows), so that byte-identical files are parsed only once.
+    """
+
+    first: Dict[str, Path] = {}
+    ret = {}
+    for path in paths:
+        hash_ = cache.content_hash(path) if cache else None
+        ret[path] = first.setdefault(hash_, path) if hash_ else path
+    return ret
+
+
+def __extract(engine: str, path: Path, data: Optional[bytes] = None) -> Optional[Extract]:
+    """Extract the data from the markdown file at `path` (with the contents `data`, if
+    already read) with `engine`.
+    """
+    with profiling.file(path):
+        return engines[engine](path, data)
+
+
+def __extract_profiled(engine: str, path: Path, data: Optional[bytes]
+                       ) -> Tuple[Optional[Extract], profiling.Profile]:
+    """Same as `__extract`, in a worker process, when profiling: also return the profile of
+    the extraction, for the parent process to merge.
+    """
+    profiling.current = profiling.Profile()
+    return __extract(engine, path, data), profiling.current
+
+
+def __read_parallel(md_paths: List[Path], extracts: Dict[Path, Optional[Extract]],
+                    jobs: int, engine: str, pool: Optional[Executor],
+                    contents: Dict[Path, Optional[bytes]]) -> None:
+    """Parse the markdown files in `jobs` worker processes (those of `pool`, if given).
+    contents: the contents of the files already read.
+    """
+
+    # Schedule large files first, so that a big file picked up last does not delay the end.
+    by_size = sorted(md_paths, key=os.path.getsize, reverse=True)
+    datas = [contents.get(path) for path in by_size]
+    chunksize = max(1, len(by_size) // (jobs * 16))
+    profile = profiling.current
+    with profiling.phase('workers'), \
+            contextlib.nullcontext(pool) if pool else ProcessPoolExecutor(jobs) as executor:
+        if profile is None:
+            extracts.update(zip(by_size, executor.map(engines[engine], by_size, datas,
+                                                      chunksize=chunksize)))
+            return
+        profile.jobs = jobs
+        for path, (extract, worker_profile) in zip(by_size, executor.map(
+                partial(__extract_profiled, engine), by_size, datas, chunksize=chunksize)):
+            extracts[path] = extract
+            profile.merge(worker_profile)
+
+
+def read_md_tree(tree: Tree, jobs: int = 1, cache: Optional[ParseCache] = None,
+                 engine: str = 'marko', walker: Optional[Walker] = None,
+                 pool: Optional[Executor] = None) -> None:
+    """Scan a markdown tree and populate the model.
+
+    jobs: number of processes to parse the markdown files with; 0 means one per CPU.
+    cache: if given, files found in the cache are not parsed, and parsed files are added to it.
+    engine: the extraction engine (see `engines`).
+    walker: walks the file tree, and decides which paths are excluded (see `walk`).
+    pool: if given, the worker processes to parse the markdown files in (e.g. shared by
+        several trees); `jobs` must be their number.
+    """
+
+    md_paths = __walk(tree, walker)
+
+    # None for the files that could not be parsed
+    extracts: Dict[Path, Optional[Extract]] = {}
+
+    pending = md_paths
+    with profiling.phase('cache'):
+        if cache:
+            pending = []
+            for path in md_paths:
+                extract = cache.get(path, engine)
+                if extract is None:
+                    pending.append(path)
+                else:
+                    extracts[path] = extract
+
+        firsts = __unique_by_hash(pending, cache)
+        to_parse = [path for path in pending if firsts[path] == path]
+        contents = {path: cache.content(path) for path in to_parse} if cache else {}
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs > 1 and len(to_parse) > 1:
+        __read_parallel(to_parse, extracts, jobs, engine, pool, contents)
+    else:
+        extracts.update((path, __extract(engine, path, contents.pop(path, None)))
+                        for path in to_parse)
+
+    with profiling.phase('cache'):
+        for path in pending:
+            extract = extracts[path] = extracts[firsts[path]]
+            if cache and extract is not None:
+                cache.put(path, extract)
+
+    # Merge in walk order, so that the model does not depend on how the files were read.
+    with profiling.phase('model'):
+        for path in md_paths:
+            extract = extracts[path]
+            if extract is None:
+                __on_parser_error(path)
+            else:
+                __merge(tree, path, extract)
+
+        tree.update_all_anchors()
+
+
+def read_md_file(tree: Tree, path: Path, cache: Optional[ParseCache] = None,
+                 engine: str = 'marko') -> bool:
+    """Parse a single markdown file, which is already registered in the tree, and add the
+    extracted data to the model. Call `tree.update_all_anchors` when done updating the tree.
+    Return False if the file could not be parsed.
+    """
+
+    extract = cache.get(path, engine) if cache else None
+    if extract is None:
+        extract = __extract(engine, path, cache.content(path) if cache else None)
+        if extract is None:
+            __on_parser_error(path)
+            return False
+        if cache:
+            cache.put(path, extract)
+    __merge(tree, path, extract)
+    return True
+
+
+def read_md_text(tree: Tree, path: Path, text: str) -> bool:
+    """Same as `read_md_file`, from `text`, the contents of the file at `path` (e.g. unsaved
+    in an editor, so not on the disk), which is scanned.
+    """
+
+    try:
+        extract = scan_markdown(text.replace('\r\n', '\n').replace('\r', '\n'))
+    except Exception:   # pylint: disable=broad-except
+        __on_parser_error(path)
+        return False
+    __merge(tree, path, extract)
+    return True
@@ -1,8 +1,10 @@
 """Represents an anchor in a markdown file."""
 
 
+import functools
 import re
-from typing import List, Dict
+import sys
+from typing import List, Dict, Iterable, Optional
 from pathlib import Path
 
 
@@ -20,26 +22,52 @@ rc_h2a_2 = re.compile(RE_H2A_1)
 class Anchor:
     """Represents an anchor in a markdown file."""
 
+    __slots__ = ('name',)
+
+    # The name part of the anchor (e.g. "anchor_name"). Interned, as the same names are
+    # used in many files.
     name: str
 
-    def __init__(self, html: str = None, heading: str = None) -> None:
-        # The name part of the anchor (e.g. "anchor_name")
+    def __init__(self, html: Optional[str] = None, heading: Optional[str] = None,
+                 name: Optional[str] = None) -> None:
+        if name is not None:
+            self.name = sys.intern(name)
 
-        if html:
+        elif html:
             match = rc_anchor_name.search(html)
             if match:
-                self.name = match.group(1) or match.group(2)
+                self.name = sys.intern(match.group(1) or match.group(2))
 
         elif heading:
-            self.name = Anchor.heading_to_anchor(heading)
+            self.name = sys.intern(Anchor.heading_to_anchor(heading))
 
     @staticmethod
+    @functools.lru_cache(maxsize=1 << 16)
     def heading_to_anchor(heading: str) -> str:
         """github-compatible translation of a heading to a corresponding autogenerated
-        anchor name.
+        anchor name. Memoized, as the same headings (e.g. "Usage") recur in many files.
         """
 
         ret = heading.strip().lower()
         ret = rc_h2a_1.sub("", ret)
         ret = rc_h2a_2.sub("-", ret)
         return ret
+
+    @staticmethod
+    def headings_to_anchors(headings: Iterable[str]) -> List[str]:
+        """github-compatible anchor names of all headings of a file, in document order.
+        A repeated name gets a numeric suffix ("foo", "foo-1", "foo-2"), skipping the names
+        already taken (e.g. by a heading "foo-1").
+        """
+
+        # Maps from each name taken so far to the last suffix used with it
+        taken: Dict[str, int] = {}
+        ret = []
+        for heading in headings:
+            name = base = Anchor.heading_to_anchor(heading)
+            while name in taken:
+                taken[base] += 1
+                name = base + '-' + str(taken[base])
+            taken[name] = 0
+            ret.append(name)
+        return ret
@@ -0,0 +1,324 @@
+"""A persistent cache of the data extracted from markdown files, so that files which did not
+change since the previous run are not parsed again.
+
+Entries are stored in an sqlite database:
+- `extracts` maps a content hash to the extracted data. Byte-identical files (such as
+  vendored copies) share one entry, and are parsed only once.
+- `files` maps a path, with the mtime and size it had when it was cached, to a content hash.
+  A file whose mtime and size did not change is a hit without even being read.
+
+Both are per extraction engine, as the engines do not extract quite the same data (e.g. only
+the scanner records the spans of the links).
+
+The total size of the extracted data is capped; the least recently used entries are evicted.
+
+Several processes may use the cache at once (e.g. CI jobs, or a pre-commit hook while
+mdlinkd runs): the database is in WAL mode, so that reads do not block, and the writes are
+buffered and committed in short transactions. If the database stays locked by another
+process, the session continues without the cache.
+"""
+
+
+import contextlib
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import marko # type: ignore
+
+from mdtools.model.parse import Extract
+from mdtools.model.link import Span
+
+
+# Bump when the layout of `Extract`, or the way it is produced, changes.
+SCHEMA_VERSION = 4
+
+# Default cap on the total size of the cached data.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds to wait for a lock held by another process, before giving up on the cache.
+BUSY_TIMEOUT = 5.0
+
+# Number of buffered writes committed together, in one transaction.
+WRITE_BATCH = 500
+
+
+def default_path() -> Path:
+    """Default location of the cache database."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base).joinpath('mdtools', 'parse-cache.sqlite')
+
+
+@dataclass
+class CacheStats:
+    """Counters describing how well the cache worked during this session."""
+
+    hits:        int = 0    # Found by path, mtime and size
+    dedup_hits:  int = 0    # Found by content hash (file changed, moved or copied)
+    misses:      int = 0    # Had to be parsed
+    evictions:   int = 0    # Entries evicted to stay under the size cap
+    entries:     int = 0    # Entries in the cache after the session
+    bytes:       int = 0    # Total size of the cached data after the session
+
+    def describe(self) -> str:
+        """Provide a textual description of the stats."""
+        return ("Parse cache: {} hits, {} content hits, {} misses, {} evicted, "
+                "{} entries, {} KiB").format(self.hits, self.dedup_hits, self.misses,
+                                            self.evictions, self.entries, self.bytes // 1024)
+
+
+class ParseCache:
+    """Persistent cache of `Extract`s. See the module docstring.
+
+    Usage: `get` a file; if that returns None, parse the file and `put` the result.
+    `close` at the end of the session, to persist the changes and evict old entries.
+    If the database cannot be used, e.g. because it stays locked, the cache disables itself
+    with a warning: every file misses, and nothing is stored.
+    """
+
+    path:       Path
+    max_bytes:  int
+    check_hash: bool
+    stats:      CacheStats
+
+    def __init__(self, path: Union[str, Path, None] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 check_hash: bool = False) -> None:
+        """path: location of the database (see `default_path`).
+        max_bytes: cap on the total size of the cached data.
+        check_hash: if True, files with an unchanged mtime and size are still read and
+            hashed, and only considered a hit if the content hash matches too.
+        """
+
+        self.path = Path(path) if path else default_path()
+        self.max_bytes = max_bytes
+        self.check_hash = check_hash
+        self.stats = CacheStats()
+
+        # (engine, mtime, size, hash) of the files that were looked up and missed, for `put`.
+        self.__pending: Dict[Path, Tuple[str, int, int, str]] = {}
+        # Contents of these files, as read to hash them, until they are parsed (see `content`)
+        self.__contents: Dict[Path, bytes] = {}
+        # Writes not committed yet: statements and their parameters (see `__write`)
+        self.__writes: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.__clock = 0
+        self.__db: Optional[sqlite3.Connection] = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Autocommit: transactions are explicit (see `__transaction`), and short
+            self.__db = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT,
+                                        isolation_level=None)
+            self.__db.execute("PRAGMA busy_timeout = {}".format(int(BUSY_TIMEOUT * 1000)))
+            self.__db.execute("PRAGMA journal_mode = WAL")
+            self.__init_db()
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+
+    @property
+    def enabled(self) -> bool:
+        """False if the cache disabled itself (see the class docstring)."""
+        return self.__db is not None
+
+    def __disable(self, exc: sqlite3.Error) -> None:
+        """Continue the session without the cache, because of `exc`."""
+        print("Parse cache " + str(self.path) + " unavailable (" + str(exc) +
+              "); continuing without it", file=sys.stderr)
+        if self.__db is not None:
+            self.__db.close()
+        self.__db = None
+        self.__writes.clear()
+
+    @contextlib.contextmanager
+    def __transaction(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction; the lock is taken at the start, so it cannot fail halfway."""
+        assert self.__db is not None
+        db = self.__db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def __init_db(self) -> None:
+        with self.__transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            version = '{}/{}'.format(SCHEMA_VERSION, marko.__version__)
+            if self.__get_meta('version') != version:
+                db.execute("DROP TABLE IF EXISTS files")
+                db.execute("DROP TABLE IF EXISTS extracts")
+                self.__set_meta('version', version)
+            db.execute("""CREATE TABLE IF NOT EXISTS files (
+                              path TEXT, engine TEXT, mtime INTEGER, size INTEGER, hash TEXT,
+                              PRIMARY KEY (path, engine))""")
+            db.execute("""CREATE TABLE IF NOT EXISTS extracts (
+                              hash TEXT, engine TEXT, data TEXT, size INTEGER, used INTEGER,
+                              PRIMARY KEY (hash, engine))""")
+            db.execute("CREATE INDEX IF NOT EXISTS extracts_used ON extracts (used)")
+            self.__clock = int(self.__get_meta('clock') or 0) + 1
+            self.__set_meta('clock', str(self.__clock))
+
+    def __get_meta(self, key: str) -> Optional[str]:
+        assert self.__db is not None
+        row = self.__db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __set_meta(self, key: str, value: str) -> None:
+        assert self.__db is not None
+        self.__db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def __write(self, sql: str, params: Tuple[Any, ...]) -> None:
+        """Buffer a write; commit the buffered writes once there are `WRITE_BATCH` of them."""
+        self.__writes.append((sql, params))
+        if len(self.__writes) >= WRITE_BATCH:
+            self.__flush()
+
+    def __flush(self) -> None:
+        """Commit the buffered writes, in one transaction."""
+        if self.__db is None or not self.__writes:
+            return
+        try:
+            with self.__transaction() as db:
+                for sql, params in self.__writes:
+                    db.execute(sql, params)
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+        self.__writes.clear()
+
+    def __get_extract(self, hash_: str, engine: str) -> Optional[Extract]:
+        assert self.__db is not None
+        row = self.__db.execute("SELECT data FROM extracts WHERE hash = ? AND engine = ?",
+                                (hash_, engine)).fetchone()
+        if not row:
+            return None
+        self.__write("UPDATE extracts SET used = ? WHERE hash = ? AND engine = ?",
+                     (self.__clock, hash_, engine))
+        extract = Extract(**json.loads(row[0]))
+        extract.spans = [Span(*span) for span in extract.spans]
+        return extract
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        """Content hash of a file."""
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def get(self, path: Path, engine: str) -> Optional[Extract]:
+        """Return the data that `engine` extracted from the file at `path`, or None if the
+        file must be parsed.
+        """
+
+        if self.__db is None:
+            self.stats.misses += 1
+            return None
+        try:
+            return self.__get(path, engine)
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+            self.stats.misses += 1
+            return None
+
+    def __get(self, path: Path, engine: str) -> Optional[Extract]:
+        assert self.__db is not None
+        st = os.stat(path)
+        key = str(path)
+        row = self.__db.execute("SELECT mtime, size, hash FROM files WHERE path = ? AND engine = ?",
+                                (key, engine)).fetchone()
+
+        data = None
+        hash_ = None
+        if row and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            if self.check_hash:
+                with open(path, 'rb') as file:
+                    data = file.read()
+                hash_ = self.hash(data)
+            if hash_ is None or hash_ == row[2]:
+                extract = self.__get_extract(row[2], engine)
+                if extract is not None:
+                    self.stats.hits += 1
+                    return extract
+
+        if hash_ is None or data is None:
+            with open(path, 'rb') as file:
+                data = file.read()
+            hash_ = self.hash(data)
+        extract = self.__get_extract(hash_, engine)
+        if extract is not None:
+            self.__write("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                         (key, engine, st.st_mtime_ns, st.st_size, hash_))
+            self.stats.dedup_hits += 1
+            return extract
+
+        self.__pending[path] = (engine, st.st_mtime_ns, st.st_size, hash_)
+        self.__contents[path] = data
+        self.stats.misses += 1
+        return None
+
+    def content_hash(self, path: Path) -> Optional[str]:
+        """Content hash of a file that missed in `get`. Files with the same hash need to be
+        parsed only once.
+        """
+        pending = self.__pending.get(path)
+        return pending[3] if pending else None
+
+    def content(self, path: Path) -> Optional[bytes]:
+        """Contents of a file that missed in `get`, as read to hash it, so that the file is
+        not read again to be parsed, and the data put in the cache is extracted from the
+        contents with the hash it is stored under. Returned only once.
+        """
+        return self.__contents.pop(path, None)
+
+    def put(self, path: Path, extract: Extract) -> None:
+        """Store the data extracted from a file that missed in `get`."""
+
+        pending = self.__pending.pop(path, None)
+        self.__contents.pop(path, None)
+        if self.__db is None or pending is None:
+            return
+        engine, mtime, size, hash_ = pending
+        data = json.dumps(dataclasses.asdict(extract), separators=(',', ':'))
+        self.__write("INSERT OR REPLACE INTO extracts VALUES (?, ?, ?, ?, ?)",
+                     (hash_, engine, data, len(data), self.__clock))
+        self.__write("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                     (str(path), engine, mtime, size, hash_))
+
+    def __evict(self) -> None:
+        """Evict the least recently used entries until the total size is under the cap."""
+
+        with self.__transaction() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM extracts").fetchone()[0]
+            if total > self.max_bytes:
+                evicted = []
+                for hash_, engine, size in db.execute(
+                        "SELECT hash, engine, size FROM extracts ORDER BY used"):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((hash_, engine))
+                    total -= size
+                db.executemany("DELETE FROM extracts WHERE hash = ? AND engine = ?", evicted)
+                db.execute("""DELETE FROM files WHERE NOT EXISTS (
+                                  SELECT 1 FROM extracts WHERE extracts.hash = files.hash
+                                                           AND extracts.engine = files.engine)""")
+                self.stats.evictions += len(evicted)
+
+            self.stats.entries = db.execute("SELECT COUNT(*) FROM extracts").fetchone()[0]
+            self.stats.bytes = total
+
+    def close(self) -> None:
+        """Persist the changes made during this session, and release the database."""
+        self.__flush()
+        if self.__db is None:
+            return
+        try:
+            self.__evict()
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+            return
+        self.__db.close()
+        self.__db = None
@@ -2,8 +2,7 @@
 
 
 from pathlib import Path
-from typing import List, Dict
-import marko # type: ignore
+from typing import List, Dict, Optional
 from mdtools.model.anchor import Anchor
 from mdtools.model.link import Link
 
@@ -11,6 +10,8 @@ from mdtools.model.link import Link
 class File:
     """Represents a file or directory in a file tree."""
 
+    __slots__ = ('path', 'anchors', 'h_anchors', 'links', 'duplicates')
+
     # Path to the file.
     path:               Path
 
@@ -20,27 +21,32 @@ class File:
     # If this is markdown file, - all headings in this file
     h_anchors:          Dict[str, Anchor]
 
-    # If this is markdown file, - all links in this file
+    # If this is markdown file, - all links in this file, in document order.
+    # The AST of the file is not kept; it is re-created when the file is patched.
     links:              List[Link]
 
-    # Markdown parser and renderer for this file. Used to parse the markdown, as well as
-    # to generate an updated markdown after fixing issues (which is why it's being stored).
-    marko:              marko.Markdown
-
-    # The root node of the markdown AST, produced by `marko`.
-    m_document:         marko.block.Document
+    # If this is markdown file, - the anchors with the same name as an earlier anchor in
+    # this file; None if there are none.
+    duplicates:         Optional[List[Anchor]]
 
     def __init__(self, path: Path):
         self.path = path        # pathlib Path
         self.anchors = {}
         self.h_anchors = {}
         self.links = []
-        self.marko = None
-        self.m_document = None
-
-    def on_anchor(self, anchor: Anchor) -> None:
-        """Called during file parsing if an anchor is found."""
+        self.duplicates = None
+
+    def on_anchor(self, anchor: Anchor) -> bool:
+        """Called during file parsing if an anchor is found. Return False if there already
+        is an anchor with the same name (the first one is kept).
+        """
+        if anchor.name in self.anchors:
+            if self.duplicates is None:
+                self.duplicates = []
+            self.duplicates.append(anchor)
+            return False
         self.anchors[anchor.name] = anchor
+        return True
 
     def on_heading_anchor(self, anchor: Anchor) -> None:
         """Called during file parsing if a heading anchor is found."""
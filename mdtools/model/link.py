@@ -1,28 +1,69 @@
 """Represents a link in a markdown file."""
 
 
-from typing import Tuple
-import marko # type: ignore
+import re
+import sys
+from typing import NamedTuple, Optional, Tuple
+
+
+rc_dest_needs_brackets = re.compile(r"[\s<>]")
+
+
+class Span(NamedTuple):
+    """Where a link is in the text of its file (with the line endings normalized to '\n').
+    Recorded when the file is scanned, and used to patch the link in place.
+    """
+
+    # Offsets of the text to replace to change the destination of the link. For inline
+    # links, it is the destination as written (e.g. '<a b.md>' in '[x](<a b.md> "t")').
+    # For reference links, it is the label part after the link text (e.g. '[ref]' in
+    # '[x][ref]'; empty for '[ref]'), which a patch replaces with an inline destination
+    # (unless it changes all the links using the definition alike, see `def_start`).
+    start:      int
+    end:        int
+
+    # Offset, line and column (1-based) of the start of the link.
+    offset:     int
+    line:       int
+    column:     int
+
+    # Whether this is a reference link.
+    reference:  bool
+
+    # For reference links, offsets of the destination of the reference definition (e.g.
+    # 'b.md' in '[ref]: b.md'), which a patch changing all the links using the definition
+    # replaces instead.
+    def_start:  int = 0
+    def_end:    int = 0
 
 
 class Link:
-    """Represents a link in a markdown file. Wraps a Link or Image node in the Marko AST."""
+    """Represents a link (or an image) in a markdown file. Only holds the destination, and
+    where the link is in the file, if known.
+    """
 
-    # "Link" object in the Marko document
-    m_link: marko.inline.Link
+    __slots__ = ('dest', 'span')
 
-    def __init__(self, m_link: marko.inline.Link):
-        self.m_link = m_link
+    # Destination of the link (see `get_dest`). Interned, as many links have the same
+    # destination.
+    dest:   str
+
+    # Location of the link in the file, if the file was scanned (see `scan`)
+    span:   Optional[Span]
+
+    def __init__(self, dest: str, span: Optional[Span] = None):
+        self.dest = sys.intern(dest)
+        self.span = span
 
     def get_dest(self) -> str:
         """Get the destination string from the link. Destination is
         'hello.md#world' from '[text](<hello.md#world> "label).
         """
-        return self.m_link.dest
+        return self.dest
 
     def set_dest(self, dest: str) -> None:
         """Set the destination string of the link."""
-        self.m_link.dest = dest
+        self.dest = sys.intern(dest)
 
     def get_href(self) -> str:
         """Get the href string from the link. Href is
@@ -56,7 +97,29 @@ class Link:
 
     def is_local(self) -> bool:
         """Return true if the link is local (assumed local if contains no colons)."""
-        return self.get_href().find(':') == -1
+        return Link.is_local_dest(self.get_dest())
+
+    @staticmethod
+    def is_local_dest(dest: str) -> bool:
+        """Return true if a link with the destination `dest` is local. See `is_local`."""
+        href, _ = Link.split_link(dest)
+        return href.find(':') == -1
+
+    @staticmethod
+    def format_dest(dest: str) -> str:
+        """Return `dest` as it must be written in the round brackets of an inline link:
+        in angle brackets, if it contains spaces or angle brackets, or if its round brackets
+        are not balanced.
+        """
+
+        depth = 0
+        for c in dest:
+            depth += (c == '(') - (c == ')')
+            if depth < 0:
+                break
+        if depth == 0 and not rc_dest_needs_brackets.search(dest):
+            return dest
+        return '<' + re.sub(r"([<>])", r"\\\1", dest) + '>'
 
     @staticmethod
     def split_link(linkstr: str) -> Tuple[str, str]:
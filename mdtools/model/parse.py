@@ -0,0 +1,112 @@
+"""Parsing of markdown files, and extraction of the data the model needs from them."""
+
+
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import marko # type: ignore
+from marko.md_renderer import MarkdownRenderer # type: ignore
+
+from mdtools.model.anchor import Anchor
+from mdtools.model.link import Span
+from mdtools import profiling
+
+
+RE_ANCHOR = r"""<a\s*(name|id).*?>"""
+rc_anchor = re.compile(RE_ANCHOR)
+
+
+@dataclass
+class Extract:
+    """Plain data extracted from a single markdown file. Unlike the marko AST, it is cheap
+    to pickle, so it can be produced by a worker process and sent back to the parent.
+    """
+
+    # Destinations of all links and images, in document order.
+    links:    List[str] = field(default_factory=list)
+
+    # Names of all anchors (e.g. "hello" from '<a name="hello">'), in document order.
+    anchors:  List[str] = field(default_factory=list)
+
+    # Texts of all headings, in document order.
+    headings: List[str] = field(default_factory=list)
+
+    # Locations of the links, in the same order as `links`. Only the scanner (see `scan`)
+    # records them; empty if the file was parsed with marko.
+    spans:    List[Span] = field(default_factory=list, compare=False)
+
+
+def __traverse_ast(node, out: Extract, link_nodes: list) -> None:
+    """Recursively traverse the AST produced by Marko, and collect the data into `out`.
+    Link and Image nodes are additionally collected into `link_nodes`.
+    """
+
+    if isinstance(node, marko.inline.InlineHTML):
+        if rc_anchor.match(node.children):
+            out.anchors.append(Anchor(html=node.children).name)
+    elif isinstance(node, (marko.inline.Link, marko.inline.Image)):
+        out.links.append(node.dest)
+        link_nodes.append(node)
+    elif isinstance(node, marko.block.Heading):
+        text = node.children[0].children
+        if isinstance(text, str):
+            out.headings.append(text)
+
+    if hasattr(node, 'children') and isinstance(node.children, list):
+        for child in node.children:
+            __traverse_ast(child, out, link_nodes)
+
+
+def decode(data: bytes) -> str:
+    """Decode the raw contents of a markdown file the same way `open(..., 'r')` would."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def parse_markdown(markdown: str) -> Tuple[marko.Markdown, marko.block.Document, Extract, list]:
+    """Parse markdown text. Return the parser (which is also the renderer), the AST,
+    the extracted data, and the Link/Image nodes of the AST in document order.
+    """
+
+    with profiling.phase('parse'):
+        match = marko.Markdown(renderer = MarkdownRenderer)
+        doc = match.parse(markdown)
+    out = Extract()
+    link_nodes: list = []
+    with profiling.phase('traverse'):
+        __traverse_ast(doc, out, link_nodes)
+    return match, doc, out, link_nodes
+
+
+def parse_ast(path: Path) -> Tuple[marko.Markdown, marko.block.Document, Extract, list]:
+    """Parse a markdown file. See `parse_markdown`."""
+
+    with profiling.phase('read'), open(path, encoding='utf-8') as file:
+        markdown = file.read()
+    return parse_markdown(markdown)
+
+
+def read_file(path: Path, data: Optional[bytes] = None) -> str:
+    """Return the contents of the markdown file at `path`: `data` decoded, if given (e.g.
+    already read by the cache, see `ParseCache.content`), else read from the file.
+    """
+
+    if data is None:
+        with profiling.phase('read'), open(path, 'rb') as file:
+            data = file.read()
+    return decode(data)
+
+
+def extract_file(path: Path, data: Optional[bytes] = None) -> Optional[Extract]:
+    """Parse a markdown file and return only the extracted data, or None if the file could
+    not be parsed. Runs in worker processes, so it must not touch the model.
+
+    data: the contents of the file, if already read (see `read_file`).
+    """
+
+    try:
+        _, _, out, _ = parse_markdown(read_file(path, data))
+        return out
+    except Exception:   # pylint: disable=broad-except
+        return None
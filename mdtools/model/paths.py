@@ -0,0 +1,115 @@
+"""Compact storage of the paths of a file tree.
+
+Each distinct path is stored once, in a `PathTable`, and referred to by its index in the
+table (its id). Indexes which map names to many paths, such as `Tree.names`, store arrays of
+ids, and return lists of `Path`s when looked up.
+"""
+
+
+from array import array
+from pathlib import Path
+from typing import List, Dict, Iterator, Mapping, Optional
+
+
+class PathTable:
+    """Interns paths: maps each distinct path to an integer id, and back."""
+
+    __slots__ = ('paths', 'ids', 'parents')
+
+    # Path of each id.
+    paths:      List[Path]
+
+    # Id of each path.
+    ids:        Dict[Path, int]
+
+    # Id of the parent directory of each id, or -1 if not known yet.
+    parents:    'array[int]'
+
+    def __init__(self) -> None:
+        self.paths = []
+        self.ids = {}
+        self.parents = array('i')
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, id_: int) -> Path:
+        return self.paths[id_]
+
+    def intern(self, path: Path) -> int:
+        """Return the id of `path`, adding it to the table if it is not there yet."""
+        id_ = self.ids.get(path)
+        if id_ is None:
+            id_ = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.parents.append(-1)
+        return id_
+
+    def get(self, path: Path) -> Optional[int]:
+        """Return the id of `path`, or None if it is not in the table."""
+        return self.ids.get(path)
+
+    def path(self, path: Path) -> Path:
+        """Return the path in the table which is equal to `path` (adding it if needed), so
+        that equal paths are stored once.
+        """
+        return self.paths[self.intern(path)]
+
+    def parent(self, path: Path) -> int:
+        """Return the id of the parent directory of `path`."""
+        id_ = self.intern(path)
+        parent = self.parents[id_]
+        if parent < 0:
+            parent = self.parents[id_] = self.intern(path.parent)
+        return parent
+
+
+class PathIndex(Mapping[str, List[Path]]):
+    """Maps from names to lists of paths (e.g. from a file name to all files with this
+    name). Behaves as a read-only `Dict[str, List[Path]]`; the lists are created when
+    looked up. Use `add` and `remove` to change it.
+    """
+
+    __slots__ = ('table', 'ids')
+
+    # The table of the paths.
+    table:      PathTable
+
+    # The ids of the paths, by name.
+    ids:        Dict[str, 'array[int]']
+
+    def __init__(self, table: PathTable, ids: Optional[Dict[str, 'array[int]']] = None) -> None:
+        self.table = table
+        self.ids = {} if ids is None else ids
+
+    def __getitem__(self, name: str) -> List[Path]:
+        paths = self.table.paths
+        return [paths[id_] for id_ in self.ids[name]]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return 'PathIndex({!r})'.format(dict(self.items()))
+
+    def add(self, name: str, path: Path) -> None:
+        """Add `path` to the paths with `name`."""
+        ids = self.ids.get(name)
+        if ids is None:
+            ids = self.ids[name] = array('i')
+        ids.append(self.table.intern(path))
+
+    def remove(self, name: str, path: Path) -> None:
+        """Remove `path` from the paths with `name`, if it is there."""
+        ids = self.ids.get(name)
+        id_ = self.table.get(path)
+        if ids is not None and id_ is not None and id_ in ids:
+            ids.remove(id_)
+            if not ids:
+                del self.ids[name]
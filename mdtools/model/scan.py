@@ -0,0 +1,1035 @@
+"""A lightweight extraction engine, which scans markdown for links, anchors and headings
+without building an AST.
+
+It produces the same `Extract` as `parse.parse_markdown`, following the rules of marko (the
+parser used everywhere else) closely: code blocks, code spans, HTML blocks, autolinks,
+reference definitions, emphasis and the nesting of links are handled the same way. It is
+much faster, because the block structure is found with a single pass over the lines, and
+the inline content of paragraphs and headings is turned into a few light tokens instead of
+a tree of elements. The time is linear in the length of the text: a ']' is matched with the
+last opener, and long link texts and destinations with indexes of the brackets and
+parentheses of the text, rather than by scanning again (see `_Brackets`). Only removing
+emphasis delimiters from their list is quadratic in their number, with a tiny constant.
+
+Unlike marko, the scanner also records where each link is in the text (see `Span`), so that
+links can be patched in place.
+"""
+
+
+import re
+import string
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from mdtools.model.anchor import Anchor
+from mdtools.model.link import Span
+from mdtools.model.parse import Extract, rc_anchor, read_file
+from mdtools import profiling
+
+
+# -----------------------------------------------------------------------------
+# Patterns. These are the ones marko uses.
+
+TAG_NAME = r"[A-Za-z][A-Za-z0-9\-]*"
+ATTRIBUTE = (r"\s+[A-Za-z:_][A-Za-z0-9\-_\.:]*"
+             r"""(?:\s*=\s*(?:[^\s"'`=<>]+|'[^']*'|"[^"]*"))?""")
+ATTRIBUTE_NO_LF = (r"[^\n\S]+[A-Za-z:_][A-Za-z0-9\-_\.:]*"
+                   r"""(?:[^\n\S]*=[^\n\S]*(?:[^\s"'`=<>]+|'[^\n']*'|"[^\n"]*"))?""")
+LINK_LABEL = r"(?P<label>\[(?!\s*\])(?:\\\\|\\[\[\]]|[^\[\]])+\])"
+LINK_DEST = r"(?P<dest><(?:\\.|[^\n\\<>])*>|[^<\s]\S*)"
+LINK_TITLE = (r"""(?P<title>"(?:\\\\|\\"|[^"])*"|'(?:\\\\|\\'|[^'])*'"""
+              r"|\((?:\\\\|\\\)|[^\(\)])*\))")
+URI = r"[A-Za-z][A-Za-z\-.+]{1,31}:[^\s<>]*?"
+EMAIL = (r"[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9]"
+         r"(?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9]"
+         r"(?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*")
+BLOCK_TAGS = (
+    "address|article|aside|base|basefont|blockquote|body|caption|center|col|colgroup|dd|"
+    "details|dialog|dir|div|dl|dt|fieldset|figcaption|figure|footer|form|frame|frameset|"
+    "h1|h2|h3|h4|h5|h6|head|header|hr|html|iframe|legend|li|link|main|menu|menuitem|meta|"
+    "nav|noframes|ol|optgroup|option|p|param|section|source|summary|table|tbody|td|tfoot|"
+    "th|thead|title|tr|track|ul")
+
+# Block level
+rc_heading = re.compile(
+    r" {0,3}(#{1,6})((?=\s)[^\n]*?|[^\n\S]*)(?:(?<=\s)(?<!\\)#+)?[^\n\S]*$\n?", re.M)
+rc_setext = re.compile(r" {,3}(=+|-+)[^\n\S]*$", re.M)
+rc_fence = re.compile(r"( {,3})(`{3,}|~{3,})[^\n\S]*(.*?)$", re.M)
+rc_fence_end = re.compile(r" {,3}(~+|`+)[^\n\S]*$", re.M)
+rc_thematic = re.compile(r" {,3}([-_*][^\n\S]*){3,}$\n?", re.M)
+rc_quote = re.compile(r" {,3}>")
+QUOTE_PREFIX = r" {,3}>[^\n\S]?"
+rc_list_item = re.compile(r" {,3}(\d{1,9}[.)]|[*\-+])[ \t\n\r\f]")
+rc_link_ref_def = re.compile(
+    r" {,3}%s:(?P<s1>\s*)%s(?P<s2>\s*)(?:(?<=\s)%s)?[^\n\S]*$\n?"
+    % (LINK_LABEL, LINK_DEST, LINK_TITLE), re.M)
+rc_space = re.compile(r"\s+")
+# A line which can neither start a block nor interrupt a paragraph
+rc_plain = re.compile(r"[^\s#>`~*_=+\-<\[\d]")
+
+# Start and end conditions of the 7 kinds of HTML blocks. The blocks without an end
+# condition end at a blank line.
+html_blocks = [
+    (re.compile(r"(?i) {,3}<(?:script|pre|style)[>\s]"),
+     re.compile(r"(?i)</(?:script|pre|style)>")),
+    (re.compile(r" {,3}<!--"), re.compile(r"-->")),
+    (re.compile(r" {,3}<\?"), re.compile(r"\?>")),
+    (re.compile(r" {,3}<!"), re.compile(r">")),
+    (re.compile(r" {,3}<!\[CDATA\["), re.compile(r"\]\]>")),
+    (re.compile(r"(?im) {,3}</?(?:%s)(?: +|/?>|$)" % BLOCK_TAGS), None),
+    (re.compile(r"(?m) {,3}(<%s(?:%s)*[^\n\S]*/?>|</%s[^\n\S]*>)[^\n\S]*$"
+                % (TAG_NAME, ATTRIBUTE_NO_LF, TAG_NAME)), None),
+]
+
+# Inline level
+rc_literal = re.compile(r'\\([!"#\$%&\'()*+,\-./:;<=>?@\[\\\]^_`{|}~])')
+rc_line_break = re.compile(r"( *|\\)\n(?!\Z)")
+rc_inline_html = re.compile(
+    r"(<%s(?:%s)* */?>"
+    r"|</%s *>"
+    r"|<!--(?!>|->|[\s\S]*?--[\s\S]*?-->)[\s\S]*?(?<!-)-->"
+    r"|<\?[\s\S]*?\?>"
+    r"|<![A-Z]+ +[\s\S]*?>"
+    r"|<!\[CDATA\[[\s\S]*?\]\]>)" % (TAG_NAME, ATTRIBUTE, TAG_NAME))
+rc_code_span = re.compile(r"(?<!`)(`+)(?!`)([\s\S]+?)(?<!`)\1(?!`)")
+rc_auto_link = re.compile(r"<(%s|%s)>" % (URI, EMAIL))
+rc_delimiter = re.compile(r"(?:!?\[|\*+|_+)")
+rc_special = re.compile(r"[\\`\]!\[*_]")
+rc_whitespace = re.compile(r"\s+")
+rc_white_char = re.compile(r"\s")
+rc_link_dest = re.compile(r"<(?:\\.|[^\n\\<>])*>")
+rc_link_tail = re.compile(r"(?:\s+%s)?\s*\)" % LINK_TITLE)
+rc_optional_label = re.compile(r"\[(?:\\\\|\\[\[\]]|[^\[\]])*\]")
+# The brackets not right after a backslash
+rc_bare_bracket = re.compile(r"(?<!\\)[\[\]]")
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+
+
+def __is_paired(text: str, open_: str, close: str) -> bool:
+    """Check that the brackets in `text` are paired, ignoring backslash-escaped ones."""
+    count = 0
+    escape = False
+    for c in text:
+        if escape:
+            escape = False
+        elif c == "\\":
+            escape = True
+        elif c == open_:
+            count += 1
+        elif c == close:
+            if count == 0:
+                return False
+            count -= 1
+    return count == 0
+
+
+def __normalize_label(label: str) -> str:
+    return rc_space.sub(" ", label).strip().lower()
+
+
+def __match_prefix(prefix: str, line: str) -> int:
+    """Match the prefix of the open containers (a regular expression, matched with tabs
+    expanded) at the start of `line`. Return the position of the rest of the line, or -1.
+    Blank lines match any prefix made of spaces.
+    """
+    if not prefix:
+        return 0
+    expanded = line.expandtabs(4)
+    match = re.match(prefix, expanded)
+    if not match:
+        if re.match(prefix, expanded.replace("\n", " " * 99 + "\n")):
+            return len(line) - 1
+        return -1
+    end = match.end()
+    if end == 0:
+        return 0
+    for i in range(1, len(line) + 1):
+        if len(line[:i].expandtabs(4)) >= end:
+            return i
+    return -1
+
+
+def __strip_prefix(prefix: str, line: str) -> str:
+    """Strip the shortest match of `prefix` from `line`, expanding the tabs it covers."""
+    for i in range(1, len(line) + 1):
+        head = line[:i].expandtabs(4)
+        match = re.match(prefix, head)
+        if match:
+            return head[match.end():] + line[i:]
+    return line
+
+
+def __is_code(prefix: str, line: str) -> bool:
+    """Whether `line` is a line of an indented code block under `prefix`."""
+    match = re.match(prefix + " {4}", line.expandtabs(4))
+    if not match:
+        return False
+    end = match.end()
+    for i in range(len(line)):
+        expanded = line[:i + 1].expandtabs(4)
+        if len(expanded) >= end:
+            return len(expanded) > end or i + 1 < len(line)
+    return False
+
+
+# -----------------------------------------------------------------------------
+# Block level: split the document into the blocks with inline content (paragraphs and
+# headings), skipping code and HTML blocks, and collecting the reference definitions.
+
+
+def __is_thematic_break(line: str) -> bool:
+    match = rc_thematic.match(line)
+    return match is not None and len(set(rc_space.sub("", match.group()))) == 1
+
+
+def __fence(line: str) -> Optional[str]:
+    """If `line` opens a fenced code block, return the fence."""
+    match = rc_fence.match(line)
+    if not match or match.group(2)[0] == "`" and "`" in match.group(3):
+        return None
+    return match.group(2)
+
+
+def __html_block(line: str) -> Tuple[int, Optional['re.Pattern']]:
+    """If `line` opens an HTML block, return its kind (1-7) and end condition. Otherwise
+    return 0.
+    """
+    for kind, (start, end) in enumerate(html_blocks, 1):
+        if start.match(line):
+            return kind, end
+    return 0, None
+
+
+def __list_leading(line: str) -> Tuple[int, str, int, str]:
+    """Split the first line of a list item into the indentation, the bullet, the spacing
+    after the bullet and the rest.
+    """
+    line = line.expandtabs(4)
+    stripped = line.lstrip()
+    parts = stripped.split(None, 1)
+    if len(parts) == 1:
+        return len(line) - len(stripped), parts[0], 0, ""
+    mid = len(stripped) - len("".join(parts))
+    return len(line) - len(stripped), parts[0], mid if mid <= 4 else 1, parts[1]
+
+
+def __breaks_paragraph(line: str, lazy: bool) -> bool:
+    """Whether `line` interrupts a paragraph. If `lazy`, the line would be a lazy
+    continuation line of the paragraph.
+    """
+    if rc_quote.match(line) or rc_heading.match(line) or not line.strip() or __fence(line):
+        return True
+    if rc_list_item.match(line):
+        _, bullet, _, tail = __list_leading(line)
+        if lazy or (bullet[:-1] == "1" or bullet in "*-+") and tail:
+            return True
+    kind, _ = __html_block(line)
+    if kind and kind != 7:
+        return True
+    if __is_thematic_break(line):
+        return lazy or not rc_setext.match(line)
+    return False
+
+
+def __is_link_ref_def(match: 're.Match') -> bool:
+    """Check the parts of a match of `rc_link_ref_def`."""
+    dest = match.group('dest')
+    title = match.group('title')
+    return (match.group('s1').count("\n") <= 1
+            and (dest[0] == "<" and dest[-1] == ">" or __is_paired(dest, "(", ")"))
+            and not (title and re.search(r"^$", title, re.M)))
+
+
+def __join(lines: List[str], offsets: List[int]) -> Tuple[str, List[int], List[int]]:
+    """Join the lines of a paragraph, stripping their indentation. Return the text, and the
+    segments it is made of: their offsets in the text, and in the document.
+    """
+    parts = []
+    positions = []
+    sources = []
+    pos = 0
+    for line, offset in zip(lines, offsets):
+        stripped = line.lstrip()
+        positions.append(pos)
+        sources.append(offset + len(line) - len(stripped))
+        parts.append(stripped)
+        pos += len(stripped)
+    return "".join(parts), positions, sources
+
+
+class _Container:
+    """An open block quote or list item. `prefix` is the regular expression matching the
+    start of its lines; for list items, it changes after the first line.
+    """
+
+    __slots__ = ('prefix', 'next_prefix', 'is_quote')
+
+    def __init__(self, prefix: str, next_prefix: str, is_quote: bool) -> None:
+        self.prefix = prefix
+        self.next_prefix = next_prefix
+        self.is_quote = is_quote
+
+
+# A block with inline content: is an ATX heading, the inline text, and the offsets of the
+# segments of the text in the text and in the document (see `__join`).
+_Leaf = Tuple[bool, str, List[int], List[int]]
+
+# A reference definition: the destination, and its offsets in the document.
+_Ref = Tuple[str, int, int]
+
+
+def __blocks(text: str) -> Tuple[List[_Leaf], Dict[str, _Ref]]:
+    """Find the blocks with inline content. Return them in document order, and the reference
+    definitions (by normalized label).
+    """
+
+    leaves: List[_Leaf] = []
+    refs: Dict[str, _Ref] = {}
+
+    containers: List[_Container] = []   # Open block quotes and list items, outermost first
+    para: List[str] = []            # Lines of the open paragraph
+    para_at: List[int] = []         # Offsets of these lines in the document
+    fence = None                    # Fence of the open fenced code block
+    html_end = None                 # End condition of the open HTML block
+    html_open = False               # An HTML block ending at a blank line is open
+    code_open = False               # An indented code block is open
+    empty_item = False              # The innermost container is a list item opened by a
+                                    # line with only the bullet
+    skip_to = 0                     # End of the last reference definition
+
+    def close_para():
+        if para:
+            joined, positions, sources = __join(para, para_at)
+            leaves.append((False, joined.rstrip("\n"), positions, sources))
+            para.clear()
+            para_at.clear()
+
+    def prefix(depth: int) -> str:
+        if not depth:
+            return ""
+        return "".join(container.prefix for container in containers[:depth])
+
+    lines = text.split('\n')
+    offset = 0
+    next_offset = 0
+    for i, line in enumerate(lines):
+        offset = next_offset
+        next_offset += len(line) + 1
+        if i < len(lines) - 1:
+            line += '\n'
+        elif not line:
+            break
+        if offset < skip_to:
+            continue        # Part of a multi-line reference definition
+        if not (containers or fence or html_end or html_open or code_open) \
+                and rc_plain.match(line):
+            para.append(line)
+            para_at.append(offset)
+            continue
+        for container in containers:
+            container.prefix = container.next_prefix
+
+        # Match the prefixes of the open containers
+        depth = len(containers)
+        pos = __match_prefix(prefix(depth), line)
+        while pos < 0:
+            depth -= 1
+            pos = __match_prefix(prefix(depth), line)
+        rest = line[pos:]
+
+        if empty_item:
+            empty_item = False
+            if depth < len(containers) or not rest.strip():
+                # The list item ends empty
+                depth = min(depth, len(containers) - 1)
+                containers.pop()
+                pos = __match_prefix(prefix(depth), line)
+                rest = line[pos:]
+
+        if depth < len(containers):
+            if para and not __breaks_paragraph(rest, True):
+                # Lazy continuation line
+                para.append(rest)
+                para_at.append(offset + pos)
+                continue
+            close_para()
+            del containers[depth:]
+            fence = html_end = None
+            html_open = code_open = False
+
+        if not rest:
+            # Like marko, fail on a last line consisting only of container markers
+            raise ValueError("Unexpected end of the document")
+
+        # Continue the open leaf block
+        if fence:
+            match = rc_fence_end.match(rest)
+            if match and fence in match.group(1):
+                fence = None
+            continue
+        if html_end:
+            if html_end.search(rest):
+                html_end = None
+            continue
+        if html_open:
+            if rest.strip():
+                continue
+            html_open = False
+        if code_open:
+            if not rest.strip() or __is_code(prefix(depth), line):
+                continue
+            code_open = False
+        if para:
+            if not __breaks_paragraph(rest, False):
+                if rc_setext.match(rest):
+                    # A setext heading is not a `Heading` in marko, so it does not count
+                    # as a heading here either.
+                    joined, positions, sources = __join(para, para_at)
+                    leaves.append((False, joined.strip(), positions, sources))
+                    para.clear()
+                    para_at.clear()
+                else:
+                    para.append(rest)
+                    para_at.append(offset + pos)
+                continue
+            close_para()
+
+        # Start new blocks
+        while True:
+            if not rest:
+                raise ValueError("Unexpected end of the document")
+            if __is_thematic_break(rest):
+                break
+            fence = __fence(rest)
+            if fence:
+                break
+            match = rc_heading.match(rest)
+            if match:
+                heading = match.group(2)
+                leaves.append((True, heading.strip(), [0], [offset + pos + match.start(2)
+                                                            + len(heading) - len(heading.lstrip())]))
+                break
+            if rc_list_item.match(rest):
+                indent, bullet, mid, _ = __list_leading(__strip_prefix(prefix(depth), line))
+                containers.append(_Container(" " * indent + re.escape(bullet) + " " * mid,
+                                             " " * (len(bullet) + indent + (mid or 1)), False))
+                depth += 1
+                pos = __match_prefix(prefix(depth), line)
+                if pos < 0:
+                    raise ValueError("List item not matching its own prefix")
+                rest = line[pos:]
+                if not rest.strip():
+                    empty_item = True
+                    break
+                continue
+            if rc_quote.match(rest):
+                containers.append(_Container(QUOTE_PREFIX, QUOTE_PREFIX, True))
+                depth += 1
+                pos = __match_prefix(prefix(depth), line)
+                rest = line[pos:]
+                continue
+            if not rest.strip():
+                break
+            kind, end = __html_block(rest)
+            if kind:
+                if end is None:
+                    html_open = True
+                elif not end.search(rest):
+                    html_end = end
+                break
+            match = rc_link_ref_def.match(text, offset + pos)
+            if match and __is_link_ref_def(match):
+                refs.setdefault(__normalize_label(match.group('label')[1:-1]),
+                                (match.group('dest'), match.start('dest'), match.end('dest')))
+                skip_to = match.end()
+                break
+            code_prefix = prefix(depth)
+            if containers and containers[-1].is_quote:
+                code_prefix = code_prefix[:-1]
+            if __is_code(code_prefix, line):
+                code_open = True
+                break
+            para.append(rest)
+            para_at.append(offset + pos)
+            break
+
+    close_para()
+    return leaves, refs
+
+
+# -----------------------------------------------------------------------------
+# Inline level: find the links, images, emphasis, code spans, inline HTML etc. in the
+# inline text of a block, and resolve the overlaps between them.
+
+
+class _Token:
+    """An inline element found in the text, spanning `start:end`. For links, images and
+    emphasis (`nested`), the elements found in `inner_start:inner_end` become children.
+    For links and images, `span` is the text to replace to change the destination, and for
+    reference links, the offsets of the destination of the definition (see `Span`).
+    """
+
+    __slots__ = ('kind', 'start', 'end', 'inner_start', 'inner_end', 'priority', 'nested',
+                 'data', 'children', 'span')
+
+    # Kinds of tokens
+    LINE_BREAK, LITERAL, HTML, CODE, AUTO_LINK, LINK, EMPHASIS = range(7)
+
+    def __init__(self, kind: int, start: int, end: int, inner_start: int, inner_end: int,
+                 priority: int, data: Optional[str] = None) -> None:
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.inner_start = inner_start
+        self.inner_end = inner_end
+        self.priority = priority
+        self.nested = kind in (_Token.LINK, _Token.EMPHASIS)
+        self.data = data
+        self.children: List['_Token'] = []
+        self.span: Optional[Tuple[int, int, Optional[Tuple[int, int]]]] = None
+
+
+def __resolve_overlap(tokens: List[_Token]) -> List[_Token]:
+    """Drop the tokens that overlap with others, and nest the ones contained in others."""
+
+    if not tokens:
+        return tokens
+    result = []
+    prev = tokens[0]
+    for cur in tokens[1:]:
+        if prev.end <= cur.start:
+            result.append(prev)
+            prev = cur
+        elif prev.end >= cur.end and prev.nested and cur.start >= prev.inner_start \
+                and cur.end <= prev.inner_end:
+            prev.children.append(cur)
+        elif prev.end >= cur.end and prev.nested and prev.inner_end <= cur.start:
+            pass    # Shaded by the destination or title of a link
+        elif prev.priority < cur.priority:
+            prev = cur
+    result.append(prev)
+    for token in result:
+        if token.children:
+            token.children = __resolve_overlap(token.children)
+    return result
+
+
+class _Delimiter:
+    """A run of '*' or '_', or a '[' or '![', which may open or close emphasis or links."""
+
+    __slots__ = ('start', 'end', 'content', 'text', 'active', 'can_open', 'can_close')
+
+    def __init__(self, start: int, end: int, text: str) -> None:
+        self.start = start
+        self.end = end
+        self.content = text[start:end]
+        self.text = text
+        self.active = True
+        self.can_open = self.can_close = False
+        if self.content[0] == "*":
+            self.can_open = self.__left_flanking()
+            self.can_close = self.__right_flanking()
+        elif self.content[0] == "_":
+            left, right = self.__left_flanking(), self.__right_flanking()
+            self.can_open = left and (not right or self.__preceded_by(string.punctuation))
+            self.can_close = right and (not left or self.__followed_by(string.punctuation))
+
+    def __left_flanking(self) -> bool:
+        text = self.text
+        return (self.end < len(text) and not rc_white_char.match(text, self.end)) and (
+            not self.__followed_by(string.punctuation) or self.start == 0
+            or self.__preceded_by(string.punctuation)
+            or rc_white_char.match(text, self.start - 1) is not None)
+
+    def __right_flanking(self) -> bool:
+        text = self.text
+        return (self.start > 0 and not rc_white_char.match(text, self.start - 1)) and (
+            not self.__preceded_by(string.punctuation) or self.end == len(text)
+            or self.__followed_by(string.punctuation)
+            or rc_white_char.match(text, self.end) is not None)
+
+    def __followed_by(self, chars: str) -> bool:
+        return self.end < len(self.text) and self.text[self.end] in chars
+
+    def __preceded_by(self, chars: str) -> bool:
+        return self.start > 0 and self.text[self.start - 1] in chars
+
+    def closed_by(self, other: '_Delimiter') -> bool:
+        """Whether this opener can be closed by the `other` delimiter."""
+        return not (
+            self.content[0] != other.content[0]
+            or (self.can_open and self.can_close or other.can_open and other.can_close)
+            and len(self.content + other.content) % 3 == 0
+            and not all(len(d.content) % 3 == 0 for d in [self, other]))
+
+    def remove(self, n: int, left: bool = False) -> bool:
+        """Use up `n` characters of the run. Return True if nothing is left."""
+        if len(self.content) <= n:
+            return True
+        if left:
+            self.start += n
+        else:
+            self.end -= n
+        self.content = self.content[n:]
+        return False
+
+
+# Link texts and destinations longer than this are matched with the indexes of `_Brackets`
+# rather than by scanning them, so that the time stays linear in the length of the text
+# even with many nested or unclosed brackets and parentheses.
+SCAN_LIMIT = 80
+
+
+class _Pairs:
+    """The `open_` and `close` characters of a text, ignoring backslash-escaped ones, so that
+    whether they are paired between two positions is known without scanning the text again.
+    `positions`: theirs, after a virtual one at -1; `depths`: the number of open characters
+    left open after each; `lower`: the position of the next one after which the depth is
+    lower (the end if none); `stops`: the positions of the unescaped `stops` characters.
+    """
+
+    __slots__ = ('positions', 'depths', 'lower', 'stops')
+
+    def __init__(self, text: str, open_: str, close: str, stops: str = "") -> None:
+        positions, depths = [-1], [0]
+        self.stops: List[int] = []
+        depth = 0
+        pattern = r"\\[\s\S]|[%s]" % re.escape(open_ + close + stops)
+        for match in re.finditer(pattern, text):
+            c = match.group()
+            if c == open_:
+                depth += 1
+            elif c == close:
+                depth -= 1
+            elif c in stops:
+                self.stops.append(match.start())
+                continue
+            else:
+                continue
+            positions.append(match.start())
+            depths.append(depth)
+        lower = [len(text)] * len(positions)
+        stack: List[int] = []
+        for k, depth in enumerate(depths):
+            while stack and depths[stack[-1]] > depth:
+                lower[stack.pop()] = positions[k]
+            stack.append(k)
+        self.positions, self.depths, self.lower = positions, depths, lower
+
+    def paired(self, start: int, end: int) -> bool:
+        """`__is_paired(text[start:end], open_, close)`, for a `start` not escaped."""
+        k = bisect_left(self.positions, start) - 1
+        n = bisect_left(self.positions, end) - 1
+        return self.depths[n] == self.depths[k] and self.lower[k] >= end
+
+    def scan(self, start: int) -> Tuple[int, int]:
+        """Scan from `start` (not escaped) to the first stop character or unpaired close
+        character (or to the end). Return where, and the number of open characters left
+        open there.
+        """
+        k = bisect_left(self.positions, start) - 1
+        s = bisect_left(self.stops, start)
+        end = min(self.lower[k], self.stops[s]) if s < len(self.stops) else self.lower[k]
+        return end, self.depths[bisect_left(self.positions, end) - 1] - self.depths[k]
+
+
+class _Brackets:
+    """The link openers of a text (its '[' and '![' delimiters, in order), and the indexes
+    of its brackets and parentheses, built when first needed.
+    `inactive`: the '[' openers before this one were deactivated by a link.
+    """
+
+    __slots__ = ('text', 'openers', 'inactive', '__brackets', '__parens', '__bare')
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.openers: List[_Delimiter] = []
+        self.inactive = 0
+        self.__brackets: Optional[_Pairs] = None
+        self.__parens: Optional[_Pairs] = None
+        self.__bare: Optional[List[int]] = None
+
+    def brackets(self) -> _Pairs:
+        """The brackets of the text."""
+        if self.__brackets is None:
+            self.__brackets = _Pairs(self.text, "[", "]")
+        return self.__brackets
+
+    def parens(self) -> _Pairs:
+        """The parentheses of the text, stopping at whitespace."""
+        if self.__parens is None:
+            self.__parens = _Pairs(self.text, "(", ")", string.whitespace)
+        return self.__parens
+
+    def bare(self, start: int, end: int) -> bool:
+        """Whether `text[start:end]` has a bracket without a backslash right before it. The
+        labels of the definitions have none.
+        """
+        if self.__bare is None:
+            self.__bare = [match.start() for match in rc_bare_bracket.finditer(self.text)]
+        k = bisect_left(self.__bare, start)
+        return k < len(self.__bare) and self.__bare[k] < end
+
+
+def __index(delimiters: List[_Delimiter], delimiter: _Delimiter) -> int:
+    """The index of `delimiter` in `delimiters`, which are in the order of the text."""
+    low, high = 0, len(delimiters)
+    while low < high:
+        middle = (low + high) // 2
+        if delimiters[middle].start < delimiter.start:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def __next_closer(delimiters: List[_Delimiter], bound: Optional[int]) -> Optional[int]:
+    for i in range(bound + 1 if bound is not None else 0, len(delimiters)):
+        if delimiters[i].can_close:
+            return i
+    return None
+
+
+def __nearest_opener(delimiters: List[_Delimiter], higher: int,
+                     lower: Optional[int]) -> Optional[int]:
+    for i in range(higher - 1, lower if lower is not None else -1, -1):
+        if delimiters[i].can_open and delimiters[i].closed_by(delimiters[higher]):
+            return i
+    return None
+
+
+def __process_emphasis(delimiters: List[_Delimiter], stack_bottom: Optional[int],
+                       found: List[_Token]) -> None:
+    """Match the emphasis delimiters above `stack_bottom`, then remove them all."""
+
+    star_bottom = underscore_bottom = stack_bottom
+    cur = __next_closer(delimiters, stack_bottom)
+    while cur is not None:
+        closer = delimiters[cur]
+        bottom = star_bottom if closer.content[0] == "*" else underscore_bottom
+        opener_i = __nearest_opener(delimiters, cur, bottom)
+        if opener_i is not None:
+            opener = delimiters[opener_i]
+            n = 2 if len(opener.content) >= 2 and len(closer.content) >= 2 else 1
+            found.append(_Token(_Token.EMPHASIS, opener.end - n, closer.start + n,
+                                opener.end, closer.start, 5))
+            del delimiters[opener_i + 1:cur]
+            cur -= cur - opener_i - 1
+            if opener.remove(n):
+                del delimiters[opener_i]
+                cur -= 1
+            if closer.remove(n, True):
+                del delimiters[cur]
+            cur = cur - 1 if cur > 0 else None
+        else:
+            bottom = cur - 1 if cur > 1 else None
+            if closer.content[0] == "*":
+                star_bottom = bottom
+            else:
+                underscore_bottom = bottom
+            if not closer.can_open:
+                del delimiters[cur]
+        cur = __next_closer(delimiters, cur)
+    del delimiters[stack_bottom + 1 if stack_bottom is not None else 0:]
+
+
+def __inline_link(text: str, start: int, brackets: _Brackets
+                  ) -> Optional[Tuple[str, int, int, int]]:
+    """Match `(dest "title")` at `start`. Return the raw destination, its start and end,
+    and the end of the match.
+    """
+
+    if start >= len(text) or text[start] != "(":
+        return None
+    i = start + 1
+    match = rc_whitespace.match(text, i)
+    if match:
+        i = match.end()
+    begin = i
+    match = rc_link_dest.match(text, i)
+    if match:
+        dest = match.group()
+        i = match.end()
+    else:
+        if i < len(text) and text[i] == "<":
+            return None
+        open_num = 0
+        escaped = False
+        while i < len(text):
+            if i - begin == SCAN_LIMIT:
+                i, open_num = brackets.parens().scan(begin)
+                break
+            c = text[i]
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == "(":
+                open_num += 1
+            elif c in string.whitespace:
+                break
+            elif c == ")":
+                if open_num > 0:
+                    open_num -= 1
+                else:
+                    break
+            i += 1
+        if open_num != 0:
+            return None
+        dest = text[begin:i]
+    match = rc_link_tail.match(text, i)
+    if not match:
+        return None
+    return dest, begin, i, match.end()
+
+
+def __reference_link(text: str, start: int, link_text: Optional[str],
+                     refs: Dict[str, _Ref]) -> Optional[Tuple[_Ref, int]]:
+    """Match the rest of a reference link at `start`, after the link text (None if it
+    cannot be a label). Return the definition and the end.
+    """
+
+    match = rc_optional_label.match(text, start)
+    label = link_text
+    if match and match.group()[1:-1]:
+        label = match.group()[1:-1]
+    ref = refs.get(__normalize_label(label)) if label is not None else None
+    if ref is None:
+        return None
+    return ref, match.end() if match else start
+
+
+def __link_token(text: str, brackets: _Brackets, opener: _Delimiter, close: int,
+                 refs: Dict[str, _Ref]) -> Optional[_Token]:
+    """Match a link or an image from `opener` to the ']' at `close`."""
+
+    inline = __inline_link(text, close + 1, brackets)
+    if inline:
+        dest, dest_start, dest_end, end = inline
+        span: Tuple[int, int, Optional[Tuple[int, int]]] = (dest_start, dest_end, None)
+    else:
+        label = None
+        if refs and (close - opener.end <= SCAN_LIMIT or not brackets.bare(opener.end, close)):
+            label = text[opener.end:close]
+        match = __reference_link(text, close + 1, label, refs)
+        if not match:
+            return None
+        (dest, def_start, def_end), end = match
+        span = (close + 1, end, (def_start, def_end))
+    if dest and dest[0] == "<" and dest[-1] == ">":
+        dest = dest[1:-1]
+    token = _Token(_Token.LINK, opener.start, end, opener.end, close, 5,
+                   rc_literal.sub(r"\1", dest))
+    token.span = span
+    return token
+
+
+def __link(text: str, delimiters: List[_Delimiter], brackets: _Brackets, close: int,
+           refs: Dict[str, _Ref], found: List[_Token]) -> Optional[_Token]:
+    """Look for a link or an image closed by the ']' at `close`, with the last opener."""
+
+    if not brackets.openers:
+        return None
+    opener = brackets.openers.pop()
+    brackets.inactive = min(brackets.inactive, len(brackets.openers))
+    i = __index(delimiters, opener)
+    if close - opener.end <= SCAN_LIMIT:
+        paired = __is_paired(text[opener.end:close], "[", "]")
+    else:
+        paired = brackets.brackets().paired(opener.end, close)
+    token = __link_token(text, brackets, opener, close, refs) if opener.active and paired \
+        else None
+    if token:
+        __process_emphasis(delimiters, i, found)
+        if opener.content == "[":
+            for other in brackets.openers[brackets.inactive:]:
+                if other.content == "[":
+                    other.active = False
+            brackets.inactive = len(brackets.openers)
+    del delimiters[i]
+    return token
+
+
+def __links_or_emphasis(text: str, refs: Dict[str, _Ref]) -> List[_Token]:
+    """Find the links, images and emphasis in `text`."""
+
+    found: List[_Token] = []
+    delimiters: List[_Delimiter] = []
+    brackets = _Brackets(text)
+    i = 0
+    while True:
+        match = rc_special.search(text, i)
+        if not match:
+            break
+        i = match.start()
+        c = text[i]
+        code = rc_code_span.match(text, i) if c == "`" else None
+        if c == "\\":
+            i += 2
+        elif code:
+            i = code.end()
+        elif c == "]":
+            token = __link(text, delimiters, brackets, i, refs, found)
+            if token:
+                found.append(token)
+                i = token.end
+            else:
+                i += 1
+        else:
+            match = rc_delimiter.match(text, i)
+            if match:
+                delimiters.append(_Delimiter(i, match.end(), text))
+                if delimiters[-1].content in ("[", "!["):
+                    brackets.openers.append(delimiters[-1])
+                i = match.end()
+            else:
+                i += 1
+    __process_emphasis(delimiters, None, found)
+    return found
+
+
+def __inline(text: str, refs: Dict[str, _Ref]) -> List[_Token]:
+    """Find the inline elements of `text`, as a tree of tokens."""
+
+    tokens = []
+    for match in rc_line_break.finditer(text):
+        tokens.append(_Token(_Token.LINE_BREAK, match.start(), match.end(),
+                             match.start(1), match.end(1), 2))
+    if '\\' in text:
+        for match in rc_literal.finditer(text):
+            tokens.append(_Token(_Token.LITERAL, match.start(), match.end(),
+                                 match.start(1), match.end(1), 7, match.group(1)))
+    tokens += __links_or_emphasis(text, refs)
+    if '<' in text:
+        for match in rc_inline_html.finditer(text):
+            tokens.append(_Token(_Token.HTML, match.start(), match.end(),
+                                 match.start(1), match.end(1), 7, match.group(1)))
+    if '`' in text:
+        for match in rc_code_span.finditer(text):
+            code = match.group(2).replace("\n", " ")
+            if code.strip() and code[0] == code[-1] == " ":
+                code = code[1:-1]
+            tokens.append(_Token(_Token.CODE, match.start(), match.end(),
+                                 match.start(1), match.end(1), 7, code))
+    if '<' in text:
+        for match in rc_auto_link.finditer(text):
+            tokens.append(_Token(_Token.AUTO_LINK, match.start(), match.end(),
+                                 match.start(1), match.end(1), 7))
+    tokens.sort(key=lambda t: t.start)
+    return __resolve_overlap(tokens)
+
+
+class _Locator:
+    """Maps the tokens found in the inline text of a block to their `Span`s in the document.
+    `positions` and `sources` are the segments of the text of the block (see `__join`).
+    """
+
+    __slots__ = ('markdown', 'line_starts', 'positions', 'sources')
+
+    def __init__(self, markdown: str) -> None:
+        self.markdown = markdown
+        self.line_starts: List[int] = []
+        self.positions: List[int] = []
+        self.sources: List[int] = []
+
+    def source(self, pos: int) -> int:
+        """Offset in the document of the character at `pos` in the text."""
+        k = bisect_right(self.positions, pos) - 1
+        return self.sources[k] + pos - self.positions[k]
+
+    def span(self, token: _Token) -> Span:
+        """The span of a link or image token."""
+        line_starts = self.line_starts
+        if not line_starts:
+            line_starts.append(0)
+            line_starts.extend(m.end() for m in re.finditer("\n", self.markdown))
+        start = self.source(token.start)
+        line = bisect_right(line_starts, start)
+        if token.span is None:
+            raise ValueError("not a link or image token")
+        begin, end, definition = token.span
+        # The end is the end of the last character, which may be on another line.
+        end = self.source(end - 1) + 1 if end > begin else self.source(begin)
+        begin = self.source(begin)
+        return Span(begin, end, start, line, start - line_starts[line - 1] + 1,
+                    definition is not None, *(definition or (0, 0)))
+
+
+def __collect(tokens: List[_Token], out: Extract, locator: _Locator) -> None:
+    for token in tokens:
+        if token.data is None:
+            pass
+        elif token.kind == _Token.HTML:
+            if rc_anchor.match(token.data):
+                out.anchors.append(Anchor(html=token.data).name)
+        elif token.kind == _Token.LINK:
+            out.links.append(token.data)
+            out.spans.append(locator.span(token))
+        if token.children:
+            __collect(token.children, out, locator)
+
+
+def __heading_text(text: str, tokens: List[_Token]) -> Optional[str]:
+    """Text of a heading, as the marko-based extraction has it: the text of the first
+    inline element, if that element is plain text. Raises for an empty heading, like the
+    marko-based extraction does.
+    """
+
+    if not tokens:
+        if not text:
+            raise ValueError("Empty heading")
+        return text
+    first = tokens[0]
+    if first.start > 0:
+        return text[:first.start]
+    if first.kind in (_Token.LITERAL, _Token.HTML, _Token.CODE):
+        return first.data
+    if first.kind == _Token.LINE_BREAK:
+        raise ValueError("Heading starts with a line break")
+    return None
+
+
+# -----------------------------------------------------------------------------
+
+
+def scan_markdown(markdown: str) -> Extract:
+    """Scan markdown text. Return the same data as `parse.parse_markdown` does, and the
+    spans of the links.
+    """
+
+    out = Extract()
+    leaves, refs = __blocks(markdown)
+    locator = _Locator(markdown)
+
+    for is_heading, text, positions, sources in leaves:
+        if not is_heading and '[' not in text and '<' not in text:
+            continue    # No links, no anchors
+        tokens = __inline(text, refs)
+        if is_heading:
+            heading = __heading_text(text, tokens)
+            if heading is not None:
+                out.headings.append(heading)
+
+        locator.positions = positions
+        locator.sources = sources
+        __collect(tokens, out, locator)
+    return out
+
+
+def scan_file(path: Path, data: Optional[bytes] = None) -> Optional[Extract]:
+    """Scan a markdown file and return the extracted data, or None if the file could not
+    be parsed. Runs in worker processes, like `parse.extract_file`.
+
+    data: the contents of the file, if already read (see `parse.read_file`).
+    """
+
+    try:
+        markdown = read_file(path, data)
+        with profiling.phase('parse'):
+            return scan_markdown(markdown)
+    except Exception:   # pylint: disable=broad-except
+        return None
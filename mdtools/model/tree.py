@@ -1,19 +1,33 @@
 """A very simple model of a markdown file tree."""
 
 
-from typing import List, Dict
+import sys
+from typing import List, Dict, Iterable, Tuple, Optional
 from pathlib import Path
+from mdtools import util
 from mdtools.model.anchor import Anchor
 from mdtools.model.link import Link
 from mdtools.model.file import File
+from mdtools.model.paths import PathTable, PathIndex
 
 
 class Tree:
-    """Contains data about a markdown file tree."""
+    """Contains data about a markdown file tree.
+
+    Each path is stored once, in `paths`; all the indexes below refer to the same Path
+    objects, and `names` and the anchor indexes only store their ids (see `PathIndex`).
+    """
+
+    __slots__ = ('base', 'paths', 'files', 'names', 'anchors', 'h_anchors', 'all_anchors',
+                 'backlinks', 'anchor_backlinks', 'generation', 'aliases', '__resolved',
+                 '__weakref__')
 
     # Base path of the markdown tree.
     base:        Path
 
+    # All paths known to the model: of the files, and of the targets of the links.
+    paths:       PathTable
+
     # All files in the file tree.
     files:       Dict[Path, File]
 
@@ -21,46 +35,187 @@ class Tree:
     # (where file name is "hello.md" in "C:/Documents/hello.md").
     # Maps from file name to all Files that have this name.
     # Used for auto fixing.
-    names:       Dict[str,  List[Path]]
+    names:       PathIndex
 
     # All anchors in the file tree.
     # Maps from file name to all Files that have this anchor.
     # Used for auto fixing.
-    anchors:     Dict[str,  List[Path]]
+    anchors:     PathIndex
 
     # All anchors autogenerated from headings in the file tree.
     # Maps from file name to all Files that have this anchor.
     # Used for auto fixing.
-    h_anchors:   Dict[str,  List[Path]]
+    h_anchors:   PathIndex
 
     # All anchors combined
-    all_anchors: Dict[str,  List[Path]]
+    all_anchors: PathIndex
+
+    # Reverse index of local links ("what links here").
+    # Maps from the Path of a link target (which may not exist) to all links pointing at it,
+    # as pairs of the Path of the file containing the link, and the Link. The same pair is
+    # shared with `anchor_backlinks`.
+    backlinks:   Dict[Path, List[Tuple[Path, Link]]]
+
+    # Same as `backlinks`, for links with an anchor. Maps from (target Path, anchor name).
+    anchor_backlinks: Dict[Tuple[Path, str], List[Tuple[Path, Link]]]
+
+    # Incremented whenever files or anchors are added or removed, so that data derived
+    # from the tree (e.g. fuzzy matching indexes) knows when it needs to be updated.
+    generation:  int
+
+    # Symbolic links in the file tree, resolved once when the tree is walked.
+    # Maps from the path of a link to the path it resolves to (as strings).
+    aliases:     Dict[str, str]
 
     def __init__(self, base: str) -> None:
         self.base = Path(base).resolve()
+        self.paths = PathTable()
         self.files = {}
-        self.names = {}
-        self.anchors = {}
-        self.h_anchors = {}
-        self.all_anchors = {}
+        self.names = PathIndex(self.paths)
+        self.anchors = PathIndex(self.paths)
+        self.h_anchors = PathIndex(self.paths)
+        self.all_anchors = PathIndex(self.paths)
+        self.backlinks = {}
+        self.anchor_backlinks = {}
+        self.generation = 0
+        self.aliases = {}
+        # Memoized `resolve`: maps from the id of the directory of the containing file, and
+        # the href, to Path
+        self.__resolved: Dict[int, Dict[str, Path]] = {}
 
     def on_file(self, path: Path) -> File:
         """Called for each file when traversing a file tree."""
+        path = self.paths.path(path)
         file = File(path)
         self.files[path] = file
-        self.names.setdefault(path.name, []).append(path)
+        self.generation += 1
+        self.names.add(path.name, path)
         return file
 
+    def on_alias(self, path: Path, target: Path) -> None:
+        """Called when traversing a file tree for each symbolic link, with the path it
+        resolves to.
+        """
+        self.aliases[str(path)] = str(target)
+        self.__resolved.clear()
+
+    def resolve(self, found_in: Path, href: str) -> Path:
+        """Return the Path of the target of `href` in a link in the file at `found_in`.
+        No file system access; see `util.href_to_path`.
+        """
+        if not href:
+            return found_in
+        resolved = self.__resolved.setdefault(self.paths.parent(found_in), {})
+        path = resolved.get(href)
+        if path is None:
+            path = resolved[sys.intern(href)] = self.paths.path(
+                util.href_to_path(found_in, self.base, href, self.aliases))
+        return path
+
     def on_anchor(self, path: Path, anchor: Anchor) -> None:
         """Called during file parsing if an anchor is found."""
-        self.files[path].on_anchor(anchor)
-        self.anchors.setdefault(anchor.name, []).append(path)
+        if self.files[path].on_anchor(anchor):
+            self.generation += 1
+            self.anchors.add(anchor.name, path)
 
     def on_heading_anchor(self, path: Path, anchor: Anchor) -> None:
         """Called during file parsing if a heading is found."""
         self.files[path].on_heading_anchor(anchor)
-        self.h_anchors.setdefault(anchor.name, []).append(path)
+        self.generation += 1
+        self.h_anchors.add(anchor.name, path)
 
     def on_link(self, path: Path, link: Link) -> None:
         """Called during file parsing if a link is found."""
-        self.files[path].on_link(link)
+        file = self.files[path]
+        file.on_link(link)
+        self.__index_link(file.path, link, link.get_dest())
+
+    def on_link_changed(self, path: Path, link: Link, old_dest: str) -> None:
+        """Called if the destination of a link in the file at `path` was changed
+        (e.g. by a patch) from `old_dest`.
+        """
+        path = self.files[path].path
+        self.__unindex_link(path, link, old_dest)
+        self.__index_link(path, link, link.get_dest())
+
+    def links_to(self, path: Path, anchor: Optional[str] = None) -> List[Tuple[Path, Link]]:
+        """Return all local links pointing at `path` (at `path#anchor` if an anchor is given),
+        as pairs of the Path of the file containing the link, and the Link.
+        """
+        if anchor:
+            return self.anchor_backlinks.get((path, anchor), [])
+        return self.backlinks.get(path, [])
+
+    # -------------------------------------------------------------------------
+    # Reverse index of links
+
+    def __link_keys(self, path: Path, dest: str) -> Tuple[Path, Optional[Tuple[Path, str]]]:
+        """Keys of a link with destination `dest` in `backlinks` and `anchor_backlinks`."""
+        href, anchor = Link.split_link(dest)
+        target = self.resolve(path, href)
+        return target, ((target, sys.intern(anchor)) if anchor else None)
+
+    def __index_link(self, path: Path, link: Link, dest: str) -> None:
+        if not Link.is_local_dest(dest):
+            return
+        target, anchor_key = self.__link_keys(path, dest)
+        path_link = (path, link)
+        self.backlinks.setdefault(target, []).append(path_link)
+        if anchor_key:
+            self.anchor_backlinks.setdefault(anchor_key, []).append(path_link)
+
+    def __unindex_link(self, path: Path, link: Link, dest: str) -> None:
+        if not Link.is_local_dest(dest):
+            return
+        target, anchor_key = self.__link_keys(path, dest)
+        for index, key in ((self.backlinks, target), (self.anchor_backlinks, anchor_key)):
+            if key is None or key not in index:
+                continue
+            remaining = [p_l for p_l in index[key] if p_l[1] is not link]   # type: ignore
+            if remaining:
+                index[key] = remaining                                      # type: ignore
+            else:
+                del index[key]                                              # type: ignore
+
+    # -------------------------------------------------------------------------
+    # Incremental updates
+
+    def reset_file(self, path: Path) -> File:
+        """Forget everything parsed from the file at `path` (e.g. because it changed and is
+        going to be parsed again). Call `update_all_anchors` when done updating the tree.
+        Return the (now empty) File.
+        """
+        file = self.files[path]
+        for link in file.links:
+            self.__unindex_link(path, link, link.get_dest())
+        for name in file.anchors:
+            self.anchors.remove(name, path)
+        for name in file.h_anchors:
+            self.h_anchors.remove(name, path)
+        self.files[path] = File(path)
+        self.generation += 1
+        return self.files[path]
+
+    def remove_file(self, path: Path) -> None:
+        """Remove the file at `path` from the tree (e.g. because it was deleted).
+        Call `update_all_anchors` when done updating the tree.
+        """
+        self.reset_file(path)
+        del self.files[path]
+        self.names.remove(path.name, path)
+
+    def update_all_anchors(self, names: Optional[Iterable[str]] = None) -> None:
+        """Bring `all_anchors` up to date with `anchors` and `h_anchors`.
+
+        names: if given, only these anchor names may have changed.
+        """
+        self.generation += 1
+        if names is None:
+            self.all_anchors = PathIndex(self.paths, {**self.anchors.ids, **self.h_anchors.ids})
+            return
+        for name in names:
+            ids = self.h_anchors.ids.get(name) or self.anchors.ids.get(name)
+            if ids:
+                self.all_anchors.ids[name] = ids
+            else:
+                self.all_anchors.ids.pop(name, None)
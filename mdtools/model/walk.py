@@ -0,0 +1,319 @@
+"""Walks a file tree and registers its files and directories in the model, skipping the
+excluded ones.
+
+Paths are excluded with gitignore-style patterns (https://git-scm.com/docs/gitignore), from:
+- the `.gitignore` and `.mdignore` files found in the tree (each applying to the directory
+  it is in, and below);
+- patterns given explicitly (e.g. `--exclude`), relative to the base of the tree, which take
+  precedence over the files.
+As in git, the last pattern matching a path decides: a pattern starting with "!" includes
+again what an earlier one excluded. The contents of an excluded directory are not walked
+at all. The `.git` directories are always excluded.
+
+Each directory is walked once: the walk remembers the directories it entered by inode, so
+that symbolic link loops (and bind mounts) end the walk instead of repeating it.
+"""
+
+
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Set, Tuple, Iterable, Iterator, NamedTuple, Optional
+
+from mdtools import profiling
+from mdtools.model.tree import Tree
+
+
+# Directories which are never walked.
+ignore_paths = ['.git']
+
+# Files with exclusion patterns, read in each directory.
+IGNORE_FILES = ['.gitignore', '.mdignore']
+
+
+def translate(pattern: str, prefix: str = '') -> Optional[Tuple[str, bool]]:
+    """Translate a gitignore pattern, found in the directory `prefix` (relative to the base,
+    with a trailing '/', or '' for the base) into a regular expression. Return it, and
+    whether the pattern is negated; or None for blank lines and comments.
+
+    The expression matches paths relative to the base, with a trailing '/' for directories.
+    """
+
+    pattern = pattern.rstrip('\n')
+    if not pattern.endswith('\\ '):
+        pattern = pattern.rstrip(' ')
+    if not pattern or pattern.startswith('#'):
+        return None
+    negated = pattern.startswith('!')
+    if negated or pattern.startswith('\\!') or pattern.startswith('\\#'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+
+    # A pattern with a slash (other than at the end) is relative to the directory of the
+    # ignore file; one without matches at any level below it.
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = re.escape(prefix) + ('' if anchored else '(?:.*/)?')
+
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            out += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern[i:] == '**' and (i == 0 or pattern[i - 1] == '/'):
+            # Everything inside, but not the directory itself
+            out += '.+'
+            i += 2
+            continue
+        if c == '*':
+            out += '[^/]*'
+        elif c == '?':
+            out += '[^/]'
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            out += re.escape(pattern[i])
+        elif c == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out += '[' + body.replace('\\', '\\\\') + ']'
+            i = end
+        else:
+            out += re.escape(c)
+        i += 1
+
+    return out + ('/' if dir_only else '/?'), negated
+
+
+class Ignore:
+    """Decides which paths are excluded, from gitignore-style patterns. All patterns are
+    compiled into a single regular expression, whose alternatives are in reverse order, so
+    that the first alternative matching a path is the last pattern (the one which decides).
+    """
+
+    # Expressions translated from the patterns of the ignore files (see `translate`), in
+    # order, and whether each is negated.
+    rules:      List[Tuple[str, bool]]
+
+    # Same, for the explicit patterns, which come after those of the ignore files.
+    exclude:    List[Tuple[str, bool]]
+
+    def __init__(self, exclude: Iterable[str] = ()) -> None:
+        self.rules = []
+        self.exclude = [rule for rule in map(translate, exclude) if rule]
+        self.__regex: Optional['re.Pattern[str]'] = None
+
+    def add(self, patterns: Iterable[str], prefix: str = '') -> None:
+        """Add patterns read from an ignore file in the directory `prefix` (relative to the
+        base, with a trailing '/', or '' for the base).
+        """
+
+        rules = [rule for rule in (translate(p, prefix) for p in patterns) if rule]
+        if rules:
+            self.rules += rules
+            self.__regex = None
+
+    def excluded(self, rel: str, is_dir: bool) -> bool:
+        """Return True if the path `rel` (relative to the base, with '/' separators) is
+        excluded. Does not look at the parent directories.
+        """
+
+        if self.__regex is None:
+            rules = self.rules + self.exclude
+            if not rules:
+                return False
+            self.__regex = re.compile('|'.join(
+                '(?P<{}{}>{})'.format('n' if negated else 'x', i, regex)
+                for i, (regex, negated) in reversed(list(enumerate(rules)))))
+        match = self.__regex.fullmatch(rel + '/' if is_dir else rel)
+        return match is not None and match.lastgroup is not None and match.lastgroup[0] == 'x'
+
+
+class _Entry(NamedTuple):
+    """A directory entry, with the information the walk needs (as cached by `DirEntry`)."""
+
+    name:       str
+    path:       str
+    is_dir:     bool
+
+    # The path the entry resolves to, if it is a symbolic link.
+    real:       Optional[str]
+
+    # Device and inode, for the directories which can be walked.
+    key:        Optional[Tuple[int, int]]
+
+
+class Walker:
+    """Walks file trees. See the module docstring."""
+
+    # Patterns excluding paths, relative to the base of the tree.
+    exclude:        List[str]
+
+    # Whether to read the patterns of the ignore files (see `IGNORE_FILES`).
+    ignore_files:   bool
+
+    # Whether to walk the directories that symbolic links point to.
+    follow_links:   bool
+
+    # Number of threads listing directories (and getting the status of their entries) ahead
+    # of the walk, for slow (e.g. network) file systems. 0: list them in the walk itself.
+    threads:        int
+
+    # The exclusions of the last walk, including the patterns read from the ignore files.
+    ignore:         Ignore
+
+    def __init__(self, exclude: Iterable[str] = (), ignore_files: bool = True,
+                 follow_links: bool = False, threads: int = 0) -> None:
+        self.exclude = list(exclude)
+        self.ignore_files = ignore_files
+        self.follow_links = follow_links
+        self.threads = threads
+        self.ignore = Ignore(self.exclude)
+
+    def walk(self, tree: Tree) -> Iterator[Tuple[Path, List[Path]]]:
+        """Walk the file tree in a deterministic order and register all files and
+        directories which are not excluded in the model. After registering the entries of
+        each directory, yield the path of the directory, and the paths of the markdown files
+        in it.
+
+        The paths are built from the (resolved) base path of the tree, so they need no
+        resolving, except for symbolic links: these are resolved once, registered at the
+        paths they resolve to, and recorded as aliases of these paths. Symbolic links to
+        directories are only followed with `follow_links`.
+        """
+
+        self.ignore = Ignore(self.exclude)
+        executor = ThreadPoolExecutor(self.threads) if self.threads > 0 else None
+        try:
+            yield from self.__walk(tree, executor)
+        finally:
+            if executor:
+                executor.shutdown()
+
+    def __walk(self, tree: Tree, executor: Optional[ThreadPoolExecutor]
+               ) -> Iterator[Tuple[Path, List[Path]]]:
+        base = str(tree.base)
+        try:
+            st = os.stat(base)
+            visited: Set[Optional[Tuple[int, int]]] = {(st.st_dev, st.st_ino)}
+        except OSError:
+            visited = set()
+
+        # Directories to walk: the path, the path relative to the base (with a trailing
+        # '/'), and their listing if it is being prefetched
+        stack: List[Tuple[str, str, Optional[Future]]] = [(base, '', None)]
+        while stack:
+            dir_, rel_dir, future = stack.pop()
+            with profiling.phase('walk'):
+                listing = future.result() if future else self.__list(dir_)
+                if listing is None:
+                    continue
+                entries, patterns = listing
+                self.ignore.add(patterns, rel_dir)
+
+                dirs: List[_Entry] = []
+                files: List[_Entry] = []
+                for entry in entries:
+                    if entry.is_dir and entry.name in ignore_paths:
+                        continue
+                    if self.ignore.excluded(rel_dir + entry.name, entry.is_dir):
+                        continue
+                    (dirs if entry.is_dir else files).append(entry)
+
+                # Treat directories as files (for some links that can point to directories)
+                children = []
+                for entry in dirs:
+                    tree.on_file(self.__path(tree, entry))
+                    if entry.real and not self.follow_links:
+                        continue
+                    if entry.key is None or entry.key not in visited:
+                        visited.add(entry.key)
+                        children.append((entry.real or entry.path, rel_dir + entry.name + '/'))
+
+                md_paths = []
+                for entry in files:
+                    path = self.__path(tree, entry)
+                    tree.on_file(path)
+                    if os.path.splitext(entry.name)[1] == '.md':
+                        md_paths.append(path)
+
+                stack += reversed([
+                    (path, rel, executor.submit(self.__list, path) if executor else None)
+                    for path, rel in children])
+
+            yield Path(dir_), md_paths
+
+    def __list(self, dir_: str) -> Optional[Tuple[List[_Entry], List[str]]]:
+        """List the directory `dir_`: return its entries, sorted, and the patterns of the
+        ignore files in it; or None if it cannot be listed.
+        """
+
+        try:
+            with os.scandir(dir_) as it:
+                scanned = sorted(it, key=lambda e: e.name.casefold())
+        except OSError:
+            return None
+
+        entries = []
+        patterns: List[str] = []
+        for entry in scanned:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            real = os.path.realpath(entry.path) if entry.is_symlink() else None
+            key = None
+            if is_dir and (real is None or self.follow_links):
+                try:
+                    st = entry.stat()
+                    key = (st.st_dev, st.st_ino)
+                except OSError:
+                    pass
+            elif self.ignore_files and entry.name in IGNORE_FILES:
+                try:
+                    with open(entry.path, encoding='utf-8', errors='replace') as file:
+                        patterns += file.read().splitlines()
+                except OSError:
+                    pass
+            entries.append(_Entry(entry.name, entry.path, is_dir, real, key))
+        return entries, patterns
+
+    @staticmethod
+    def __path(tree: Tree, entry: _Entry) -> Path:
+        """The path of a directory entry, with symbolic links resolved."""
+        if entry.real:
+            target = Path(entry.real)
+            tree.on_alias(Path(entry.path), target)
+            return target
+        return Path(entry.path)
+
+    def excluded(self, tree: Tree, path: Path) -> bool:
+        """Return True if `path` (in `tree`) was excluded from the last walk, or is in an
+        excluded directory.
+        """
+
+        try:
+            parts = path.relative_to(tree.base).parts
+        except ValueError:
+            return False
+        rel = ''
+        for i, name in enumerate(parts):
+            is_dir = i < len(parts) - 1 or path.is_dir()
+            if is_dir and name in ignore_paths or self.ignore.excluded(rel + name, is_dir):
+                return True
+            rel += name + '/'
+        return False
+
+
+def iter_walk(tree: Tree, walker: Optional[Walker] = None) -> Iterator[Tuple[Path, List[Path]]]:
+    """Walk the file tree with `walker` (by default, excluding what the ignore files in the
+    tree exclude). See `Walker.walk`.
+    """
+    return (walker or Walker()).walk(tree)
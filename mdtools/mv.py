@@ -0,0 +1,264 @@
+"""Moves (renames) files and directories of a markdown tree, and rewrites the links that
+the moves affect, so that they still point at the same targets.
+
+The moves are made as a batch: the tree is read once, and all the links to rewrite are
+found in the model, before anything is moved:
+- the links pointing at the moved files and directories (or into the moved directories);
+- the relative links in the moved files, which now start from another directory.
+Each link keeps its style: absolute links stay absolute (see `href.path_to_href_abs`), and
+relative links stay relative (see `href.path_to_href_rel`). Links which still resolve to
+their target after the moves are left as they are. For reference links, the destination of
+the reference definition is rewritten, and the links themselves are left as they are.
+
+The files are patched in place, and then moved. If any file cannot be patched, nothing is
+patched or moved.
+"""
+
+
+import functools
+import getopt
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from mdtools import util
+from mdtools.issues.fix import href
+from mdtools.issues.fix.options import Options
+from mdtools.issues.fix.patch import Patch, Patches
+from mdtools.model import read_md_tree
+from mdtools.model.cache import ParseCache
+from mdtools.model.tree import Tree, Link
+from mdtools.model.walk import Walker
+
+# pylint: disable=multiple-statements
+
+
+class MoveError(ValueError):
+    """A move which cannot be made."""
+
+
+def __within(path: Path, directory: Path) -> bool:
+    """Return True if `path` is `directory`, or is in it."""
+    return path == directory or str(path).startswith(os.path.join(str(directory), ''))
+
+
+def check_moves(tree: Tree, moves: List[Tuple[Path, Path]]) -> List[Tuple[Path, Path]]:
+    """Validate `moves`, pairs of the old and new paths of files or directories of the tree,
+    as the user gave them. Return them, resolved (a move to an existing directory is into
+    it, as with mv). Raise MoveError if a move cannot be made.
+    """
+
+    out: List[Tuple[Path, Path]] = []
+    for old, new in moves:
+        old = old.resolve()
+        new = new.resolve()
+        if old not in tree.files:
+            raise MoveError("not in the tree: " + str(old))
+        if new.is_dir():
+            new = new.joinpath(old.name)
+        if old == tree.base or util.path_to_href(new, tree.base) is None:
+            raise MoveError("cannot move " + str(old) + " out of the tree, or the tree itself")
+        if os.path.lexists(str(new)):
+            raise MoveError("already exists: " + str(new))
+        if __within(new, old):
+            raise MoveError("cannot move " + str(old) + " into itself")
+        out.append((old, new))
+
+    # No path may be moved (or moved to) twice, or be in a directory moved (or moved to)
+    for paths, what in (([old for old, _ in out], "moved"), ([new for _, new in out], "moved to")):
+        unique = set(paths)
+        if len(unique) < len(paths):
+            raise MoveError("a path is " + what + " twice")
+        for path in paths:
+            if any(parent in unique for parent in path.parents):
+                raise MoveError(str(path) + " is in a directory which is " + what + " too")
+    return out
+
+
+def moved_paths(tree: Tree, moves: List[Tuple[Path, Path]]) -> Dict[Path, Path]:
+    """Map the paths of the tree that `moves` (see `check_moves`) move, including those in
+    the moved directories, to their new paths.
+    """
+
+    by_old = dict(moves)
+    out = {}
+    for path in tree.files:
+        for ancestor in (path, *path.parents):
+            new = by_old.get(ancestor)
+            if new is not None:
+                out[path] = new.joinpath(path.relative_to(ancestor))
+                break
+            if ancestor == tree.base:
+                break
+    return out
+
+
+def rewrite_links(tree: Tree, moved: Dict[Path, Path], patches: Patches) -> int:
+    """Add to `patches` the changes to the links that the moves (see `moved_paths`) break.
+    The patches apply to the files before they are moved. Return the number of links.
+    """
+
+    # Links in the moved files, and links to the moved paths; by id, to see each once
+    links: Dict[int, Tuple[Path, Link]] = {}
+    for path in moved:
+        file = tree.files[path]
+        for link in file.links:
+            links[id(link)] = (path, link)
+        for path_link in tree.links_to(path):
+            links[id(path_link[1])] = path_link
+
+    count = 0
+    for path, link in links.values():
+        old_href = link.get_href()
+        if not link.is_local() or not old_href:
+            continue
+        target = tree.resolve(path, old_href)
+        new_target = moved.get(target, target)
+        new_path = moved.get(path, path)
+        if util.href_to_path(new_path, tree.base, old_href, tree.aliases) == new_target:
+            continue
+
+        if link.is_absolute():
+            new_href = href.path_to_href_abs(new_target, tree.base)
+        else:
+            new_href = href.path_to_href_rel(new_target, new_path) or new_target.name
+        if new_href is None:
+            continue
+        if old_href.endswith('/') and not new_href.endswith('/'):
+            new_href += '/'
+        patches.add(Patch(path, functools.partial(link.set_href, new_href), link))
+        count += 1
+    return count
+
+
+def move_all(tree: Tree, moves: List[Tuple[Path, Path]], dry_run: bool = False) -> bool:
+    """Move files and directories of the tree, and rewrite the links the moves affect (see
+    the module docstring). `moves`: pairs of old and new paths (see `check_moves`).
+    Dry run: print the moves, and the changes to the files as unified diffs, instead.
+    Return False if nothing was moved because some files could not be patched.
+    """
+
+    moves = check_moves(tree, moves)
+    moved = moved_paths(tree, moves)
+    patches = Patches(tree, dry_run, all_or_nothing=True)
+    count = rewrite_links(tree, moved, patches)
+    print("Rewriting {} link(s) in {} file(s)".format(count, len(patches.targets)))
+    if not patches.empty and not patches.apply():
+        return False
+
+    for old, new in moves:
+        print(util.clr("GREEN") + (util.path_to_href(old, tree.base) or str(old)) + " -> " +
+              (util.path_to_href(new, tree.base) or str(new)) + util.clr(""))
+        if not dry_run:
+            new.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(old), str(new))
+    return True
+
+# -----------------------------------------------------------------------------
+# Usage info
+
+def print_usage():
+    """Print info about the command-line arguments of the script."""
+    print("""
+Usage: mdmv <options> <markdown_dir_root> [<old> <new>]...
+Move (rename) files and directories of the markdown tree, and rewrite the links to them,
+and the relative links in them, so that the links still work. Moves to an existing
+directory are into it. Absolute links stay absolute, and relative links stay relative.
+Options:
+    --moves=FILE: Also make the moves listed in FILE: one per line, the old and the new
+        path separated by a tab ('-' for the standard input).
+    --dry-run: Do not change any files; print the moves, and the changes to the files as
+        unified diffs, instead.
+    -c: Colorize output for better readability.
+    -j N, --jobs=N: Parse markdown files in N processes (0: one per CPU).
+    --exclude=PATTERN, --no-ignore: see mdlinkcheck. Links in excluded files are not
+        rewritten.
+    --no-cache: Do not use the parse cache.
+    --cache=FILE: Location of the parse cache (default: ~/.cache/mdtools/parse-cache.sqlite).
+""")
+
+
+def read_moves(lines) -> List[Tuple[Path, Path]]:
+    """Parse the moves in `lines` (see --moves)."""
+    out = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        old, sep, new = line.partition('\t')
+        if not sep:
+            raise MoveError("no tab between the old and the new path: " + line)
+        out.append((Path(old), Path(new)))
+    return out
+
+# -----------------------------------------------------------------------------
+# Argument parsing
+
+def main():
+    """Script entry point"""
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], "cj:",
+                                      ["moves=", "dry-run", "jobs=", "exclude=", "no-ignore",
+                                       "no-cache", "cache="])
+    except getopt.GetoptError as exc:
+        print(exc.msg + "\n")
+        print_usage()
+        sys.exit(2)
+
+    opt = Options()
+    moves_file = None
+    for o in optlist:
+        if   o[0] == '--moves': moves_file = o[1]
+        elif o[0] == '--dry-run': opt.dry_run = True
+        elif o[0] == '-c': opt.colorize = True
+        elif o[0] in ('-j', '--jobs'):
+            try:
+                opt.jobs = int(o[1])
+            except ValueError:
+                print("Invalid number of jobs: " + o[1] + "\n")
+                print_usage()
+                sys.exit(2)
+        elif o[0] == '--exclude': opt.exclude.append(o[1])
+        elif o[0] == '--no-ignore': opt.ignore_files = False
+        elif o[0] == '--no-cache': opt.cache = False
+        elif o[0] == '--cache': opt.cache_file = o[1]
+
+    if not args or len(args) % 2 != 1 or (len(args) == 1 and not moves_file):
+        print_usage()
+        sys.exit(2)
+    if not Path(args[0]).resolve().is_dir():
+        print("Input path " + args[0] + " is not a directory\n")
+        print_usage()
+        sys.exit(2)
+
+    util.colorize_setting = opt.colorize
+    if opt.colorize:
+        from colorama import init as colorama_init  # type: ignore
+        colorama_init()
+
+    try:
+        moves = [(Path(old), Path(new)) for old, new in zip(args[1::2], args[2::2])]
+        if moves_file == '-':
+            moves += read_moves(sys.stdin)
+        elif moves_file:
+            with open(moves_file, encoding='utf-8') as f:   # pylint: disable=invalid-name
+                moves += read_moves(f)
+
+        tree = Tree(args[0])
+        cache = ParseCache(opt.cache_file or None) if opt.cache else None
+        read_md_tree(tree, opt.jobs, cache, 'scan', Walker(opt.exclude, opt.ignore_files))
+        if cache:
+            cache.close()
+        ok = move_all(tree, moves, opt.dry_run)
+    except (MoveError, OSError) as exc:
+        print(util.clr("RED") + str(exc) + util.clr(""))
+        sys.exit(1)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
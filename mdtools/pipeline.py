@@ -0,0 +1,265 @@
+"""Checks a markdown tree in a single pass: walking, parsing and checking the links run as
+chained generator stages, so that issues are reported while the tree is still being read.
+
+    walk  ->  parse  ->  check
+
+- walk: lists the directories one by one (see `model.walk`), registering their entries
+  in the tree, and yields the markdown files.
+- parse: extracts the data from the files, in this process or in worker processes, with a
+  bounded number of files in flight. Yields the extracts in walk order.
+- check: adds the anchors of each file to the tree, and checks its links.
+
+Links are not kept in the tree: once a link is checked, only the issue (if any) remains.
+The memory used is what the index of files and anchors needs, plus the links which cannot
+be checked yet:
+
+- A link to a file which is not in the tree yet is deferred until the directory of the
+  file has been listed: then the file either exists, or it does not.
+- A link with an anchor, to a markdown file which has not been parsed yet, is deferred
+  until the file has been parsed.
+- A link whose href goes down and then up again (e.g. "a/../b.md") could go through a
+  symbolic link which has not been seen yet; it is deferred until the walk is complete.
+
+So the issues are not reported in document order; deferred links are reported later. The
+set of issues is the same as `read_md_tree` followed by `analyze` would find.
+"""
+
+
+import contextlib
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Set, Tuple, Iterable, Iterator, Optional, Deque, Sequence
+
+from mdtools import util, profiling
+from mdtools.model import engines, iter_walk
+from mdtools.model.walk import Walker
+from mdtools.model.cache import ParseCache
+from mdtools.model.parse import Extract
+from mdtools.model.link import Span
+from mdtools.model.tree import Tree, Anchor, Link
+from mdtools.issues import issues, iter_issues
+
+
+def descends(href: str) -> bool:
+    """Return True if `href` only goes up (if at all) before going down, as in
+    "../../a/b.md"; unlike "a/../b.md".
+    """
+
+    down = False
+    for part in href.split('/'):
+        if part == '..':
+            if down:
+                return False
+        elif part not in ('', '.'):
+            down = True
+    return True
+
+
+class Pipeline:
+    """Checks the markdown tree in a single pass. See the module docstring.
+
+    Usage: `for issue in Pipeline(tree).run(): ...`
+    """
+
+    tree:       Tree
+    jobs:       int
+    cache:      Optional[ParseCache]
+    engine:     str
+    walker:     Optional[Walker]
+    pool:       Optional[Executor]
+
+    # Maximal number of files being parsed at a time, with jobs > 1.
+    buffer:     int
+
+    # Number of links checked so far.
+    links:      int
+
+    def __init__(self, tree: Tree, jobs: int = 1, cache: Optional[ParseCache] = None,
+                 engine: str = 'scan', buffer: int = 0,
+                 walker: Optional[Walker] = None, pool: Optional[Executor] = None) -> None:
+        """tree: a new tree, to be populated.
+        jobs: number of processes to parse the markdown files with; 0 means one per CPU.
+        cache: if given, files found in the cache are not parsed, and parsed files are added
+            to it.
+        engine: the extraction engine (see `model.engines`).
+        buffer: maximal number of files being parsed at a time (default: 4 per process).
+        walker: walks the file tree, and decides which paths are excluded (see `model.walk`).
+        pool: if given, the worker processes to parse the markdown files in (e.g. shared by
+            several trees); `jobs` must be their number.
+        """
+
+        self.tree = tree
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache = cache
+        self.engine = engine
+        self.buffer = buffer or 4 * self.jobs
+        self.walker = walker
+        self.pool = pool
+        self.links = 0
+        # Directories listed by the walk so far (ids in `tree.paths`)
+        self.__listed: Set[int] = set()
+        # Directories listed, whose deferred links have not been checked again yet
+        self.__just_listed: List[int] = []
+        # Whether the walk is complete
+        self.__walked = False
+        # Markdown files in the listed directories, which have not been checked yet
+        self.__pending: Set[Path] = set()
+        # Deferred links (with the Path of the file containing them): by the directory which
+        # must be listed, by the markdown file which must be parsed, and until the walk ends
+        self.__by_dir: Dict[int, List[Tuple[Path, Link]]] = {}
+        self.__by_file: Dict[Path, List[Tuple[Path, Link]]] = {}
+        self.__by_walk: List[Tuple[Path, Link]] = []
+
+    def run(self) -> Iterator[issues.Issue]:
+        """Check the tree. Yield the issues as soon as they are found."""
+        yield from self.check(self.parse(self.walk()))
+        self.tree.update_all_anchors()
+
+    # -------------------------------------------------------------------------
+    # Stages
+
+    def walk(self) -> Iterator[Path]:
+        """Walk the tree, registering all files in it. Yield the paths of the markdown files."""
+        for dir_, md_paths in iter_walk(self.tree, self.walker):
+            dir_id = self.tree.paths.intern(dir_)
+            self.__listed.add(dir_id)
+            self.__just_listed.append(dir_id)
+            self.__pending.update(md_paths)
+            yield from md_paths
+        self.__walked = True
+
+    def parse(self, paths: Iterable[Path]) -> Iterator[Tuple[Path, Optional[Extract]]]:
+        """Extract the data from the markdown files at `paths`. Yield each path and its
+        extract (None if the file could not be parsed), in the order of `paths`.
+        """
+
+        extract_file = engines[self.engine]
+        if self.jobs <= 1:
+            for path in paths:
+                extract = self.cache.get(path, self.engine) if self.cache else None
+                if extract is None:
+                    with profiling.file(path):
+                        extract = extract_file(path, self.cache.content(path)
+                                               if self.cache else None)
+                    self.__put(path, extract)
+                yield path, extract
+            return
+
+        if profiling.current:
+            profiling.current.jobs = self.jobs
+        with contextlib.nullcontext(self.pool) if self.pool else \
+                ProcessPoolExecutor(self.jobs) as executor:
+            # The files being parsed, in order, with their extract if found in the cache
+            window: Deque[Tuple[Path, Optional[Extract], object]] = deque()
+            for path in paths:
+                extract = self.cache.get(path, self.engine) if self.cache else None
+                future = None
+                if extract is None:
+                    future = executor.submit(extract_file, path,
+                                             self.cache.content(path) if self.cache else None)
+                window.append((path, extract, future))
+                if len(window) >= self.buffer:
+                    yield self.__result(*window.popleft())
+            while window:
+                yield self.__result(*window.popleft())
+
+    def check(self, extracts: Iterable[Tuple[Path, Optional[Extract]]]
+              ) -> Iterator[issues.Issue]:
+        """Add the anchors of each file to the tree, and check the links. Yield the issues."""
+
+        for path, extract in extracts:
+            yield from self.__check_deferred()
+            with profiling.phase('model'):
+                self.__merge(path, extract)
+            yield from iter_issues(self.tree, (), [path])
+            yield from self.__check_all(self.__by_file.pop(path, []))
+
+            if extract is None:
+                continue
+            spans: Sequence[Optional[Span]] = extract.spans or [None] * len(extract.links)
+            with profiling.phase('analyze'):
+                for dest, span in zip(extract.links, spans):
+                    self.links += 1
+                    issue = self.__check(path, Link(dest, span))
+                    if issue:
+                        yield issue
+        yield from self.__check_deferred()
+
+    # -------------------------------------------------------------------------
+
+    def __put(self, path: Path, extract: Optional[Extract]) -> None:
+        if self.cache and extract is not None:
+            self.cache.put(path, extract)
+
+    def __result(self, path: Path, extract: Optional[Extract], future
+                 ) -> Tuple[Path, Optional[Extract]]:
+        if future is not None:
+            with profiling.phase('workers'):
+                extract = future.result()
+            self.__put(path, extract)
+        return path, extract
+
+    def __merge(self, path: Path, extract: Optional[Extract]) -> None:
+        """Add the anchors of a file to the tree."""
+
+        self.__pending.discard(path)
+        if extract is None:
+            print(util.clr("RED") + "Parser error in: " +  str(path) + util.clr(""))
+            return
+        for name in extract.anchors:
+            self.tree.on_anchor(path, Anchor(name=name))
+        for name in Anchor.headings_to_anchors(extract.headings):
+            self.tree.on_heading_anchor(path, Anchor(name=name))
+
+    def __check(self, path: Path, link: Link) -> Optional[issues.Issue]:
+        """Check a link (as `issues.check_link` does), or defer it if it cannot be checked
+        yet.
+        """
+
+        if not link.is_local():
+            return None
+        href = link.get_href()
+        if not self.__walked:
+            if not descends(href):
+                self.__by_walk.append((path, link))
+                return None
+            target = self.tree.resolve(path, href)
+            if target not in self.tree.files:
+                dir_id = self.tree.paths.parent(target)
+                if dir_id not in self.__listed:
+                    self.__by_dir.setdefault(dir_id, []).append((path, link))
+                    return None
+        else:
+            target = self.tree.resolve(path, href)
+        file = self.tree.files.get(target)
+        if file is None:
+            return issues.TargetNotFound(path, link)
+        anchor = link.get_anchor()
+        if anchor and target in self.__pending:
+            self.__by_file.setdefault(target, []).append((path, link))
+            return None
+        if anchor and anchor not in file.anchors and anchor not in file.h_anchors:
+            return issues.AnchorNotFound(path, link)
+        return None
+
+    def __check_all(self, deferred: List[Tuple[Path, Link]]) -> Iterator[issues.Issue]:
+        with profiling.phase('analyze'):
+            for path, link in deferred:
+                issue = self.__check(path, link)
+                if issue:
+                    yield issue
+
+    def __check_deferred(self) -> Iterator[issues.Issue]:
+        """Check the links deferred until the directories listed since the last call were
+        listed, and, if the walk is complete, the links deferred until then.
+        """
+
+        while self.__just_listed:
+            yield from self.__check_all(self.__by_dir.pop(self.__just_listed.pop(), []))
+        if self.__walked:
+            deferred = self.__by_walk + [p_l for links in self.__by_dir.values() for p_l in links]
+            self.__by_walk = []
+            self.__by_dir = {}
+            yield from self.__check_all(deferred)
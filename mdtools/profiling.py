@@ -0,0 +1,210 @@
+"""Profiling of a run: the wall and CPU time spent in each phase, counts of what was
+processed, and the files which took longest to parse.
+
+Code marks a phase with `with profiling.phase('parse'): ...`. Phases are exclusive: while a
+phase is nested in another, the time is only charged to the inner one. Profiling is enabled
+by setting `current` to a `Profile`; while it is None, marking a phase costs next to nothing.
+"""
+
+
+import json
+import time
+from heapq import nlargest
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Any
+
+
+# The phases, in the order they are reported.
+PHASES = {
+    'walk':     "Walk the directory tree",
+    'cache':    "Look up and store parse results in the parse cache",
+    'read':     "Read markdown files",
+    'parse':    "Parse markdown (the scanner also extracts the data while parsing)",
+    'traverse': "Traverse the AST to extract the data (marko engine only)",
+    'workers':  "Wait for the worker processes (with -j)",
+    'model':    "Add the extracted data to the model",
+    'analyze':  "Check the links",
+    'external': "Check the external links (with --external)",
+    'fuzzy':    "Fuzzy matching of fix suggestions",
+    'patch':    "Patch files (and render them, if needed)",
+}
+
+
+class _Phase:
+    """Context manager measuring a phase of a `Profile`."""
+
+    __slots__ = ('profile', 'name')
+
+    def __init__(self, profile: 'Profile', name: str) -> None:
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.profile.enter(self.name)
+
+    def __exit__(self, *exc) -> None:
+        self.profile.exit()
+
+
+class _File:
+    """Context manager measuring the time to extract the data from a file."""
+
+    __slots__ = ('profile', 'path', 'start')
+
+    def __init__(self, profile: 'Profile', path: Path) -> None:
+        self.profile = profile
+        self.path = path
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.profile.files.append((time.perf_counter() - self.start, str(self.path)))
+
+
+class _Nothing:
+    """Context manager doing nothing, for when not profiling."""
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+class Profile:
+    """Times and counts collected during a run."""
+
+    # Wall time, CPU time and number of calls, by phase.
+    phases:     Dict[str, List[float]]
+
+    # Counts of what was processed (e.g. "links"), by name.
+    counts:     Dict[str, int]
+
+    # Time to extract the data from each markdown file, and its path.
+    files:      List[Tuple[float, str]]
+
+    # Number of worker processes the files were parsed in (1: parsed in this process).
+    jobs:       int
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.counts = {}
+        self.files = []
+        self.jobs = 1
+        self.__start = (time.perf_counter(), time.process_time())
+        # Phases entered and not yet exited, with the times they were (re)started at
+        self.__stack: List[Tuple[str, float, float]] = []
+
+    def phase(self, name: str) -> _Phase:
+        """Context manager measuring the phase `name`."""
+        return _Phase(self, name)
+
+    def file(self, path: Path) -> _File:
+        """Context manager measuring the time to extract the data from the file at `path`."""
+        return _File(self, path)
+
+    def enter(self, name: str) -> None:
+        """Start the phase `name`, pausing the current phase (if any)."""
+        now = (time.perf_counter(), time.process_time())
+        if self.__stack:
+            self.__charge(self.__stack[-1], now)
+        self.__stack.append((name, *now))
+        self.__entry(name)[2] += 1
+
+    def exit(self) -> None:
+        """End the current phase, resuming the one it was nested in (if any)."""
+        now = (time.perf_counter(), time.process_time())
+        self.__charge(self.__stack.pop(), now)
+        if self.__stack:
+            self.__stack[-1] = (self.__stack[-1][0], *now)
+
+    def __entry(self, name: str) -> List[float]:
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = [0.0, 0.0, 0]
+        return entry
+
+    def __charge(self, started: Tuple[str, float, float], now: Tuple[float, float]) -> None:
+        entry = self.__entry(started[0])
+        entry[0] += now[0] - started[1]
+        entry[1] += now[1] - started[2]
+
+    @staticmethod
+    def __order(name: str) -> Tuple[int, str]:
+        return (list(PHASES).index(name) if name in PHASES else len(PHASES), name)
+
+    def merge(self, other: 'Profile') -> None:
+        """Add the phases and files of `other` (e.g. from a worker process) to this one."""
+        for name, (wall, cpu, calls) in other.phases.items():
+            entry = self.__entry(name)
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += calls
+        for name, count in other.counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+        self.files += other.files
+
+    def total(self) -> Tuple[float, float]:
+        """Wall and CPU time since the profile was created."""
+        return (time.perf_counter() - self.__start[0], time.process_time() - self.__start[1])
+
+    def report(self, slowest: int = 10) -> Dict[str, Any]:
+        """The profile as plain data: times in seconds, and the `slowest` files to parse."""
+
+        wall, cpu = self.total()
+        return {
+            'total':    {'wall': wall, 'cpu': cpu},
+            'jobs':     self.jobs,
+            'phases':   {name: {'wall': entry[0], 'cpu': entry[1], 'calls': entry[2]}
+                         for name, entry in sorted(self.phases.items(),
+                                                   key=lambda n_e: Profile.__order(n_e[0]))},
+            'counts':   dict(self.counts),
+            'slowest':  [{'path': path, 'seconds': seconds}
+                         for seconds, path in nlargest(slowest, self.files)],
+        }
+
+    def describe(self, slowest: int = 10) -> str:
+        """Provide a textual description of the profile, as a table."""
+
+        report = self.report(slowest)
+        lines = ["{:10}{:>12}{:>12}{:>10}".format('phase', 'wall (s)', 'cpu (s)', 'calls')]
+        for name, entry in report['phases'].items():
+            lines.append("{:10}{:>12.3f}{:>12.3f}{:>10}".format(
+                name, entry['wall'], entry['cpu'], entry['calls']))
+        lines.append("{:10}{:>12.3f}{:>12.3f}".format(
+            'total', report['total']['wall'], report['total']['cpu']))
+        if report['jobs'] > 1:
+            lines.append("(read and parse are summed over {} worker processes)".format(
+                report['jobs']))
+        if report['counts']:
+            lines.append("Counts: " + ", ".join(
+                "{} {}".format(count, name) for name, count in report['counts'].items()))
+        if report['slowest']:
+            lines.append("Slowest files to parse:")
+            lines += ["{:10.3f}  {}".format(entry['seconds'], entry['path'])
+                      for entry in report['slowest']]
+        return "\n".join(lines)
+
+    def to_json(self, slowest: int = 10) -> str:
+        """The profile as JSON. See `report`."""
+        return json.dumps(self.report(slowest), indent=2)
+
+
+# The profile being collected, if profiling is enabled.
+current: Optional[Profile] = None
+
+__nothing = _Nothing()
+
+
+def phase(name: str):
+    """Context manager measuring the phase `name` in the current profile, if any."""
+    return current.phase(name) if current else __nothing
+
+
+def file(path: Path):
+    """Context manager measuring the time to extract the data from the file at `path` in the
+    current profile, if any.
+    """
+    return current.file(path) if current else __nothing
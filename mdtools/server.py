@@ -0,0 +1,509 @@
+"""Server mode: keeps the model of a markdown tree in memory, and answers requests about it
+(e.g. from an editor, or a pre-commit hook) without walking and parsing the tree again.
+
+The tree is read once, when the server starts, and then kept up to date incrementally (see
+`watch.Watcher`): from the changes to the files on the disk, which the server is notified
+of by inotify (where available), or by the clients (`changed`); and from the contents of
+files being edited, which the clients send with `diagnostics`.
+
+The protocol is JSON-RPC 2.0, framed as in the Language Server Protocol: each message is
+preceded by a `Content-Length: <bytes>` header and a blank line. It is spoken on the
+standard input and output, or on a Unix domain socket (one connection at a time). Paths in
+the requests are absolute, or relative to the base of the tree. Methods:
+
+- diagnostics {path, text?}: the issues of the file, as in `report.record`. If `text` is
+  given, it replaces the contents of the file in the model (and the issues are of it).
+- suggest {path, line, column?}: the destinations the link at that position (1-based; the
+  last link starting on the line at or before the column) could be fixed to.
+- complete {path, prefix}: completions of a link destination being typed in the file: the
+  files and directories in the directory of the href, or the anchors in the target of the
+  href, if the prefix has a '#'.
+- changed {paths}: the files and directories which were created, modified or deleted; the
+  issues of the links the changes could affect.
+- shutdown: stop the server.
+
+Invalid params (of the wrong type, or paths which are outside the tree or excluded from it)
+are answered with the INVALID_PARAMS error; errors of the server itself with INTERNAL_ERROR,
+and the server goes on.
+
+`Client` talks to a server, for tests and scripts (see `--connect`).
+"""
+
+
+import contextlib
+import functools
+import getopt
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, IO, Callable, Dict, List, Optional, Tuple
+
+from mdtools import util
+from mdtools.issues import iter_issues, report
+from mdtools.issues.fix.link_issues import suggest
+from mdtools.issues.fix.options import Options
+from mdtools.model import read_md_tree
+from mdtools.model.cache import ParseCache
+from mdtools.model.link import Link
+from mdtools.model.tree import Tree
+from mdtools.model.walk import Walker
+from mdtools.watch import InotifyMonitor, Watcher
+
+# pylint: disable=multiple-statements
+
+
+# JSON-RPC error codes.
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RequestError(Exception):
+    """An error answering a request, reported to the client."""
+
+    code: int
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def read_message(stream: IO[bytes]) -> Optional[Any]:
+    """Read a message from `stream`. Return None at the end of the stream."""
+
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is not None:
+                break
+            continue
+        name, _, value = line.decode('ascii').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+def write_message(stream: IO[bytes], message: Any) -> None:
+    """Write a message to `stream`."""
+    body = json.dumps(message).encode('utf-8')
+    stream.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    stream.flush()
+
+
+class Server:
+    """Answers requests about a markdown tree. See the module docstring."""
+
+    tree:       Tree
+
+    watcher:    Watcher
+
+    # Reports the changes to the tree on the disk, if available.
+    monitor:    Optional[InotifyMonitor]
+
+    # Whether to use fuzzy matching for the suggestions.
+    fuzzy:      bool
+
+    # Set when the server is asked to stop.
+    stopped:    bool
+
+    def __init__(self, tree: Tree, walker: Optional[Walker] = None,
+                 monitor: Optional[InotifyMonitor] = None, fuzzy: bool = False) -> None:
+        """tree: a tree populated by `read_md_tree`, with the scanner (so that the links have
+            their positions).
+        walker: the walker the tree was populated with (see `Watcher`).
+        """
+        self.tree = tree
+        self.watcher = Watcher(tree, None, walker)
+        self.monitor = monitor
+        self.fuzzy = fuzzy
+        self.stopped = False
+        # The methods, and their params: the type of each, and whether it is required
+        self.__methods: Dict[str, Tuple[Callable[..., Any], Dict[str, Tuple[type, bool]]]] = {
+            'diagnostics':  (self.diagnostics, {'path': (str, True), 'text': (str, False)}),
+            'suggest':      (self.suggest, {'path': (str, True), 'line': (int, True),
+                                            'column': (int, False)}),
+            'complete':     (self.complete, {'path': (str, True), 'prefix': (str, True)}),
+            'changed':      (self.changed, {'paths': (list, True)}),
+            'shutdown':     (self.shutdown, {}),
+        }
+        # Paths in each directory (by id in the path table), for `complete`; rebuilt when
+        # the tree changes
+        self.__children: Dict[int, List[Path]] = {}
+        self.__generation = -1
+
+    def handle(self, request: Any) -> Optional[Dict[str, Any]]:
+        """Answer a request. Return the response, or None for notifications (requests
+        without an id).
+        """
+
+        is_request = isinstance(request, dict) and 'method' in request
+        response: Dict[str, Any] = {'jsonrpc': '2.0', 'id': None}
+        try:
+            if not is_request:
+                raise RequestError(PARSE_ERROR, "not a request")
+            response['id'] = request.get('id')
+            method = self.__methods.get(request['method'])
+            if method is None:
+                raise RequestError(METHOD_NOT_FOUND, "unknown method: " + str(request['method']))
+            params = request.get('params') or {}
+            self.__check_params(params, method[1])
+            if self.monitor:
+                changed = self.monitor.wait(0)
+                if changed:
+                    self.watcher.update(changed)
+            response['result'] = method[0](**params)
+        except RequestError as exc:
+            response['error'] = {'code': exc.code, 'message': str(exc)}
+        except Exception as exc:    # pylint: disable=broad-except
+            response['error'] = {'code': INTERNAL_ERROR,
+                                 'message': type(exc).__name__ + ": " + str(exc)}
+        return None if is_request and 'id' not in request else response
+
+    @staticmethod
+    def __check_params(params: Any, spec: Dict[str, Tuple[type, bool]]) -> None:
+        """Raise RequestError if `params` do not match `spec`: the type of each param, and
+        whether it is required. Params which are not required may be null.
+        """
+        if not isinstance(params, dict):
+            raise RequestError(INVALID_PARAMS, "params must be an object")
+        for name, value in params.items():
+            if name not in spec:
+                raise RequestError(INVALID_PARAMS, "unknown param: " + str(name))
+            type_, required = spec[name]
+            if value is None and not required:
+                continue
+            if not isinstance(value, type_) or isinstance(value, bool) and type_ is not bool:
+                raise RequestError(INVALID_PARAMS, name + " must be of type " + type_.__name__)
+        missing = [name for name, (_, required) in spec.items()
+                   if required and name not in params]
+        if missing:
+            raise RequestError(INVALID_PARAMS, "missing param: " + ", ".join(missing))
+
+    def serve(self, reader: IO[bytes], writer: IO[bytes]) -> None:
+        """Answer the requests read from `reader`, until it ends or the server is stopped."""
+        while not self.stopped:
+            try:
+                request = read_message(reader)
+            except ValueError as exc:
+                write_message(writer, {'jsonrpc': '2.0', 'id': None, 'error': {
+                    'code': PARSE_ERROR, 'message': str(exc)}})
+                continue
+            if request is None:
+                return
+            response = self.handle(request)
+            if response is not None:
+                write_message(writer, response)
+
+    # -------------------------------------------------------------------------
+    # Methods
+
+    def diagnostics(self, path: str, text: Optional[str] = None) -> List[Dict[str, Any]]:
+        """See the module docstring."""
+
+        file_path = self.__path(path)
+        if text is not None:
+            self.watcher.update({file_path}, {file_path: text})
+        file = self.tree.files.get(file_path)
+        if file is None:
+            raise RequestError(INVALID_PARAMS, "not in the tree: " + path)
+
+        found = iter_issues(self.tree, ((file_path, link) for link in file.links), [file_path])
+        return [report.record(issue, self.tree.base, suggest(issue, self.tree, self.fuzzy))
+                for issue in found]
+
+    def suggest(self, path: str, line: int, column: Optional[int] = None) -> List[str]:
+        """See the module docstring."""
+
+        file_path = self.__path(path)
+        file = self.tree.files.get(file_path)
+        at = [link for link in file.links if link.span and link.span.line == line
+              and (column is None or link.span.column <= column)] if file else []
+        if not at:
+            return []
+        issue = next(iter_issues(self.tree, [(file_path, at[-1])]), None)
+        return suggest(issue, self.tree, self.fuzzy) if issue else []
+
+    def complete(self, path: str, prefix: str) -> List[str]:
+        """See the module docstring."""
+
+        tree = self.tree
+        file_path = self.__path(path)
+        if '#' in prefix:
+            href, anchor = Link.split_link(prefix)
+            target = tree.files.get(tree.resolve(file_path, href))
+            if target is None:
+                return []
+            names = set(target.anchors) | set(target.h_anchors)
+            return sorted(href + '#' + name for name in names if name.startswith(anchor))
+
+        dir_href, _, name = prefix.rpartition('/')
+        if dir_href or prefix.startswith('/'):
+            dir_ = tree.resolve(file_path, dir_href + '/' if dir_href else '/')
+        else:
+            dir_ = file_path.parent
+        dir_id = tree.paths.get(dir_)
+        if dir_id is None:
+            return []
+        children = self.__dir_children()
+        head = prefix[:len(prefix) - len(name)]
+        return sorted(head + child.name + ('/' if tree.paths.get(child) in children else '')
+                      for child in children.get(dir_id, []) if child.name.startswith(name))
+
+    def changed(self, paths: List[str]) -> List[Dict[str, Any]]:
+        """See the module docstring."""
+        if not all(isinstance(path, str) for path in paths):
+            raise RequestError(INVALID_PARAMS, "paths must be strings")
+        found = self.watcher.update({self.__path(path) for path in paths})
+        return [report.record(issue, self.tree.base, suggest(issue, self.tree, self.fuzzy))
+                for issue in found]
+
+    def shutdown(self) -> None:
+        """See the module docstring."""
+        self.stopped = True
+
+    # -------------------------------------------------------------------------
+
+    def __path(self, path: str) -> Path:
+        """The path of a file, given in a request. Raise RequestError if it is outside the
+        tree, or excluded from it.
+        """
+        tree = self.tree
+        resolved = tree.base.joinpath(path).resolve()
+        if util.path_to_href(resolved, tree.base) is None:
+            raise RequestError(INVALID_PARAMS, "outside the tree: " + path)
+        walker = self.watcher.walker
+        if walker and walker.excluded(tree, resolved):
+            raise RequestError(INVALID_PARAMS, "excluded from the tree: " + path)
+        return resolved
+
+    def __dir_children(self) -> Dict[int, List[Path]]:
+        """The paths in the tree, by id of their directory."""
+        if self.__generation != self.tree.generation:
+            self.__children = {}
+            for path in self.tree.files:
+                self.__children.setdefault(self.tree.paths.parent(path), []).append(path)
+            self.__generation = self.tree.generation
+        return self.__children
+
+
+def serve_socket(server: Server, path: str) -> None:
+    """Answer requests on a Unix domain socket at `path`, one connection at a time, until
+    the server is stopped.
+    """
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(path)
+        listener.listen()
+        try:
+            while not server.stopped:
+                conn, _ = listener.accept()
+                with conn, conn.makefile('rb') as reader, conn.makefile('wb') as writer:
+                    server.serve(reader, writer)
+        finally:
+            os.unlink(path)
+
+
+# -----------------------------------------------------------------------------
+# Client
+
+
+class Client:
+    """Sends requests to a server: one started for the client (see `spawn`), or one
+    listening on a socket (see `connect`).
+    """
+
+    def __init__(self, reader: IO[bytes], writer: IO[bytes],
+                 process: Optional[subprocess.Popen] = None,
+                 sock: Optional[socket.socket] = None) -> None:
+        self.__reader = reader
+        self.__writer = writer
+        self.__process = process
+        self.__socket = sock
+        self.__id = 0
+
+    @staticmethod
+    def spawn(args: List[str]) -> 'Client':
+        """Start a server with the command-line arguments `args` (see `print_usage`), on
+        the standard input and output. The server runs this copy of mdtools, even if it is
+        not installed.
+        """
+        env = dict(os.environ)
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_dir,
+                                                          env.get('PYTHONPATH')]))
+        process = subprocess.Popen([sys.executable, '-m', 'mdtools.server', *args],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        if process.stdout is None or process.stdin is None:
+            raise OSError("no pipes to the server")
+        return Client(process.stdout, process.stdin, process=process)
+
+    @staticmethod
+    def connect(path: str, timeout: float = 10.0) -> 'Client':
+        """Connect to a server listening on the socket at `path`, waiting at most `timeout`
+        seconds for it to be listening.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                break
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        return Client(sock.makefile('rb'), sock.makefile('wb'), sock=sock)
+
+    def request(self, method: str, **params) -> Any:
+        """Send a request, and return the result. Raises RequestError if the server
+        answers with an error.
+        """
+
+        self.__id += 1
+        write_message(self.__writer, {'jsonrpc': '2.0', 'id': self.__id, 'method': method,
+                                      'params': params})
+        response = read_message(self.__reader)
+        if response is None:
+            raise RequestError(0, "the server stopped")
+        if 'error' in response:
+            raise RequestError(response['error']['code'], response['error']['message'])
+        return response.get('result')
+
+    def close(self) -> None:
+        """Stop a server started for the client, or disconnect from the server."""
+        if self.__process:
+            with contextlib.suppress(RequestError, OSError):
+                self.request('shutdown')
+            self.__writer.close()
+            self.__process.wait()
+            self.__reader.close()
+        else:
+            self.__reader.close()
+            self.__writer.close()
+            if self.__socket:
+                self.__socket.close()
+
+
+# -----------------------------------------------------------------------------
+# Usage info
+
+def print_usage():
+    """Print info about the command-line arguments of the script."""
+    print("""
+Usage: mdlinkd <options> <markdown_dir_root>
+       mdlinkd --connect=SOCKET <method> [<params>]
+Read the markdown tree, keep it in memory, and answer requests about it (diagnostics of a
+file, fix suggestions for a link, completion of link destinations), on the standard input
+and output, until shut down. See mdtools/server.py for the protocol.
+Options:
+    --socket=SOCKET: Answer requests on the Unix domain socket SOCKET instead.
+    --connect=SOCKET: Send a request to the server listening on SOCKET, and print the
+        result. <params>: the parameters of the request, as a JSON object.
+    -f: Use fuzzy matching for suggestions.
+    -j N, --jobs=N: Parse markdown files in N processes (0: one per CPU), at startup.
+    --exclude=PATTERN, --no-ignore, --follow-links: see mdlinkcheck.
+    --no-cache: Do not use the parse cache.
+    --cache=FILE: Location of the parse cache (default: ~/.cache/mdtools/parse-cache.sqlite).
+""", file=sys.stderr)
+
+# -----------------------------------------------------------------------------
+# Argument parsing
+
+def main():
+    """Script entry point"""
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], "fj:",
+                                      ["jobs=", "no-cache", "cache=", "exclude=",
+                                       "no-ignore", "follow-links", "socket=", "connect="])
+    except getopt.GetoptError as exc:
+        print(exc.msg + "\n", file=sys.stderr)
+        print_usage()
+        sys.exit(2)
+
+    opt = Options()
+    socket_path = None
+    connect = None
+    for o in optlist:
+        if   o[0] == '-f': opt.fuzzy = True
+        elif o[0] in ('-j', '--jobs'):
+            try:
+                opt.jobs = int(o[1])
+            except ValueError:
+                print("Invalid number of jobs: " + o[1] + "\n", file=sys.stderr)
+                print_usage()
+                sys.exit(2)
+        elif o[0] == '--no-cache': opt.cache = False
+        elif o[0] == '--cache': opt.cache_file = o[1]
+        elif o[0] == '--exclude': opt.exclude.append(o[1])
+        elif o[0] == '--no-ignore': opt.ignore_files = False
+        elif o[0] == '--follow-links': opt.follow_links = True
+        elif o[0] == '--socket': socket_path = o[1]
+        elif o[0] == '--connect': connect = o[1]
+
+    if connect:
+        if len(args) not in (1, 2):
+            print_usage()
+            sys.exit(2)
+        client = Client.connect(connect)
+        try:
+            result = client.request(args[0], **(json.loads(args[1]) if len(args) > 1 else {}))
+        except RequestError as exc:
+            print(str(exc), file=sys.stderr)
+            sys.exit(1)
+        finally:
+            client.close()
+        print(json.dumps(result, indent=2))
+        return
+
+    if len(args) != 1 or not Path(args[0]).resolve().is_dir():
+        print_usage()
+        sys.exit(2)
+
+    # The standard output may carry the protocol: everything else goes to the standard error.
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.monotonic()
+        tree = Tree(args[0])
+        walker = Walker(opt.exclude, opt.ignore_files, opt.follow_links)
+        cache = ParseCache(opt.cache_file or None) if opt.cache else None
+        read_md_tree(tree, opt.jobs, cache, 'scan', walker)
+        if cache:
+            cache.close()
+        try:
+            monitor: Optional[InotifyMonitor] = InotifyMonitor(
+                tree.base, functools.partial(walker.excluded, tree))
+        except (OSError, AttributeError):
+            monitor = None
+        print(util.clr("GREY") + "Read {} file(s) in {:.0f} ms".format(
+            len(tree.files), (time.monotonic() - start) * 1000) + util.clr(""))
+
+        server = Server(tree, walker, monitor, opt.fuzzy)
+        try:
+            if socket_path:
+                serve_socket(server, socket_path)
+            else:
+                server.serve(sys.stdin.buffer, sys.__stdout__.buffer)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if monitor:
+                monitor.close()
+
+
+if __name__ == "__main__":
+    main()
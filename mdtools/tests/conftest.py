@@ -0,0 +1,28 @@
+"""Shared test fixtures and helpers."""
+
+
+import os
+import shutil
+import pytest
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+
+
+# The test tree (see also `tree_out`, the test tree as automatically fixed)
+TREE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tree')
+
+
+@pytest.fixture
+def tmp_tree(tmp_path):
+    """A copy of the test tree, in the temporary directory of the test. Return its path."""
+    tree_path = str(tmp_path / 'tree')
+    shutil.copytree(TREE, tree_path)
+    return tree_path
+
+
+def read_tree(tree_path, **kwargs) -> Tree:
+    """Read the tree at `tree_path`, with the arguments of `read_md_tree`."""
+    tree = Tree(tree_path)
+    read_md_tree(tree, **kwargs)
+    return tree
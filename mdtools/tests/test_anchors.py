@@ -0,0 +1,33 @@
+"""Anchor tests."""
+
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree, Anchor
+from mdtools.issues import analyze, issues
+from mdtools.pipeline import Pipeline
+
+
+def test_headings_to_anchors():
+    """ Repeated headings get numeric suffixes, as on GitHub. """
+    assert Anchor.headings_to_anchors(['Foo', 'Bar', 'foo', 'Foo-1', 'FOO', 'Foo!']) == \
+        ['foo', 'bar', 'foo-1', 'foo-1-1', 'foo-2', 'foo-3']
+
+
+def test_duplicates(tmp_path):
+    """ Links to suffixed headings work, and repeated explicit anchors are reported. """
+
+    tmp_path.joinpath('a.md').write_text(
+        '# Usage\n<a name="top"></a>\n## Usage\n<a name="top"></a>\n<a name="x"></a>\n'
+        '[1](#usage-1) [2](#usage-2) [3](b.md#x)\n')
+    tmp_path.joinpath('b.md').write_text('<a name="x"></a>\n')
+    for read in ('tree', 'pipeline'):
+        tree = Tree(str(tmp_path))
+        if read == 'tree':
+            read_md_tree(tree, 1, None, 'scan')
+            found = analyze(tree)
+        else:
+            found = list(Pipeline(tree).run())
+        assert [type(i) for i in found] == [issues.DuplicateAnchor, issues.AnchorNotFound]
+        assert found[0].anchor.name == 'top' and found[0].path.name == 'a.md'
+        assert found[1].link.get_dest() == '#usage-2'
+        assert tree.anchors['top'] == [tree.base.joinpath('a.md')]
@@ -0,0 +1,44 @@
+"""Reverse link index tests."""
+
+
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze
+from mdtools.issues.fix import fix_all
+from mdtools.issues.fix.options import Options
+
+from .conftest import read_tree
+
+
+def backlinks_of(tree):
+    """A comparable summary of the reverse link index."""
+    return ({str(k): sorted((str(p), l.get_dest()) for p, l in v)
+             for k, v in tree.backlinks.items()},
+            {str(k): sorted((str(p), l.get_dest()) for p, l in v)
+             for k, v in tree.anchor_backlinks.items()})
+
+
+def test_backlinks(tmp_tree):
+    """ The index answers "what links here", and is kept current when links are patched. """
+
+    tree = read_tree(tmp_tree)
+    duis = tree.base / 'purus' / 'bibendum' / 'interdum' / 'Duis'
+    libero = duis / 'libero.md'
+    neque = duis / 'ultricies' / 'Neque.md'
+
+    assert [(p, l.get_dest()) for p, l in tree.links_to(libero, 'auctor')] \
+        == [(libero, '#auctor')]
+    assert len(tree.links_to(libero)) == 11
+    assert tree.links_to(neque) == []
+
+    fix_all(analyze(tree), tree, Options(mode='-a'))
+
+    assert [(p, l.get_dest()) for p, l in tree.links_to(neque, 'lorem')] \
+        == [(libero, 'ultricies/Neque.md#lorem')]
+
+    # Same as an index built from scratch from the patched links
+    fresh = Tree(tmp_tree)
+    for path, file in tree.files.items():
+        fresh.on_file(path)
+        for link in file.links:
+            fresh.on_link(path, link)
+    assert backlinks_of(tree) == backlinks_of(fresh)
@@ -0,0 +1,54 @@
+"""Benchmark suite tests."""
+
+
+from pathlib import Path
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze, issues
+from mdtools.bench import synth, suite
+
+
+OPTIONS = synth.SynthOptions(files=60, depth=2, per_dir=10, broken=0.3)
+
+
+def contents(base: Path):
+    return {str(p.relative_to(base)): p.read_bytes() for p in base.rglob('*.md')}
+
+
+def test_synth(tmp_path):
+    """ The generated tree only depends on the options, and has the broken links it says. """
+
+    one, two = tmp_path.joinpath('one'), tmp_path.joinpath('two')
+    counts = synth.generate(one, OPTIONS)
+    assert synth.generate(two, OPTIONS) == counts
+    assert contents(one) == contents(two)
+    assert counts['files'] == len(contents(one)) == 60
+    assert counts['links'] == 60 * OPTIONS.links
+
+    tree = Tree(str(one))
+    read_md_tree(tree, 1, None, 'scan')
+    found = analyze(tree)
+    assert sum(isinstance(i, issues.TargetNotFound) for i in found) \
+        == counts['broken_name'] + counts['broken_moved'] > 0
+    assert sum(isinstance(i, issues.AnchorNotFound) for i in found) \
+        == counts['broken_anchor']
+
+
+def test_suite(tmp_path, capfd):
+    """ The suite times all stages, fixes the moved targets, and reports regressions. """
+
+    synth.generate(tmp_path, OPTIONS)
+    opt = suite.parse_args(['-r', '1', '--files=60', '--depth=2', '--per-dir=10',
+                            '--broken=0.3'])
+    assert opt.synth == OPTIONS
+    results = suite.run(tmp_path.resolve(), opt)
+    assert list(results['times']) == ['read', 'analyze', 'suggest', 'patch']
+    assert results['counts']['fixed'] > 0
+
+    results['params'] = {}
+    baseline = {'params': {}, 'times': {'read': 1.0, 'analyze': 1.0, 'suggest': 1.0}}
+    results['times'].update(read=0.9, analyze=2.0, suggest=1.01)
+    assert suite.compare(results, baseline, 0.2) == ['analyze']
+    out, _ = capfd.readouterr()
+    assert "SLOWER" in out
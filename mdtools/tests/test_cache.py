@@ -0,0 +1,120 @@
+"""Parse cache tests."""
+
+
+import os
+import shutil
+import sqlite3
+import pytest
+
+from mdtools.model import cache, engines
+from mdtools.model.cache import ParseCache
+from mdtools.model.tree import Tree
+
+from .conftest import read_tree
+
+
+def model_of(tree: Tree):
+    """A comparable summary of the model."""
+    return ({str(p): ([l.get_dest() for l in f.links], list(f.anchors), list(f.h_anchors))
+             for p, f in tree.files.items()},
+            tree.names, tree.anchors, tree.h_anchors)
+
+
+def read(tree_path, parse_cache, engine='marko'):
+    """Read the tree with `parse_cache`, and close it."""
+    tree = read_tree(tree_path, cache=parse_cache, engine=engine)
+    parse_cache.close()
+    return tree
+
+
+def test_cache_hits(tmp_tree, tmp_path):
+    """ A second run finds every file in the cache, and builds the same model. """
+
+    tree_path = tmp_tree
+    db = tmp_path / 'cache.sqlite'
+
+    cold = ParseCache(db)
+    tree1 = read(tree_path, cold)
+    assert cold.stats.hits == 0 and cold.stats.misses == 11
+
+    warm = ParseCache(db)
+    tree2 = read(tree_path, warm)
+    assert warm.stats.hits == 11 and warm.stats.misses == 0
+    assert model_of(tree1) == model_of(tree2)
+
+    # A changed file is parsed again; a copy of a known file is not.
+    with open(os.path.join(tree_path, 'root.md'), 'a') as f:
+        f.write('\n<a name="appended"></a>\n')
+    shutil.copy(os.path.join(tree_path, 'purus', 'consectetur.md'),
+                os.path.join(tree_path, 'copy.md'))
+    again = ParseCache(db)
+    tree3 = read(tree_path, again)
+    assert again.stats.misses == 1 and again.stats.dedup_hits == 1
+    assert 'appended' in tree3.anchors
+    assert (tree3.files[tree3.base / 'copy.md'].anchors.keys()
+            == tree3.files[tree3.base / 'purus' / 'consectetur.md'].anchors.keys())
+
+
+def test_cache_eviction(tmp_tree, tmp_path):
+    """ The cache stays under its size cap by evicting the least recently used entries. """
+
+    tree_path = tmp_tree
+    db = tmp_path / 'cache.sqlite'
+
+    cache = ParseCache(db, max_bytes=1000)
+    read(tree_path, cache)
+    assert cache.stats.evictions > 0
+    assert 0 < cache.stats.bytes <= 1000
+
+    warm = ParseCache(db, max_bytes=1000)
+    read(tree_path, warm)
+    assert warm.stats.hits == cache.stats.entries
+
+
+def test_cache_concurrent(tmp_tree, tmp_path, monkeypatch):
+    """ Sessions at the same time share the cache; if it stays locked, a session runs
+    without it. Each engine has its own entries. """
+
+    tree_path = tmp_tree
+    db = tmp_path / 'cache.sqlite'
+
+    first, second = ParseCache(db), ParseCache(db)
+    tree = read_tree(tree_path, cache=first, engine='marko')
+    read(tree_path, second)
+    first.close()
+    assert second.stats.misses == 11
+
+    scanned = read(tree_path, ParseCache(db), 'scan')
+    assert all(link.span is not None for file in scanned.files.values() for link in file.links)
+
+    monkeypatch.setattr(cache, 'BUSY_TIMEOUT', 0.1)
+    lock = sqlite3.connect(str(db), isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+    locked = ParseCache(db)
+    assert not locked.enabled
+    assert model_of(read(tree_path, locked)) == model_of(tree)
+    lock.execute("ROLLBACK")
+
+
+@pytest.mark.parametrize("engine", ['marko', 'scan'])
+def test_cache_parses_hashed_content(tmp_path, engine):
+    """ A file that missed is parsed from the contents the cache hashed, so that what is
+    stored matches its hash, even if the file changes in between.
+    """
+
+    path = tmp_path / 'a.md'
+    path.write_bytes(b'[a](a.md)\r\n')
+    parse_cache = ParseCache(tmp_path / 'cache.sqlite')
+    assert parse_cache.get(path, engine) is None
+    data = parse_cache.content(path)
+    assert data == b'[a](a.md)\r\n' and parse_cache.content(path) is None
+
+    path.write_text('[b](b.md)\n')
+    extract = engines[engine](path, data)
+    assert extract.links == ['a.md']
+    parse_cache.put(path, extract)
+    parse_cache.close()
+
+    path.write_bytes(data)
+    assert ParseCache(tmp_path / 'cache.sqlite').get(path, engine).links == ['a.md']
+    assert engines[engine](path).links == ['a.md']
@@ -0,0 +1,78 @@
+"""Changed-files mode tests."""
+
+
+import json
+import subprocess
+
+import pytest
+
+from mdtools import linkcheck
+from mdtools.changes import changed_since, affected_links
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze, issues
+
+
+def git(base, *args):
+    subprocess.run(['git', '-C', str(base), '-c', 'user.name=t', '-c', 'user.email=t@t',
+                    *args], check=True, stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    files = {
+        'a.md':     '# A\n[b](b.md#b) [c](c.md) [x](x.md)\n',
+        'b.md':     '# B\n[a](a.md#a)\n',
+        'c.md':     '# C\n',
+        'd.md':     '[c](c.md#c) [e](/e.md) [x](x.md)\n',
+        'e.md':     '# E\n',
+    }
+    for name, text in files.items():
+        tmp_path.joinpath(name).write_text(text)
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'init')
+    return tmp_path
+
+
+def test_changed_since(repo, monkeypatch, capsys):
+    """ The links in changed files, and the links to them, are checked; with the same
+    issues as a full check.
+    """
+
+    repo.joinpath('b.md').write_text('# Bee\n[a](a.md#a) [z](z.md)\n')    # modified
+    repo.joinpath('e.md').write_text('<a name="e"></a><a name="e"></a>\n')    # modified
+    git(repo, 'mv', 'c.md', 'c2.md')                                     # renamed
+    repo.joinpath('new.md').write_text('[e](e.md#nope)\n')              # untracked
+
+    changes = changed_since(repo, 'HEAD')
+    base = repo.resolve()
+    assert changes.modified == {base / 'b.md', base / 'c2.md', base / 'e.md', base / 'new.md'}
+    assert changes.deleted == {base / 'c.md'}
+
+    tree = Tree(str(repo))
+    read_md_tree(tree, 1, None, 'scan')
+    links = affected_links(tree, changes)
+    assert sorted((path.name, link.get_dest()) for path, link in links) == [
+        ('a.md', 'b.md#b'), ('a.md', 'c.md'), ('b.md', 'a.md#a'), ('b.md', 'z.md'),
+        ('d.md', '/e.md'), ('d.md', 'c.md#c'), ('new.md', 'e.md#nope')]
+    ids = {id(link) for _, link in links}
+    files = [path for path in tree.files if path in changes.modified]
+    key = lambda i: (str(i.path), i.anchor.name if isinstance(i, issues.DuplicateAnchor)
+                     else str(id(i.link)))
+    assert sorted(map(key, analyze(tree, links, files))) == \
+        sorted(key(i) for i in analyze(tree) if isinstance(i, issues.DuplicateAnchor) and
+               i.path in changes.modified or id(getattr(i, 'link', None)) in ids)
+
+    monkeypatch.setattr("sys.argv", ["pytest", "--no-cache", "--format=jsonl",
+                                     "--changed-since=HEAD", str(repo)])
+    linkcheck.main()
+    out, _ = capsys.readouterr()
+    found = [json.loads(line) for line in out.splitlines()]
+    assert sorted(rec['dest'] for rec in found if 'dest' in rec) == \
+        ['b.md#b', 'c.md', 'c.md#c', 'e.md#nope', 'z.md']
+    assert [(rec['type'], rec['file'], rec['anchor']) for rec in found if 'anchor' in rec] == \
+        [('duplicate-anchor', 'e.md', 'e')]
+
+    with pytest.raises(ValueError):
+        changed_since(repo, 'no-such-revision')
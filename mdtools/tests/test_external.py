@@ -0,0 +1,111 @@
+"""External link checker tests, against a local HTTP server."""
+
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import issues
+from mdtools.issues.external import Checker, UrlCache, check_external
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ /ok: 200. /nohead: 405 to HEAD, 200 to GET. /moved: redirects to /ok. /slow: 200,
+    after a while. Anything else: 404. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            server.ports.add(self.client_address[1])
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        path = self.path.split('?')[0]
+        time.sleep(0.02 if path != '/slow' else 0.3)
+        if path in ('/ok', '/slow') or (path == '/nohead' and self.command == 'GET'):
+            self.send_response(200)
+        elif path == '/nohead':
+            self.send_response(405)
+        elif path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/ok')
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        with server.lock:
+            server.active -= 1
+
+    do_HEAD = respond
+    do_GET = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests, httpd.ports, httpd.active, httpd.max_active = [], set(), 0, 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_external(server, tmp_path):
+    """ Broken URLs are reported once per link, each URL is requested once, connections are
+    reused, the number of requests per host is limited, and the results are cached. """
+
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    paths = ['/ok', '/nohead', '/moved', '/missing', '/gone']
+    paths += ['/ok?' + str(i) for i in range(8)]
+    docs = tmp_path.joinpath('docs')
+    docs.mkdir()
+    docs.joinpath('a.md').write_text(''.join('[x]({}{})\n'.format(url, p) for p in paths))
+    docs.joinpath('b.md').write_text('[x]({0}/missing#top) [y]({0}/ok) [z](a.md)\n'.format(url))
+    tree = Tree(str(docs))
+    read_md_tree(tree, 1, None, 'scan')
+
+    cache = UrlCache(tmp_path.joinpath('urls.sqlite'))
+    found = check_external(tree, Checker(per_host=2, cache=cache))
+    cache.close()
+    assert all(isinstance(i, issues.ExternalLinkBroken) and i.status == 404 for i in found)
+    assert sorted((i.path.name, i.link.get_dest()[len(url):]) for i in found) == \
+        [('a.md', '/gone'), ('a.md', '/missing'), ('b.md', '/missing#top')]
+    assert "404" in found[0].describe()
+
+    heads = [p for method, p in server.requests if method == 'HEAD']
+    assert sorted(heads) == sorted(paths + ['/ok'])     # '/ok' again, after '/moved'
+    assert ('GET', '/nohead') in server.requests
+    assert len(server.ports) < len(server.requests)
+    assert server.max_active <= 2
+
+    server.requests.clear()
+    cache = UrlCache(tmp_path.joinpath('urls.sqlite'))
+    again = check_external(tree, Checker(cache=cache))
+    cache.close()
+    assert not server.requests and len(again) == len(found)
+
+
+def test_external_errors(server, tmp_path):
+    """ Unreachable hosts and timeouts are reported, without a status, and not cached. """
+
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    cache = UrlCache(tmp_path.joinpath('urls.sqlite'))
+    checker = Checker(timeout=0.1, cache=cache)
+    results = checker.check([url + '/slow', 'http://127.0.0.1:1/', url + '/missing'])
+    assert results[url + '/slow'] == (0, 'timed out')
+    assert results['http://127.0.0.1:1/'].status == 0
+    assert not any(result.ok() for result in results.values())
+    assert cache.get(url + '/slow') is None and cache.get('http://127.0.0.1:1/') is None
+    cache.close()
+    assert UrlCache(tmp_path.joinpath('urls.sqlite')).get(url + '/missing') == (404, 'Not Found')
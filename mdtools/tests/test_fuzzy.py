@@ -0,0 +1,126 @@
+"""Fuzzy matching tests."""
+
+
+import random
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze
+from mdtools.issues.fix import fuzzy, fix_all, link_issues
+from mdtools.issues.fix.options import Options
+from mdtools.bench import synth
+from mdtools.bench.fuzzy import levenshtein_numpy, best_match_numpy, make_names, misspell
+
+
+def test_levenshtein_bounded():
+    """ Within the bound, the distance is exact; beyond it, `max_dist + 1` is returned. """
+
+    rnd = random.Random(0)
+    alphabet = 'abcd'
+    for _ in range(500):
+        a = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 9)))
+        b = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 9)))
+        exact = int(levenshtein_numpy(a, b))
+        assert fuzzy.levenshtein(a, b) == exact
+        for k in range(5):
+            assert fuzzy.levenshtein(a, b, k) == min(exact, k + 1)
+            assert fuzzy.histogram_bound(fuzzy.Counter(a), b) <= exact
+
+
+def test_best_match_bounded():
+    """ The bounded search finds the same match as the exhaustive one, if within the bound. """
+
+    rnd = random.Random(0)
+    names = make_names(100, rnd) + ['Hello World.md', 'helloworld.md']
+    for query in [misspell(rnd.choice(names), rnd) for _ in range(20)] + ['hello  world.md']:
+        old = best_match_numpy(query, names)
+        new = fuzzy.best_match(query, names, 3)
+        if old[1] <= 3:
+            assert new == old
+        else:
+            assert new == (None, fuzzy.math.inf)
+
+
+def test_fuzzy_index():
+    """ The index finds the same match as `best_match`, and follows changes of its keys. """
+
+    rnd = random.Random(1)
+    names = make_names(500, rnd) + ['Hello World.md', 'helloworld.md', 'ab']
+    index = fuzzy.FuzzyIndex(names)
+    queries = [misspell(rnd.choice(names), rnd) for _ in range(30)] + ['hello  world.md', 'a']
+    for query in queries:
+        for k in (3, 4):
+            assert index.nearest(query, k) == fuzzy.best_match(query, names, k)
+
+    names = names[250:] + make_names(100, rnd)
+    index.sync(names)
+    assert len(index) == len(set(names))
+    for query in queries:
+        assert index.nearest(query, 3) == fuzzy.best_match(query, names, 3)
+
+
+def test_prefetch(tmp_path, monkeypatch, capsys):
+    """ In interactive mode, the fuzzy matches of the upcoming issues are computed in the
+    background while the user chooses, once per name. """
+
+    synth.generate(tmp_path, synth.SynthOptions(files=40, depth=1, per_dir=10, broken=0.5))
+    tree = Tree(str(tmp_path))
+    read_md_tree(tree, 1, None, 'scan')
+    found = analyze(tree)
+    assert len(found) > 5
+
+    looked_up = []
+    nearest = fuzzy.FuzzyIndex.nearest
+    monkeypatch.setattr(fuzzy.FuzzyIndex, 'nearest',
+                        lambda self, what, k: looked_up.append(what) or nearest(self, what, k))
+    prefetched = []
+    def input_(_):
+        prefetched.append(len(getattr(link_issues, '__fuzzy_matches')[tree][0]))
+        return ''
+    monkeypatch.setattr('builtins.input', input_)
+
+    fix_all(found + found, tree, Options(mode='-i', fuzzy=True))
+    assert len(looked_up) == len(set(looked_up))
+    assert prefetched and prefetched[0] > 1
+    assert "Did you mean" in capsys.readouterr().out
+
+
+def test_nearest_all():
+    """ The batch finds all the keys at the distance of the match of `nearest`. """
+
+    rnd = random.Random(2)
+    alphabet = 'abcd'
+    words = [[''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 9)))
+              for _ in range(300)] for _ in range(2)]
+    codes1, lengths1 = fuzzy.encode(words[0], -1)
+    codes2, lengths2 = fuzzy.encode(words[1], -2)
+    assert fuzzy.levenshtein_batch(codes1, lengths1, codes2, lengths2).tolist() == \
+        [fuzzy.levenshtein(a, b) for a, b in zip(*words)]
+
+    names = make_names(500, rnd) + ['Hello World.md', 'helloworld.md', 'ab']
+    index = fuzzy.FuzzyIndex(names)
+    queries = [misspell(rnd.choice(names), rnd) for _ in range(30)] + ['hello  world.md', 'a']
+    for k in (3, 4):
+        found = index.nearest_all(queries, k, batch=100)
+        for query in queries:
+            match, dist = index.nearest(query, k)
+            assert found[query] == (
+                [name for name in names if fuzzy.levenshtein(
+                    fuzzy.normalize(query), fuzzy.normalize(name)) == dist], dist)
+            assert found[query][0][:1] == ([match] if match else [])
+
+
+def test_automatic(tmp_path):
+    """ In automatic mode, names and anchors not found are fixed to their closest match,
+    only if it is the only one. """
+
+    tmp_path.joinpath('guide.md').write_text('# Installation\n## Usage\n')
+    tmp_path.joinpath('ab.md').write_text('')
+    tmp_path.joinpath('ac.md').write_text('')
+    tmp_path.joinpath('index.md').write_text(
+        '[1](gide.md) [2](guide.md#instalation) [3](ad.md) [4](/gude.md#usag)\n')
+    tree = Tree(str(tmp_path))
+    read_md_tree(tree, 1, None, 'scan')
+    fix_all(analyze(tree), tree, Options(mode='-a', fuzzy=True))
+    assert tmp_path.joinpath('index.md').read_text() == \
+        '[1](guide.md) [2](guide.md#installation) [3](ad.md) [4](/guide.md#usag)\n'
@@ -1,14 +1,19 @@
 """Linkcheck script tests."""
 
 
+import io
 import os
-import shutil
-import tempfile
+import json
+import pstats
 import pytest
 
 from .compare_dirs import are_dir_trees_equal
 
-from mdtools import linkcheck
+from mdtools import linkcheck, profiling
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze, iter_issues, report
+from mdtools.issues.fix.options import Options
 
 
 abspath = os.path.abspath(__file__)
@@ -16,22 +21,16 @@ dname = os.path.dirname(abspath)
 os.chdir(dname)
 
 
-@pytest.fixture
-def copy_input_tree_to_tmp_dir():
-    tmp_dir = tempfile.TemporaryDirectory()
-    tree_path = os.path.join(tmp_dir.name, 'tree')
-    shutil.copytree('./tree', tree_path)
-    return [tmp_dir, tree_path]
-
-
-def test_automatic_fix(copy_input_tree_to_tmp_dir, monkeypatch, capfd):
+@pytest.mark.parametrize("extra_args", [[], ["-j", "2"]])
+def test_automatic_fix(tmp_tree, tmp_path, monkeypatch, capfd, extra_args):
     """ Test the automatic mode of the linkcheck script by running it against a
     pre-built test tree, and comparing the output to the desired output.
+    The output must not depend on whether the files are parsed in parallel.
     """
 
-    tmp_dir = copy_input_tree_to_tmp_dir[0]
-    tree_path = copy_input_tree_to_tmp_dir[1]
-    monkeypatch.setattr("sys.argv", ["pytest", "-a", tree_path])
+    tree_path = tmp_tree
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / 'cache'))
+    monkeypatch.setattr("sys.argv", ["pytest", "-a", *extra_args, tree_path])
 
     # Invole the script
     linkcheck.main()
@@ -42,7 +41,6 @@ def test_automatic_fix(copy_input_tree_to_tmp_dir, monkeypatch, capfd):
 
     # Verify the resulting tree
     assert are_dir_trees_equal(tree_path, './tree_out')
-    tmp_dir.cleanup()
 
     # Verify script output
     with open('out/test_automatic.txt') as f:
@@ -51,3 +49,109 @@ def test_automatic_fix(copy_input_tree_to_tmp_dir, monkeypatch, capfd):
     out = out.replace('\\', '/')
     out_desired = out_desired.replace('\\', '/')
     assert out_desired == out
+
+
+def test_profile(tmp_tree, tmp_path, monkeypatch):
+    """ The profile covers the phases of the run, and is written as JSON; the cProfile
+    statistics are written too.
+    """
+
+    tree_path = tmp_tree
+    report = str(tmp_path / 'profile.json')
+    stats = str(tmp_path / 'out.prof')
+    monkeypatch.setattr(profiling, 'current', None)
+    monkeypatch.setattr("sys.argv", ["pytest", "-a", "--no-cache", "--slowest=2",
+                                     "--profile-json=" + report, "--cprofile=" + stats,
+                                     tree_path])
+    linkcheck.main()
+
+    with open(report) as f:
+        profile = json.load(f)
+    assert list(profile['phases']) == ['walk', 'cache', 'read', 'parse', 'model', 'analyze',
+                                       'patch']
+    assert profile['phases']['parse']['calls'] == profile['counts']['markdown files']
+    assert profile['counts']['issues'] > 0 and profile['counts']['links'] > 0
+    assert len(profile['slowest']) == 2
+    assert pstats.Stats(stats).total_calls > 0
+
+
+class FlushCounter(io.StringIO):
+    """A stream counting the lines written before each flush."""
+
+    def __init__(self):
+        super().__init__()
+        self.flushed = []
+
+    def flush(self):
+        self.flushed.append(self.getvalue().count('\n'))
+
+
+def test_jsonl():
+    """ Issues are written one per line, and flushed one by one, with suggested fixes. """
+
+    tree = Tree('./tree')
+    read_md_tree(tree, 1, None, 'scan')
+    out = FlushCounter()
+    writer = report.writers['jsonl'](out, tree.base)
+    found = linkcheck.write_issues(iter_issues(tree), tree, writer, Options())
+    writer.close()
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(records) == len(found) == len(analyze(tree)) > 0
+    assert out.flushed[:len(records)] == list(range(1, len(records) + 1))
+    for rec, issue in zip(records, found):
+        assert rec['path'] == str(issue.path)
+        assert rec['dest'] == issue.link.get_dest()
+        assert (rec['line'], rec['column']) == (issue.link.span.line, issue.link.span.column)
+    assert {rec['type'] for rec in records} == {'target-not-found', 'anchor-not-found'}
+    assert any(rec['suggestions'] for rec in records)
+
+
+def test_sarif(monkeypatch, capsys):
+    """ The SARIF log is valid JSON, with a result for each issue; nothing else is written
+    to the standard output.
+    """
+
+    monkeypatch.setattr("sys.argv", ["pytest", "--no-cache", "--format=sarif", "-f", "./tree"])
+    linkcheck.main()
+    out, _ = capsys.readouterr()
+
+    log = json.loads(out)
+    run = log['runs'][0]
+    tree = Tree('./tree')
+    read_md_tree(tree, 1, None, 'scan')
+    assert len(run['results']) == len(analyze(tree))
+    rules = {rule['id'] for rule in run['tool']['driver']['rules']}
+    for result in run['results']:
+        assert result['ruleId'] in rules
+        location = result['locations'][0]['physicalLocation']
+        assert (tree.base / location['artifactLocation']['uri'].replace('%20', ' ')).exists()
+        assert location['region']['startLine'] > 0
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--stream", "-j", "2"]])
+def test_several_roots(monkeypatch, capsys, extra_args):
+    """ Several trees are checked in one run, each relative to its own root, in a section
+    of the report per tree.
+    """
+
+    roots = ['./tree', './tree/purus']
+    monkeypatch.setattr("sys.argv", ["pytest", "--no-cache", "--format=jsonl", *extra_args,
+                                     *roots])
+    linkcheck.main()
+    out, _ = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+
+    for root in roots:
+        tree = Tree(root)
+        read_md_tree(tree, 1, None, 'scan')
+        found = [(str(i.path), i.link.get_dest()) for i in analyze(tree)]
+        assert sorted(found) == sorted((rec['path'], rec['dest']) for rec in records
+                                       if rec['root'] == str(tree.base))
+
+    monkeypatch.setattr("sys.argv", ["pytest", "--no-cache", "--format=sarif", *roots])
+    linkcheck.main()
+    out, _ = capsys.readouterr()
+    runs = json.loads(out)['runs']
+    assert [len(run['results']) for run in runs] == [
+        sum(rec['root'] == str(Tree(root).base) for rec in records) for root in roots]
@@ -0,0 +1,80 @@
+"""Move command tests."""
+
+
+import pytest
+
+from mdtools import mv
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze
+
+
+FILES = {
+    'index.md':         '[g](guide/intro.md#start) [a](/guide/api.md) [d](guide/) [o](old.md)\n',
+    'old.md':           '# Old\n[i](index.md) [self](old.md#old) [g](guide/intro.md)\n',
+    'guide/intro.md':   '# Start\n[api](api.md) [up](../index.md) [o](/old.md#old)\n',
+    'guide/api.md':     '[x](missing.md)\n',
+}
+
+
+@pytest.fixture
+def base(tmp_path):
+    for name, text in FILES.items():
+        tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(name).write_text(text)
+    return tmp_path
+
+
+def read(base):
+    tree = Tree(str(base))
+    read_md_tree(tree, 1, None, 'scan')
+    return tree
+
+
+def test_move(base):
+    """ Links to the moved files and directories, and relative links in them, are
+    rewritten in their own style; other links are left as they are.
+    """
+
+    before = len(analyze(read(base)))
+    base.joinpath('docs').mkdir()
+    moves = [(base / 'guide', base / 'docs' / 'manual'), (base / 'old.md', base / 'docs')]
+    assert mv.move_all(read(base), moves)
+
+    assert not base.joinpath('guide').exists()
+    assert base.joinpath('index.md').read_text() == \
+        '[g](docs/manual/intro.md#start) [a](/docs/manual/api.md) [d](docs/manual/) ' \
+        '[o](docs/old.md)\n'
+    assert base.joinpath('docs', 'old.md').read_text() == \
+        '# Old\n[i](../index.md) [self](old.md#old) [g](manual/intro.md)\n'
+    assert base.joinpath('docs', 'manual', 'intro.md').read_text() == \
+        '# Start\n[api](api.md) [up](../../index.md) [o](/docs/old.md#old)\n'
+    assert len(analyze(read(base))) == before == 1
+
+
+def test_move_reference_links(base):
+    """ The definitions of reference links are rewritten once, and the links are kept. """
+
+    base.joinpath('refs.md').write_text(
+        '[r][ref] and [again][ref] [R]\n\n[ref]: old.md#old\n[r]: <guide/api.md> "API"\n')
+    assert mv.move_all(read(base), [(base / 'old.md', base / 'guide' / 'old.md'),
+                                    (base / 'guide' / 'api.md', base / 'api.md')])
+    assert base.joinpath('refs.md').read_text() == \
+        '[r][ref] and [again][ref] [R]\n\n[ref]: guide/old.md#old\n[r]: api.md "API"\n'
+    tree = read(base)
+    assert [link.get_dest() for link in tree.files[base / 'refs.md'].links] == \
+        ['guide/old.md#old', 'guide/old.md#old', 'api.md']
+
+
+def test_invalid_moves(base):
+    """ Nothing is changed if a move cannot be made; a dry run changes nothing. """
+
+    tree = read(base)
+    for moves in ([(base / 'nope.md', base / 'x.md')],
+                  [(base / 'old.md', base / 'index.md')],
+                  [(base / 'guide', base / 'guide' / 'sub')],
+                  [(base / 'guide', base / 'a'), (base / 'guide' / 'api.md', base / 'b.md')]):
+        with pytest.raises(mv.MoveError):
+            mv.move_all(tree, moves)
+    assert mv.move_all(tree, [(base / 'old.md', base / 'new.md')], dry_run=True)
+    assert all(base.joinpath(name).read_text() == text for name, text in FILES.items())
@@ -0,0 +1,158 @@
+"""File patching tests."""
+
+
+import os
+import stat
+from pathlib import Path
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues.fix.patch import Patch, Patches
+
+
+DOCUMENT = (
+    "# Title  \r\n"
+    "\r\n"
+    "Some\ttext, *kept*   as is: [a](old.md \"t\") and ![i](<old image.png>).\r\n"
+    "> * [ref][r] and [r]\r\n"
+    "\r\n"
+    "[r]: old.md\r\n"
+)
+
+
+def read(tmp_path: Path, engine: str = 'scan'):
+    tree = Tree(str(tmp_path))
+    read_md_tree(tree, 1, None, engine)
+    return tree, tmp_path.resolve().joinpath('doc.md')
+
+
+def patch_all(tree, path, dests):
+    patches = Patches(tree)
+    for link, dest in zip(tree.files[path].links, dests):
+        if dest != link.get_dest():
+            patches.add(Patch(path, lambda link=link, dest=dest: link.set_dest(dest), link))
+    patches.apply()
+
+
+def test_patch_splices(tmp_path):
+    """ Only the changed destinations are replaced; all other bytes (including the line
+    endings) are left untouched.
+    """
+
+    tmp_path.joinpath('doc.md').write_bytes(DOCUMENT.encode('utf-8'))
+    tree, path = read(tmp_path)
+    assert [l.get_dest() for l in tree.files[path].links] == \
+        ['old.md', 'old image.png', 'old.md', 'old.md']
+    assert [(l.span.line, l.span.column) for l in tree.files[path].links] == \
+        [(3, 28), (3, 48), (4, 5), (4, 18)]
+
+    patch_all(tree, path, ['new.md', 'new image.png', 'old.md', 'x.md'])
+
+    assert path.read_bytes().decode('utf-8') == DOCUMENT \
+        .replace("[a](old.md", "[a](new.md") \
+        .replace("<old image.png>", "<new image.png>") \
+        .replace("and [r]", "and [r](x.md)")
+
+    # The patched file reads back the same as the model
+    links = tree.files[path].links
+    tree2, _ = read(tmp_path)
+    assert [(l.get_dest(), l.span) for l in tree2.files[path].links] == \
+        [(l.get_dest(), l.span) for l in links]
+
+
+def test_patch_changed_file(tmp_path, capfd):
+    """ A file changed since it was read is not patched. """
+
+    tmp_path.joinpath('doc.md').write_text("[a](b.md)\n")
+    tree, path = read(tmp_path)
+    path.write_text("[c](d.md) [a](b.md)\n")
+
+    patch_all(tree, path, ['x.md'])
+
+    assert path.read_text() == "[c](d.md) [a](b.md)\n"
+    out, _ = capfd.readouterr()
+    assert "Not patched" in out
+
+
+def test_patch_render(tmp_path):
+    """ Files read without link locations (by the marko engine) are patched by rendering
+    the whole document again.
+    """
+
+    tmp_path.joinpath('doc.md').write_text("[a](b.md)\n")
+    tree, path = read(tmp_path, 'marko')
+    assert tree.files[path].links[0].span is None
+
+    patch_all(tree, path, ['c.md'])
+
+    assert "[a](c.md)" in path.read_text()
+
+
+def read_two(tmp_path):
+    tmp_path.joinpath('a.md').write_text("[x](old.md)\n")
+    tmp_path.joinpath('b.md').write_text("[y](old.md)\n")
+    tree = Tree(str(tmp_path))
+    read_md_tree(tree, 1, None, 'scan')
+    paths = [tmp_path.resolve().joinpath(name) for name in ('a.md', 'b.md')]
+    return tree, paths
+
+
+def add_patches(patches, tree, paths):
+    for path in paths:
+        link = tree.files[path].links[0]
+        patches.add(Patch(path, lambda link=link: link.set_dest('new.md'), link))
+
+
+def test_patch_dry_run(tmp_path, capfd):
+    """ The dry-run mode prints diffs, and changes neither the files nor the model. """
+
+    tree, paths = read_two(tmp_path)
+    patches = Patches(tree, dry_run=True)
+    add_patches(patches, tree, paths)
+    assert patches.apply()
+
+    out, _ = capfd.readouterr()
+    assert "--- a/a.md\n+++ b/a.md\n@@ -1 +1 @@\n-[x](old.md)\n+[x](new.md)\n" in out
+    assert "--- a/b.md" in out
+    for path in paths:
+        assert "(old.md)" in path.read_text()
+        assert tree.files[path].links[0].get_dest() == 'old.md'
+    assert len(tree.links_to(tmp_path.resolve().joinpath('old.md'))) == 2
+
+
+def test_patch_all_or_nothing(tmp_path, monkeypatch):
+    """ In the all-or-nothing mode, a failure to write one file leaves all files (and the
+    model) as they were, and no temporary files behind.
+    """
+
+    tree, paths = read_two(tmp_path)
+    patches = Patches(tree, all_or_nothing=True)
+    add_patches(patches, tree, paths)
+
+    replace = os.replace
+    def failing_replace(src, dst):
+        if str(dst).endswith('b.md'):
+            raise OSError("disk full")
+        replace(src, dst)
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    assert not patches.apply()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.md', 'b.md']
+    for path in paths:
+        assert "(old.md)" in path.read_text()
+        assert tree.files[path].links[0].get_dest() == 'old.md'
+
+
+def test_patch_atomic(tmp_path):
+    """ Files are replaced as a whole, keeping their permissions. """
+
+    tree, paths = read_two(tmp_path)
+    os.chmod(paths[0], 0o640)
+    patches = Patches(tree)
+    add_patches(patches, tree, paths)
+    assert patches.apply()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.md', 'b.md']
+    assert stat.S_IMODE(os.stat(paths[0]).st_mode) == 0o640
+    for path in paths:
+        assert path.read_text() == "[{}](new.md)\n".format('x' if path.name == 'a.md' else 'y')
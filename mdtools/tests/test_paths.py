@@ -0,0 +1,67 @@
+"""Compact model tests."""
+
+
+import os
+from pathlib import Path
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+
+def test_paths_interned():
+    """ Each path is stored once: the files, the indexes and the resolved link targets all
+    refer to the same Path objects.
+    """
+
+    tree = Tree(os.path.join(dname, 'tree'))
+    read_md_tree(tree, 1, None, 'scan')
+    assert len(tree.files) > 1
+
+    for path, file in tree.files.items():
+        assert file.path is path
+        assert tree.paths[tree.paths.get(path)] is path
+        for found in tree.names[path.name]:
+            assert found is path or found != path
+        for link in file.links:
+            if link.is_local():
+                target = tree.resolve(path, link.get_href())
+                if target in tree.files:
+                    assert tree.files[target].path is target
+        for name in file.anchors:
+            assert path in tree.anchors[name]
+            assert path in tree.all_anchors[name]
+
+    for target, links in tree.backlinks.items():
+        assert tree.paths[tree.paths.get(target)] is target
+        for path, _ in links:
+            assert tree.files[path].path is path
+
+
+def test_path_index(tmp_path):
+    """ The indexes behave as dictionaries of lists of Paths, and are kept current when files
+    are removed.
+    """
+
+    tmp_path.joinpath('a.md').write_text("<a name='x'></a>\n# Title\n")
+    tmp_path.joinpath('sub').mkdir()
+    tmp_path.joinpath('sub', 'a.md').write_text("<a name='x'></a>\n")
+    tree = Tree(str(tmp_path))
+    read_md_tree(tree, 1, None, 'scan')
+    a, sub_a = tmp_path.resolve().joinpath('a.md'), tmp_path.resolve().joinpath('sub', 'a.md')
+
+    assert tree.names['a.md'] == [a, sub_a]
+    assert dict(tree.anchors) == {'x': [a, sub_a]}
+    assert dict(tree.h_anchors) == {'title': [a]}
+    assert sorted(tree.all_anchors) == ['title', 'x']
+    assert 'b.md' not in tree.names and tree.names.get('b.md') is None
+
+    tree.remove_file(a)
+    tree.update_all_anchors(['x', 'title'])
+    assert tree.names['a.md'] == [sub_a]
+    assert dict(tree.anchors) == {'x': [sub_a]}
+    assert dict(tree.all_anchors) == {'x': [sub_a]}
+    assert isinstance(tree.names['sub'][0], Path)
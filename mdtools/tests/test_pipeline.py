@@ -0,0 +1,47 @@
+"""Streaming pipeline tests."""
+
+
+import os
+import pytest
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues import analyze, issues
+from mdtools.pipeline import Pipeline, descends
+from mdtools.bench import synth
+
+
+dname = os.path.dirname(os.path.abspath(__file__))
+
+
+def keys(found):
+    return sorted((type(i).__name__, str(i.path), i.link.get_dest(),
+                   i.link.span.line if i.link.span else 0) for i in found)
+
+
+def test_descends():
+    assert descends('a/b.md') and descends('../../a/b.md') and descends('/a/./b.md')
+    assert not descends('a/../b.md') and not descends('/a/b/../../c')
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_same_issues(tmp_path, jobs):
+    """ The pipeline finds the same issues as reading the tree and analyzing it, including
+    links to files and anchors further down the walk. """
+
+    counts = synth.generate(tmp_path, synth.SynthOptions(files=200, depth=2, per_dir=15,
+                                                          broken=0.3))
+    for base in (os.path.join(dname, 'tree'), str(tmp_path)):
+        tree = Tree(base)
+        read_md_tree(tree, 1, None, 'scan')
+        expected = analyze(tree)
+
+        streamed = Tree(base)
+        pipeline = Pipeline(streamed, jobs, None, 'scan', buffer=3)
+        found = list(pipeline.run())
+        assert keys(found) == keys(expected)
+        assert pipeline.links == sum(len(f.links) for f in tree.files.values())
+        assert all(not f.links for f in streamed.files.values())
+        assert list(streamed.all_anchors) == list(tree.all_anchors)
+
+    assert sum(isinstance(i, issues.AnchorNotFound) for i in found) == counts['broken_anchor']
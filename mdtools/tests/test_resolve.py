@@ -0,0 +1,64 @@
+"""Href resolution tests."""
+
+
+import os
+from pathlib import Path
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.issues.fix import href
+
+
+HREFS = ['', 'a.md', './a.md', 'sub/b.md', 'sub/../a.md', '../x.md', '/a.md', '/sub/b.md',
+         'sub//b.md', 'sub/', 'sub/.', '..', '../../..', 'link/c.md', 'link/../a.md',
+         'link/../../a.md', 'alias.md', '/link/c.md', 'missing/../sub/b.md']
+
+
+def make_tree(tmp_path: Path) -> Path:
+    base = tmp_path.joinpath('base')
+    base.joinpath('sub', 'deep').mkdir(parents=True)
+    tmp_path.joinpath('outside', 'dir').mkdir(parents=True)
+    for name in ('a.md', 'sub/b.md', 'sub/deep/d.md', '../outside/dir/c.md'):
+        base.joinpath(name).write_text("[a](a.md)\n")
+    os.symlink(str(tmp_path.joinpath('outside', 'dir')), str(base.joinpath('link')))
+    os.symlink(str(base.joinpath('sub', 'b.md')), str(base.joinpath('alias.md')))
+    return base
+
+
+def test_resolve_like_file_system(tmp_path):
+    """ Hrefs resolve to the same paths as with `Path.resolve`, including through symbolic
+    links, without accessing the file system.
+    """
+
+    base = make_tree(tmp_path)
+    tree = Tree(str(base))
+    read_md_tree(tree)
+    assert tree.aliases
+
+    for found_in in (base.joinpath('a.md'), base.joinpath('sub', 'deep', 'd.md')):
+        for href_ in HREFS:
+            if not href_:
+                expected = found_in
+            elif href_.startswith('/'):
+                expected = base.joinpath(href_[1:]).resolve()
+            else:
+                expected = found_in.parent.joinpath(href_).resolve()
+            assert tree.resolve(found_in, href_) == expected, href_
+            # Memoized
+            assert tree.resolve(found_in, href_) is tree.resolve(found_in, href_)
+
+
+def test_relative_href(tmp_path):
+    """ Relative hrefs go up as many directories as needed, and resolve back to the target. """
+
+    base = make_tree(tmp_path)
+    tree = Tree(str(base))
+    read_md_tree(tree)
+
+    paths = list(tree.files)
+    for found_in in paths:
+        for target in paths:
+            rel = href.path_to_href_rel(target, found_in)
+            assert tree.resolve(found_in, rel) == target, (found_in, target, rel)
+    assert href.path_to_href_rel(base.joinpath('a.md'), base.joinpath('sub', 'deep', 'd.md')) \
+        == '../../a.md'
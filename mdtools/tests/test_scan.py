@@ -0,0 +1,152 @@
+"""Tests of the scanner-based extraction, against the marko-based one."""
+
+
+import random
+import time
+import traceback
+from pathlib import Path
+import pytest
+
+from mdtools.model.link import Link
+from mdtools.model.parse import parse_markdown
+from mdtools.model.scan import SCAN_LIMIT, scan_markdown
+
+
+# Pieces of markdown the synthetic documents are made of: the constructs the scanner must
+# get right, and the characters which make them interact.
+PIECES = [
+    "[a](b.md)", "[x y](<c d.md>)", "![img](i.png)", "[l](m \"title\")", "[l]( m )",
+    "[l](m(n))", "[l](m\n\"ti\ntle\")", "[a [b](c)](d)", "[![i](j)](k)", "[b](</x>)",
+    "[c](d.md#e)", "[e](#f g)", "[ref]", "[ref][]", "[t][ref]", "\n[ref]: r.md\n",
+    "\n[Ref]: <s p.md> \"t\"\n", "[a]: <b c>\n", "[A]:\n/u\n", "[^1]",
+    "*", "**", "_", "__", "***x***", "_a_b_", "**a*", "`", "``", "# `c`\n",
+    "<http://x.y>", "<a name=\"x\">", "<a id='y'></a>", "<a name=x>", "<a id=\"q\"/>",
+    "<a href=\"z\">", "<span>", "</a>", "<!-- c -->", "<!--\n", "-->\n", "x<br/>y",
+    "<div>\n", "</div>\n", "<details>\n", "<script>\n", "</script>", "<pre>\n", "</pre>\n",
+    "```\n", "~~~\n", "    code\n", "\t",
+    "# ", "## H ##", "#", "#\n", "# [a](b)\n", "# \\[x\n", "---\n", "===\n", "a\n---\n",
+    "* * *", "|a|b|\n|-|-|\n",
+    "> ", "> > ", "   > ", "- ", "  - ", "\t- ", "+ ", "1. ", "2) ", "10. ", "-",
+    "\\[", "\\*", "\\#", "](", ")", "(", "[", "]", "![", "\"t\"", "&amp;",
+    "text", "foo bar", " ", "   ", "    ", "\n", "\n\n",
+]
+
+
+def extract_or_none(function, text):
+    """The extracted data, or None if the file could not be parsed."""
+    try:
+        return function(text)
+    except Exception:   # pylint: disable=broad-except
+        return None
+
+
+def marko_extract(text):
+    """The data extracted by the marko-based engine."""
+    return parse_markdown(text)[2]
+
+
+def marko_extract_or_none(text):
+    """The data extracted by the marko-based engine, or None if it fails. Raises the
+    IndexError marko fails with on an inline link cut off after its '(' at the end of a
+    paragraph, where the scanner does not fail.
+    """
+    try:
+        return marko_extract(text)
+    except IndexError as error:
+        if traceback.extract_tb(error.__traceback__)[-1].name == '_expect_inline_link':
+            raise
+        return None
+    except Exception:   # pylint: disable=broad-except
+        return None
+
+
+def test_scan_test_trees():
+    """ The scanner extracts the same data as marko from the test trees. """
+
+    base = Path(__file__).parent
+    paths = sorted(base.glob('tree/**/*.md')) + sorted(base.glob('etc/**/*.md'))
+    assert paths
+    for path in paths:
+        text = path.read_text(encoding='utf-8')
+        assert scan_markdown(text) == marko_extract(text), path
+
+
+def test_scan_synthetic():
+    """ The scanner extracts the same data as marko from random combinations of tricky
+    markdown constructs (and fails on the same inputs).
+    """
+
+    rnd = random.Random(0)
+    for _ in range(3000):
+        text = "".join(rnd.choice(PIECES) for _ in range(rnd.randint(1, 25)))
+        scanned = extract_or_none(scan_markdown, text)
+        try:
+            assert scanned == marko_extract_or_none(text), repr(text)
+        except IndexError:
+            assert scanned is not None, repr(text)
+
+
+def test_scan_unterminated_inline_link():
+    """ A paragraph ending in an inline link cut off after its '(' has no inline link (marko
+    fails on it); the link text can still be a reference link.
+    """
+
+    with pytest.raises(IndexError):
+        marko_extract_or_none("[a](")
+    assert scan_markdown("[a](").links == []
+    assert scan_markdown("x [a](\n\n[a]: b.md\n").links == ["b.md"]
+    assert scan_markdown("[a]( \n").links == []
+
+
+def test_scan_long_links():
+    """ Link texts and destinations too long to be scanned, matched with the indexes of the
+    brackets and parentheses instead, are found as marko finds them.
+    """
+
+    long = ["x" * SCAN_LIMIT, "y " * SCAN_LIMIT, "\\" + "z" * SCAN_LIMIT]
+    pieces = PIECES + long + ["[" + p for p in long] + [p + "]" for p in long] \
+        + ["(" + p for p in long] + [p + ")" for p in long] + ["\\(", "\\)", "\\]"]
+    rnd = random.Random(2)
+    for _ in range(1000):
+        text = "".join(rnd.choice(pieces) for _ in range(rnd.randint(1, 25)))
+        scanned = extract_or_none(scan_markdown, text)
+        try:
+            assert scanned == marko_extract_or_none(text), repr(text)
+        except IndexError:
+            assert scanned is not None, repr(text)
+
+
+def test_scan_nested_brackets():
+    """ Deeply nested or unpaired brackets are scanned in linear time. """
+
+    for n in (2000, 8000):
+        start = time.perf_counter()
+        scan_markdown("[" * n + "a" + "]" * n)
+        scan_markdown("[ " * n + "*a " * n + "]" * n)
+        scan_markdown("[ " * n + "[a](b)" * n)
+        if n == 2000:
+            small = time.perf_counter() - start
+    assert time.perf_counter() - start < 10 * small + 1
+
+
+def test_scan_spans():
+    """ Replacing the span of a link in random documents changes the destination of that
+    link, and nothing else.
+    """
+
+    rnd = random.Random(1)
+    for _ in range(1000):
+        text = "".join(rnd.choice(PIECES) for _ in range(rnd.randint(1, 25)))
+        extract = extract_or_none(scan_markdown, text)
+        if not extract or not extract.links:
+            continue
+        i = rnd.randrange(len(extract.links))
+        span = extract.spans[i]
+        line = text.split("\n")[span.line - 1]
+        assert line[span.column - 1] in "[!"
+        dest = rnd.choice(["new.md", "a b.md", "x(y).md", "#z"])
+        new = Link.format_dest(dest)
+        if span.reference:
+            new = "(" + new + ")"
+        links = scan_markdown(text[:span.start] + new + text[span.end:]).links
+        assert links == extract.links[:i] + [dest] + extract.links[i + 1:], repr(text)
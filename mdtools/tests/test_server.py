@@ -0,0 +1,100 @@
+"""Server mode tests."""
+
+
+import pytest
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.model.walk import Walker
+from mdtools.server import Server, Client, RequestError
+
+
+@pytest.fixture
+def base(tmp_path):
+    tmp_path.joinpath('docs').mkdir()
+    tmp_path.joinpath('docs', 'guide.md').write_text('# Install\n## Usage\n')
+    tmp_path.joinpath('docs', 'api.md').write_text('# API\n')
+    tmp_path.joinpath('a.md').write_text('[1](docs/guide.md#usage)\n[2](docs/gide.md)\n')
+    return tmp_path
+
+
+def test_requests(base):
+    """ Diagnostics follow the edited text of a file, with suggestions; links can be
+    suggested fixes, and destinations completed.
+    """
+
+    tree = Tree(str(base))
+    read_md_tree(tree, 1, None, 'scan')
+    server = Server(tree)
+    call = lambda method, **params: server.handle(
+        {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})['result']
+
+    found = call('diagnostics', path='a.md')
+    assert [(rec['type'], rec['dest'], rec['line']) for rec in found] == \
+        [('target-not-found', 'docs/gide.md', 2)]
+    found = call('diagnostics', path='a.md', text='[1](docs/guide.md#usge)\n')
+    assert [(rec['dest'], rec['suggestions']) for rec in found] == \
+        [('docs/guide.md#usge', [])]
+    server.fuzzy = True
+    assert call('suggest', path='a.md', line=1) == ['docs/guide.md#usage']
+
+    assert call('complete', path='a.md', prefix='do') == ['docs/']
+    assert call('complete', path='a.md', prefix='docs/') == ['docs/api.md', 'docs/guide.md']
+    assert call('complete', path='docs/api.md', prefix='/docs/g') == ['/docs/guide.md']
+    assert call('complete', path='a.md', prefix='docs/guide.md#') == \
+        ['docs/guide.md#install', 'docs/guide.md#usage']
+
+    base.joinpath('docs', 'guide.md').write_text('# Install\n')
+    found = call('changed', paths=['docs/guide.md'])
+    assert [rec['dest'] for rec in found] == ['docs/guide.md#usge']
+
+    error = server.handle({'jsonrpc': '2.0', 'id': 2, 'method': 'nope'})['error']
+    assert error['code'] == -32601
+    assert server.handle({'jsonrpc': '2.0', 'method': 'diagnostics',
+                          'params': {'path': 'a.md'}}) is None
+
+
+def test_invalid_requests(base, monkeypatch):
+    """ Invalid params, and paths outside or excluded from the tree, are rejected; errors of
+    the server are answered, and it goes on.
+    """
+
+    base.joinpath('drafts').mkdir()
+    base.joinpath('drafts', 'b.md').write_text('[x](nope.md)\n')
+    tree = Tree(str(base))
+    walker = Walker(['drafts'])
+    read_md_tree(tree, 1, None, 'scan', walker)
+    server = Server(tree, walker)
+    error = lambda method, **params: server.handle(
+        {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})['error']['code']
+
+    assert error('diagnostics', path=1) == -32602
+    assert error('diagnostics') == -32602
+    assert error('diagnostics', path='a.md', extra=1) == -32602
+    assert error('suggest', path='a.md', line=True) == -32602
+    assert error('changed', paths='a.md') == -32602
+    assert error('changed', paths=[1]) == -32602
+    assert error('diagnostics', path='../outside.md', text='[x](y.md)\n') == -32602
+    assert error('diagnostics', path='drafts/b.md', text='[x](y.md)\n') == -32602
+    assert error('changed', paths=['drafts/b.md']) == -32602
+    assert not any(p.name in ('outside.md', 'b.md') for p in tree.files)
+
+    def fail(*_):
+        raise KeyError('boom')
+    monkeypatch.setattr(server, '_Server__dir_children', fail)
+    assert error('complete', path='a.md', prefix='do') == -32603
+    assert server.handle({'jsonrpc': '2.0', 'id': 2, 'method': 'diagnostics',
+                          'params': {'path': 'a.md'}})['result']
+
+
+def test_client(base):
+    """ A server started by the client answers over the standard input and output. """
+
+    client = Client.spawn(['--no-cache', str(base)])
+    try:
+        found = client.request('diagnostics', path=str(base.joinpath('a.md')))
+        assert [rec['dest'] for rec in found] == ['docs/gide.md']
+        with pytest.raises(RequestError):
+            client.request('diagnostics', path='missing.md')
+    finally:
+        client.close()
@@ -0,0 +1,88 @@
+"""Tree walker tests."""
+
+
+import os
+import pytest
+
+from mdtools.model import read_md_tree
+from mdtools.model.tree import Tree
+from mdtools.model.walk import Walker, Ignore, iter_walk
+from mdtools.watch import Watcher
+
+
+FILES = ['top.md', 'a/top.md', 'a/deep.md', 'a/b/deep.md', 'x.tmp.md', 'keep.tmp.md',
+         'build/b.md', 'docs/drafts/d.md', 'drafts/d.md', 'node_modules/m/m.md', '.git/g.md']
+
+
+@pytest.fixture
+def base(tmp_path):
+    for name in FILES:
+        tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(name).write_text('[x](/top.md)\n')
+    tmp_path.joinpath('.gitignore').write_text(
+        '# build outputs\nbuild/\n*.tmp.md\n!keep.tmp.md\n/top.md\na/**/deep.md\n')
+    tmp_path.joinpath('docs', '.mdignore').write_text('drafts/\n')
+    return tmp_path
+
+
+def walked(base, walker):
+    tree = Tree(str(base))
+    md_paths = [p for _, paths in iter_walk(tree, walker) for p in paths]
+    return tree, sorted(str(p.relative_to(tree.base)) for p in md_paths)
+
+
+def test_ignore():
+    """ The last matching pattern decides; directory patterns only match directories. """
+    ignore = Ignore(['/b', 'c/'])
+    ignore.add(['*.md', '!keep.md', 'd/**/e'], 'sub/')
+    assert ignore.excluded('sub/x/a.md', False) and not ignore.excluded('a.md', False)
+    assert not ignore.excluded('sub/keep.md', False)
+    assert ignore.excluded('sub/d/e', False) and ignore.excluded('sub/d/x/y/e', False)
+    assert ignore.excluded('b', True) and not ignore.excluded('x/b', True)
+    assert ignore.excluded('x/c', True) and not ignore.excluded('x/c', False)
+    # A trailing "/**" matches what is inside the directory, not the directory itself
+    ignore = Ignore(['foo/**'])
+    assert not ignore.excluded('foo', True)
+    assert ignore.excluded('foo/a.md', False) and ignore.excluded('foo/x', True)
+
+
+def test_exclusions(base):
+    """ .gitignore, .mdignore and explicit patterns exclude paths, and .git is never walked. """
+
+    tree, md_paths = walked(base, Walker(['node_modules/']))
+    assert md_paths == ['a/top.md', 'drafts/d.md', 'keep.tmp.md']
+    assert base.resolve().joinpath('build') not in tree.files
+
+    _, md_paths = walked(base, Walker(['node_modules/', '!build/'], ignore_files=False))
+    assert len(md_paths) == len(FILES) - 2
+
+
+def test_same_walk_in_threads(base):
+    """ Prefetching the listings in threads does not change the walk. """
+    one, md_one = walked(base, Walker())
+    two, md_two = walked(base, Walker(threads=3))
+    assert md_one == md_two and list(one.files) == list(two.files)
+
+
+def test_symlink_loop(base):
+    """ Symbolic links to directories are only followed on demand, and loops end. """
+
+    os.symlink('..', str(base.joinpath('a', 'up')))
+    os.symlink(str(base.joinpath('drafts')), str(base.joinpath('a', 'drafts')))
+    _, md_paths = walked(base, Walker(['a/b/']))
+    _, followed = walked(base, Walker(['a/b/'], follow_links=True))
+    assert followed == md_paths
+
+
+def test_watch_excluded(base):
+    """ Changes to excluded paths are ignored in watch mode. """
+
+    walker = Walker()
+    tree = Tree(str(base))
+    read_md_tree(tree, 1, None, 'scan', walker)
+    base.joinpath('build', 'new.md').write_text('[x](nowhere.md)\n')
+    base.joinpath('new.md').write_text('[x](nowhere.md)\n')
+    found = Watcher(tree, None, walker).update(
+        {base.joinpath('build', 'new.md'), base.joinpath('new.md')})
+    assert [issue.path.name for issue in found] == ['new.md']
+    assert base.resolve().joinpath('build', 'new.md') not in tree.files
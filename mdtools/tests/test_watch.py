@@ -0,0 +1,146 @@
+"""Watch mode tests."""
+
+
+import functools
+import os
+import shutil
+import pytest
+
+from mdtools.issues import analyze, issues
+from mdtools.model.walk import Walker
+from mdtools.watch import Watcher, PollMonitor, InotifyMonitor
+
+from .conftest import read_tree
+
+
+def summary(found):
+    return sorted((str(i.path), i.link.get_dest(), type(i).__name__) for i in found)
+
+
+def full_run(tree_path):
+    tree = read_tree(tree_path)
+    return tree, analyze(tree)
+
+
+def test_incremental_update(tmp_tree):
+    """ After a change, the re-checked links are the affected ones, and their issues are
+    the same as the ones of a full run.
+    """
+
+    tree, _ = full_run(tmp_tree)
+    watcher = Watcher(tree)
+    duis = tree.base / 'purus' / 'bibendum' / 'interdum' / 'Duis'
+
+    # Creates the target of `Neque.md` in Nullam.md, and the anchor of `#lorem` in libero.md.
+    with open(duis / 'Neque.md', 'w') as f:
+        f.write('<a name="lorem"></a>\n')
+    with open(duis / 'libero.md', 'a') as f:
+        f.write('\n[New link](Neque.md#lorem)\n')
+    found = watcher.update({duis / 'Neque.md', duis / 'libero.md'})
+
+    _, full = full_run(tmp_tree)
+    checked = {(str(i.path), i.link.get_dest()) for i in found}
+    assert summary(found) == summary(
+        i for i in full if (str(i.path), i.link.get_dest()) in checked)
+    assert (str(duis / 'Nullam.md'), 'Neque.md') not in checked
+    assert (str(duis / 'libero.md'), '#lorem') in checked
+    assert not any(i.link.get_dest() == 'Neque.md#lorem' for i in found)
+
+    # A duplicate anchor in a changed file is reported, as in a full run.
+    with open(duis / 'libero.md', 'a') as f:
+        f.write('\n<a name="lorem"></a><a name="lorem"></a>\n')
+    found = watcher.update({duis / 'libero.md'})
+    assert [(i.path, i.anchor.name) for i in found if isinstance(i, issues.DuplicateAnchor)] \
+        == [(duis / 'libero.md', 'lorem')]
+
+    # Deleting the file breaks the links pointing at it.
+    os.remove(duis / 'Neque.md')
+    found = watcher.update({duis / 'Neque.md'})
+    assert ('TargetNotFound' in {type(i).__name__ for i in found}
+            and all(i.link.get_href() == 'Neque.md' for i in found))
+
+
+@pytest.mark.parametrize("monitor_class", [PollMonitor, InotifyMonitor])
+def test_monitor(tmp_tree, monitor_class):
+    """ The monitors report modified and created files. """
+
+    try:
+        monitor = monitor_class(tmp_tree) if monitor_class is InotifyMonitor \
+            else monitor_class(tmp_tree, interval=0.01)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    path = os.path.join(tmp_tree, 'root.md')
+    with open(path, 'a') as f:
+        f.write('\nchanged\n')
+    os.utime(path, ns=(0, 0))
+    os.mkdir(os.path.join(tmp_tree, 'new'))
+    assert {str(p) for p in monitor.wait(5)} >= {path, os.path.join(tmp_tree, 'new')}
+
+    with open(os.path.join(tmp_tree, 'new', 'new.md'), 'w') as f:
+        f.write('# New\n')
+    assert os.path.join(tmp_tree, 'new', 'new.md') in {str(p) for p in monitor.wait(5)}
+    monitor.close()
+
+
+@pytest.mark.parametrize("monitor_class", [PollMonitor, InotifyMonitor])
+def test_monitor_excluded(tmp_tree, monitor_class):
+    """ The directories the walker excluded, including new ones, are not watched. """
+
+    walker = Walker(['purus', 'node_modules'])
+    tree = read_tree(tmp_tree, walker=walker)
+    excluded = functools.partial(walker.excluded, tree)
+    try:
+        monitor = monitor_class(tree.base, excluded) if monitor_class is InotifyMonitor \
+            else monitor_class(tree.base, interval=0.01, excluded=excluded)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    os.mkdir(tree.base / 'node_modules')
+    assert monitor.wait(0.2) <= {tree.base / 'node_modules'}
+    for path in (tree.base / 'node_modules' / 'a.md', tree.base / 'purus' / 'a.md',
+                 tree.base / 'root.md'):
+        with open(path, 'a') as f:
+            f.write('\nchanged\n')
+    assert monitor.wait(5) == {tree.base / 'root.md'}
+    monitor.close()
+
+
+def test_directory_removed(tmp_tree):
+    """ Deleting or moving away a directory removes the files below it from the model, and
+    breaks the links into it; a change of the base scans the whole tree again. """
+
+    with open(os.path.join(tmp_tree, 'root.md'), 'a') as f:
+        f.write('\n[Into](purus/bibendum/interdum/Duis/Nullam.md)\n')
+    tree, _ = full_run(tmp_tree)
+    watcher = Watcher(tree)
+    bibendum = tree.base / 'purus' / 'bibendum'
+
+    shutil.rmtree(bibendum / 'interdum')
+    found = watcher.update({bibendum / 'interdum'})
+    assert not any(str(path).startswith(str(bibendum / 'interdum')) for path in tree.files)
+    assert summary(found) == [(str(tree.base / 'root.md'),
+                               'purus/bibendum/interdum/Duis/Nullam.md', 'TargetNotFound')]
+    assert summary(analyze(tree)) == summary(full_run(tmp_tree)[1])
+
+    shutil.move(str(bibendum), str(tree.base / 'moved'))
+    watcher.update({tree.base})
+    assert set(tree.files) == set(full_run(tmp_tree)[0].files)
+    assert summary(analyze(tree)) == summary(full_run(tmp_tree)[1])
+
+
+def test_monitor_directory_moved(tmp_tree):
+    """ After a directory is moved away, its new contents are reported at its new path. """
+
+    try:
+        monitor = InotifyMonitor(tmp_tree)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    purus = os.path.join(tmp_tree, 'purus')
+    os.rename(purus, os.path.join(tmp_tree, 'moved'))
+    assert purus in {str(p) for p in monitor.wait(5)}
+    with open(os.path.join(tmp_tree, 'moved', 'new.md'), 'w') as f:
+        f.write('# New\n')
+    assert {str(p) for p in monitor.wait(5)} == {os.path.join(tmp_tree, 'moved', 'new.md')}
+    monitor.close()
@@ -3,10 +3,12 @@
 
 from typing import Optional, Dict
 from pathlib import Path, PurePosixPath
+import os
 import re
 
 
-def href_to_path(found_in: Path, base_dir: Path, href: str) -> Path:
+def href_to_path(found_in: Path, base_dir: Path, href: str,
+                 aliases: Optional[Dict[str, str]] = None) -> Path:
     """Converts:
        - from a link target (aka href) as specified in markdown
        - to an absolute Path on disk.
@@ -14,26 +16,41 @@ def href_to_path(found_in: Path, base_dir: Path, href: str) -> Path:
     found_in: the Path of the file containing the link.
     base_dir: the Path of the base directory of the markdown file tree.
     href: the target href as specified in the markdown link.
+    aliases: maps from the paths of symbolic links to the paths they resolve to.
 
     Absolute hrefs (/absolute/path.md) are resolved w.r.t. the base directory.
     Relative hrefs (relative/path.md) are resolved w.r.t. the containing file.
     Empty hrefs are considered the same target as the containing file itself.
+
+    The path is normalized lexically, without accessing the file system: "." and ".."
+    are applied component by component, and components which are symbolic links (as far
+    as `aliases` knows) are replaced with their targets, like the file system would.
+    `found_in` and `base_dir` must be resolved already.
     """
 
     if not href:
         # Markdown link was in the form: [text](#anchor)
-        ret = found_in
+        return found_in
+
+    # There may be a better check for absolute href
+    if href[0:1] == '/':
+        # Link is in the form of [text](/absolute/path.md)
+        path = str(base_dir)
+        href = href[1:]
     else:
-        # There may be a better check for absolute href
-        abs_ = (href[0:1] == '/')
-        if abs_:
-            # Link is in the form of [text](/absolute/path.md)
-            ret = base_dir.joinpath(href[1:]).resolve()
+        # Link is in the form of [text](relative/path.md)
+        path = os.path.dirname(str(found_in))
+
+    for part in href.split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..':
+            path = os.path.dirname(path)
         else:
-            # Link is in the form of [text](relative/path.md)
-            ret = found_in.parent.joinpath(href).resolve()
-
-    return ret
+            path = os.path.join(path, part)
+            if aliases:
+                path = aliases.get(path, path)
+    return Path(path)
 
 
 def path_to_href(path: Path, relative_to: Path) -> Optional[str]:
@@ -0,0 +1,332 @@
+"""Watch mode: keep the model of a markdown tree in memory, and re-check only what a change
+to the tree could have affected.
+
+When a file changes, only that file is scanned again, and only these links are checked:
+- the links in the file itself;
+- the links in other files that point at the file (or at its anchors).
+"""
+
+
+import ctypes
+import ctypes.util
+import functools
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from mdtools import util
+from mdtools.model import read_md_file, read_md_text
+from mdtools.model.walk import Walker, iter_walk, ignore_paths
+from mdtools.model.cache import ParseCache
+from mdtools.model.tree import Tree, Link
+from mdtools.issues import analyze, issues
+
+
+# -----------------------------------------------------------------------------
+# Change monitors. `wait` blocks until something changes in the tree (or until the timeout
+# runs out), and returns the paths of the files and directories that were created, modified
+# or deleted. If the monitor lost track of the changes, the base of the tree is among them:
+# the whole tree must be scanned again.
+#
+# The directories for which `excluded` (if given) returns True, such as those the walker of
+# the tree excluded (see `Walker.excluded`), are not watched.
+
+
+def _pruned(dir_: str, dirs: List[str], excluded: Optional[Callable[[Path], bool]]
+            ) -> List[str]:
+    """The subdirectories `dirs` of `dir_` to watch."""
+    return [d for d in dirs if d not in ignore_paths
+            and not (excluded and excluded(Path(dir_, d)))]
+
+
+class PollMonitor:
+    """Detects changes by periodically scanning the modification times of all files."""
+
+    base:     Path
+    interval: float
+
+    def __init__(self, base: Path, interval: float = 0.5,
+                 excluded: Optional[Callable[[Path], bool]] = None) -> None:
+        self.base = base
+        self.interval = interval
+        self.__excluded = excluded
+        self.__state = self.__scan()
+
+    def __scan(self) -> Dict[str, Tuple[int, int]]:
+        state = {}
+        for dir_, dirs, files in os.walk(self.base, topdown=True):
+            dirs[:] = _pruned(dir_, dirs, self.__excluded)
+            for name in dirs + files:
+                path = os.path.join(dir_, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """See the comment above."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self.__scan()
+            changed = {p for p in state.keys() | self.__state.keys()
+                       if state.get(p) != self.__state.get(p)}
+            self.__state = state
+            if changed:
+                return {Path(p) for p in changed}
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        """Release the resources of the monitor."""
+
+
+class InotifyMonitor:
+    """Detects changes using Linux inotify. Raises OSError if inotify is not available."""
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+    IN_CLOEXEC     = 0o2000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE)
+
+    # Time to wait for more events after the first one, so that a save is reported once.
+    settle = 0.05
+
+    base: Path
+
+    def __init__(self, base: Path, excluded: Optional[Callable[[Path], bool]] = None) -> None:
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        self.__libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.__libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.__fd = self.__libc.inotify_init1(self.IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__dirs: Dict[int, str] = {}
+        self.__excluded = excluded
+        self.base = base
+        self.__add_tree(str(base))
+
+    def __add_tree(self, top: str) -> List[str]:
+        """Watch `top` and all directories below it. Return all paths below `top`."""
+        found: List[str] = []
+        if top != str(self.base) and self.__excluded and self.__excluded(Path(top)):
+            return found
+        for dir_, dirs, files in os.walk(top, topdown=True):
+            dirs[:] = _pruned(dir_, dirs, self.__excluded)
+            wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(dir_), self.MASK)
+            if wd >= 0:
+                self.__dirs[wd] = dir_
+            found += [os.path.join(dir_, name) for name in dirs + files]
+        return found
+
+    def __remove_tree(self, top: str) -> None:
+        """Stop watching `top` and the directories below it (deleted, or moved away)."""
+        prefix = os.path.join(top, '')
+        for wd, dir_ in list(self.__dirs.items()):
+            if dir_ == top or dir_.startswith(prefix):
+                del self.__dirs[wd]
+                self.__libc.inotify_rm_watch(self.__fd, wd)
+
+    def __read(self) -> Set[str]:
+        changed = set()
+        buf = os.read(self.__fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = struct.unpack_from('iIII', buf, offset)
+            offset += 16
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost: report everything, and watch any new directories
+                changed.add(str(self.base))
+                changed.update(self.__add_tree(str(self.base)))
+                continue
+            if mask & self.IN_IGNORED:
+                # The watch is gone (its directory was deleted, or its file system unmounted)
+                self.__dirs.pop(wd, None)
+                continue
+            dir_ = self.__dirs.get(wd)
+            if dir_ is None or not name or name in ignore_paths:
+                continue
+            path = os.path.join(dir_, name)
+            changed.add(path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                changed.update(self.__add_tree(path))
+            elif mask & self.IN_ISDIR and mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self.__remove_tree(path)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """See the comment above."""
+        changed: Set[str] = set()
+        if select.select([self.__fd], [], [], timeout)[0]:
+            changed = self.__read()
+            while select.select([self.__fd], [], [], self.settle)[0]:
+                changed |= self.__read()
+        return {Path(p) for p in changed}
+
+    def close(self) -> None:
+        """Release the resources of the monitor."""
+        os.close(self.__fd)
+
+
+def make_monitor(tree: Tree, walker: Optional[Walker] = None):
+    """Create the best change monitor available on this system, for `tree`. walker: the
+    walker the tree was populated with; the directories it excluded are not watched.
+    """
+    excluded = functools.partial(walker.excluded, tree) if walker else None
+    try:
+        return InotifyMonitor(tree.base, excluded)
+    except (OSError, AttributeError):
+        return PollMonitor(tree.base, excluded=excluded)
+
+
+# -----------------------------------------------------------------------------
+
+
+class Watcher:
+    """Keeps a markdown tree model up to date, and re-checks the links affected by changes."""
+
+    tree:    Tree
+    cache:   Optional[ParseCache]
+    walker:  Optional[Walker]
+
+    def __init__(self, tree: Tree, cache: Optional[ParseCache] = None,
+                 walker: Optional[Walker] = None) -> None:
+        """tree: a tree populated by `read_md_tree`.
+        walker: the walker the tree was populated with; changes to the paths it excluded
+            are ignored.
+        """
+        self.tree = tree
+        self.cache = cache
+        self.walker = walker
+
+    def update(self, changed: Set[Path], texts: Optional[Dict[Path, str]] = None
+               ) -> List[issues.Issue]:
+        """Bring the model up to date with the changed paths (created, modified or deleted
+        files and directories). Return the issues of the links the changes could affect.
+        A deleted directory removes all the files below it from the model; if the base of
+        the tree is among the changed paths, the whole tree is scanned again.
+
+        texts: the contents of some of the changed markdown files, by resolved path, to use
+            instead of what is on the disk (e.g. unsaved changes in an editor).
+        """
+
+        tree = self.tree
+        anchor_names: Set[str] = set()
+        affected: Set[Path] = set()
+
+        resolved = {self.__resolve(path) for path in changed}
+        if tree.base in resolved:
+            # Lost track of the changes: every path, in the model or on the disk, may have
+            # changed (the walk is into another tree, as it registers the paths it finds)
+            resolved.discard(tree.base)
+            found = Tree(str(tree.base))
+            for _ in iter_walk(found, self.walker):
+                pass
+            resolved.update(tree.files, found.files)
+        else:
+            # The files below the deleted directories are deleted too
+            gone = tuple(os.path.join(str(path), '') for path in resolved
+                         if path in tree.files and not path.exists())
+            if gone:
+                resolved.update(path for path in tree.files if str(path).startswith(gone))
+
+        for path in sorted(resolved):
+            exists = path.exists()
+            text = texts.get(path) if texts else None
+            exists = exists or text is not None
+            if self.walker and self.walker.excluded(tree, path):
+                continue
+
+            if path in tree.files:
+                old = tree.files[path]
+                anchor_names.update(old.anchors, old.h_anchors)
+                if exists:
+                    tree.reset_file(path)
+                else:
+                    tree.remove_file(path)
+            elif exists:
+                tree.on_file(path)
+            else:
+                continue
+
+            affected.add(path)
+            if text is not None:
+                read = read_md_text(tree, path, text)
+            else:
+                read = exists and path.suffix == '.md' and path.is_file() and \
+                    read_md_file(tree, path, self.cache, 'scan')
+            if read:
+                new = tree.files[path]
+                anchor_names.update(new.anchors, new.h_anchors)
+
+        tree.update_all_anchors(anchor_names)
+
+        # Links in the changed files, and links pointing at them
+        links: Dict[int, Tuple[Path, Link]] = {}
+        for path in sorted(affected):
+            if path in tree.files:
+                for link in tree.files[path].links:
+                    links[id(link)] = (path, link)
+            for path_link in tree.links_to(path):
+                links[id(path_link[1])] = path_link
+
+        return analyze(tree, links.values(), [path for path in sorted(affected)
+                                              if path in tree.files])
+
+    @staticmethod
+    def __resolve(path: Path) -> Path:
+        """Resolve `path`, which may not exist anymore, as far as possible."""
+        if path.exists():
+            return path.resolve()
+        if path.parent.exists():
+            return path.parent.resolve().joinpath(path.name)
+        return path
+
+
+def watch(tree: Tree, report, cache: Optional[ParseCache] = None,
+          walker: Optional[Walker] = None) -> None:
+    """Watch the tree for changes until interrupted, and report the issues of the affected
+    links after each change.
+
+    tree: a tree populated by `read_md_tree`.
+    report: called with the list of issues after each change.
+    walker: the walker the tree was populated with (see `Watcher`).
+    """
+
+    watcher = Watcher(tree, cache, walker)
+    monitor = make_monitor(tree, walker)
+    print(util.clr("GREY") + "Watching " + str(tree.base) + " (Ctrl+C to stop)" + util.clr(""))
+    try:
+        while True:
+            changed = monitor.wait()
+            if not changed:
+                continue
+            start = time.monotonic()
+            found = watcher.update(changed)
+            report(found)
+            print(util.clr("GREY") + "Checked {} change(s) in {:.0f} ms".format(
+                len(changed), (time.monotonic() - start) * 1000) + util.clr(""))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
@@ -17,6 +17,8 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'mdlinkcheck=mdtools.linkcheck:main',
+            'mdlinkd=mdtools.server:main',
+            'mdmv=mdtools.mv:main',
         ],
     },
     classifiers=[